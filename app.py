@@ -12,7 +12,7 @@ Security rewrite:
   * FLASK_DEBUG=1 is refused unless bound to 127.0.0.1.
 """
 
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, Response, request, jsonify, send_from_directory, session
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -24,14 +24,29 @@ import math
 import os
 import logging
 import base64
+import bisect
+import concurrent.futures
+import contextlib
+import multiprocessing
 import hashlib
 import hmac
+import http.client
+import importlib
+import importlib.util
+import sqlite3
+import io
+import itertools
 import secrets as py_secrets
+import struct
+import sys
+import threading
 import time
-import urllib.request
-import urllib.error
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Sequence
 from urllib.parse import urlparse
 
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
@@ -70,6 +85,16 @@ MAX_REQUEST_SIZE = int(os.environ.get('MAX_REQUEST_SIZE', str(1 * 1024 * 1024)))
 MAX_HISTORY_RECORDS = int(os.environ.get('MAX_HISTORY_RECORDS', '200'))
 MAX_HISTORY_USERS = int(os.environ.get('MAX_HISTORY_USERS', '1000'))
 PQC_SERVICE_URL = os.environ.get('PQC_SERVICE_URL', 'http://localhost:5001')
+# Content-addressed cache of /api/generate_encryption results. 0 disables.
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '512'))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '600'))
+# Where /api/history lives: memory (per worker), sqlite (shared file) or redis.
+HISTORY_BACKEND = os.environ.get('HISTORY_BACKEND', 'memory').strip().lower()
+HISTORY_SQLITE_PATH = os.environ.get('HISTORY_SQLITE_PATH', '/tmp/fold-history.sqlite3')
+# /api/batch/* limits: body size, records per request, scrypt runs per request.
+BATCH_MAX_REQUEST_SIZE = int(os.environ.get('BATCH_MAX_REQUEST_SIZE', str(8 * 1024 * 1024)))
+BATCH_MAX_RECORDS = int(os.environ.get('BATCH_MAX_RECORDS', '50000'))
+BATCH_MAX_DERIVATIONS = int(os.environ.get('BATCH_MAX_DERIVATIONS', '16'))
 
 # Reverse-proxy / limiter configuration
 TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
@@ -179,11 +204,6 @@ limiter = Limiter(
     **_limiter_kwargs,
 )
 
-# Per-user history storage. Keyed by a server-minted session id when available,
-# falling back to a per-IP hash. The previous "per-user" claim that was really
-# per-IP is now enforced by the session cookie path.
-encryption_records_by_user: "dict[str, list[dict]]" = {}
-
 ALLOWED_GATE_TYPES = frozenset({'AND', 'OR', 'XOR', 'NOT', 'NAND', 'NOR', 'BUFFER'})
 ALLOWED_CARD_TYPES = frozenset({
     'processor', 'memory', 'io', 'custom', 'network',
@@ -211,6 +231,10 @@ def _sign(payload: bytes) -> str:
     return hmac.new(_SIGNING_KEY, payload, hashlib.sha256).hexdigest()
 
 
+def _verify_signature(payload: bytes, signature) -> bool:
+    return isinstance(signature, str) and hmac.compare_digest(_sign(payload), signature)
+
+
 # ---------------------------------------------------------------------------
 # Security helpers — auth
 # ---------------------------------------------------------------------------
@@ -276,8 +300,29 @@ def _safe_float(val, default=0.0):
     return f
 
 
+def _clean_float(val):
+    """_safe_float without the try/except for ints and finite floats."""
+    if type(val) is float:
+        return val if val - val == 0.0 else 0.0
+    if type(val) is int:
+        return float(val)
+    return _safe_float(val)
+
+
+def _clean_ids(val):
+    """Up to 16 string ids, each cut to 64 chars. Anything but a list is []."""
+    if not isinstance(val, list):
+        return []
+    return [c if len(c) <= 64 else c[:64] for c in val[:16] if isinstance(c, str)]
+
+
 def validate_circuit_data(data):
-    """Validate and sanitize incoming circuit data. Returns (cleaned, error)."""
+    """Validate and sanitize incoming circuit data. Returns (cleaned, error).
+
+    Single pass over the cards. Finite float coordinates (the common case)
+    are copied without calling _clean_float, whose `x - x == 0.0` test is
+    the same finiteness check as math.isfinite.
+    """
     if not isinstance(data, dict):
         return None, 'Request body must be a JSON object'
     cards = data.get('cards')
@@ -286,80 +331,95 @@ def validate_circuit_data(data):
     if len(cards) > MAX_CARDS:
         return None, f'Too many cards (max {MAX_CARDS})'
 
+    clean_float = _clean_float
+    clean_ids = _clean_ids
     cleaned_cards = []
     for idx, card in enumerate(cards):
         if not isinstance(card, dict):
             return None, f'Card at index {idx} is not an object'
+        get = card.get
 
-        card_type = str(card.get('type', 'basic'))
+        card_type = get('type', 'basic')
+        if type(card_type) is not str:
+            card_type = str(card_type)
         if card_type not in ALLOWED_CARD_TYPES:
             card_type = 'basic'
 
-        color = str(card.get('color', 'gray'))[:20]
-
-        raw_nodes = card.get('nodes', [])
-        if not isinstance(raw_nodes, list):
-            raw_nodes = []
+        raw = get('nodes')
         nodes = []
-        for node in raw_nodes[:MAX_NODES_PER_CARD]:
-            if isinstance(node, dict):
-                nodes.append({
-                    'id': str(node.get('id', ''))[:64],
-                    'x': _safe_float(node.get('x', 0)),
-                    'y': _safe_float(node.get('y', 0)),
-                    'type': str(node.get('type', 'input'))[:20],
-                    'connections': [str(c)[:64] for c in node.get('connections', [])[:16] if isinstance(c, str)],
-                })
-
-        raw_conns = card.get('matrixConnections', [])
-        if not isinstance(raw_conns, list):
-            raw_conns = []
+        if isinstance(raw, list):
+            for node in raw[:MAX_NODES_PER_CARD]:
+                if isinstance(node, dict):
+                    g = node.get
+                    x = g('x', 0)
+                    y = g('y', 0)
+                    nodes.append({
+                        'id': str(g('id', ''))[:64],
+                        'x': x if type(x) is float and x - x == 0.0 else clean_float(x),
+                        'y': y if type(y) is float and y - y == 0.0 else clean_float(y),
+                        'type': str(g('type', 'input'))[:20],
+                        'connections': clean_ids(g('connections')),
+                    })
+
+        raw = get('matrixConnections')
         connections = []
-        for conn in raw_conns[:64]:
-            if isinstance(conn, dict) and conn.get('active'):
-                connections.append({
-                    'id': str(conn.get('id', ''))[:64],
-                    'active': True,
-                    'fromX': _safe_float(conn.get('fromX', 0)),
-                    'fromY': _safe_float(conn.get('fromY', 0)),
-                    'toX': _safe_float(conn.get('toX', 0)),
-                    'toY': _safe_float(conn.get('toY', 0)),
-                })
-
-        raw_mesh = card.get('meshInteractionPoints', [])
-        if not isinstance(raw_mesh, list):
-            raw_mesh = []
+        if isinstance(raw, list):
+            for conn in raw[:64]:
+                if isinstance(conn, dict) and conn.get('active'):
+                    g = conn.get
+                    x0 = g('fromX', 0)
+                    y0 = g('fromY', 0)
+                    x1 = g('toX', 0)
+                    y1 = g('toY', 0)
+                    connections.append({
+                        'id': str(g('id', ''))[:64],
+                        'active': True,
+                        'fromX': x0 if type(x0) is float and x0 - x0 == 0.0 else clean_float(x0),
+                        'fromY': y0 if type(y0) is float and y0 - y0 == 0.0 else clean_float(y0),
+                        'toX': x1 if type(x1) is float and x1 - x1 == 0.0 else clean_float(x1),
+                        'toY': y1 if type(y1) is float and y1 - y1 == 0.0 else clean_float(y1),
+                    })
+
+        raw = get('meshInteractionPoints')
         mesh_points = []
-        for pt in raw_mesh[:32]:
-            if isinstance(pt, dict):
-                mesh_points.append({
-                    'id': str(pt.get('id', ''))[:64],
-                    'x': _safe_float(pt.get('x', 0)),
-                    'y': _safe_float(pt.get('y', 0)),
-                    'upConnections': [str(c)[:64] for c in pt.get('upConnections', [])[:16] if isinstance(c, str)],
-                    'downConnections': [str(c)[:64] for c in pt.get('downConnections', [])[:16] if isinstance(c, str)],
-                })
-
-        raw_gates = card.get('logicGates', [])
-        if not isinstance(raw_gates, list):
-            raw_gates = []
+        if isinstance(raw, list):
+            for pt in raw[:32]:
+                if isinstance(pt, dict):
+                    g = pt.get
+                    x = g('x', 0)
+                    y = g('y', 0)
+                    mesh_points.append({
+                        'id': str(g('id', ''))[:64],
+                        'x': x if type(x) is float and x - x == 0.0 else clean_float(x),
+                        'y': y if type(y) is float and y - y == 0.0 else clean_float(y),
+                        'upConnections': clean_ids(g('upConnections')),
+                        'downConnections': clean_ids(g('downConnections')),
+                    })
+
+        raw = get('logicGates')
         logic_gates = []
-        for gate in raw_gates[:16]:
-            if isinstance(gate, dict):
-                gate_type = str(gate.get('type', 'BUFFER'))
-                if gate_type not in ALLOWED_GATE_TYPES:
-                    gate_type = 'BUFFER'
-                logic_gates.append({
-                    'id': str(gate.get('id', ''))[:64],
-                    'type': gate_type,
-                    'x': _safe_float(gate.get('x', 0)),
-                    'y': _safe_float(gate.get('y', 0)),
-                })
+        if isinstance(raw, list):
+            for gate in raw[:16]:
+                if isinstance(gate, dict):
+                    g = gate.get
+                    gate_type = g('type', 'BUFFER')
+                    if type(gate_type) is not str:
+                        gate_type = str(gate_type)
+                    if gate_type not in ALLOWED_GATE_TYPES:
+                        gate_type = 'BUFFER'
+                    x = g('x', 0)
+                    y = g('y', 0)
+                    logic_gates.append({
+                        'id': str(g('id', ''))[:64],
+                        'type': gate_type,
+                        'x': x if type(x) is float and x - x == 0.0 else clean_float(x),
+                        'y': y if type(y) is float and y - y == 0.0 else clean_float(y),
+                    })
 
         cleaned_cards.append({
-            'id': str(card.get('id', f'card-{idx}'))[:64],
+            'id': str(get('id', f'card-{idx}'))[:64],
             'type': card_type,
-            'color': color,
+            'color': str(get('color', 'gray'))[:20],
             'nodes': nodes,
             'matrixConnections': connections,
             'meshInteractionPoints': mesh_points,
@@ -400,10 +460,59 @@ def add_security_headers(response):
 # so that ciphertexts produced under one circuit cannot be decrypted under
 # another even with the same password.
 # ---------------------------------------------------------------------------
-_CIPHER_MAGIC = b'FOLD2'  # version prefix for wire format
+_CIPHER_MAGIC = b'FOLD2'  # single-shot format (default for encrypt())
+_SESSION_MAGIC = b'FOLD3'  # master key + per-message HKDF subkey
+_STREAM_MAGIC = b'FOLDS'  # segmented streaming format (encrypt_stream)
 _SCRYPT_N = int(os.environ.get('SCRYPT_N', str(2 ** 15)))
 _SCRYPT_R = 8
 _SCRYPT_P = 1
+# FOLD2 blobs do not record their scrypt cost; they were always written with
+# the static SCRYPT_N, so decrypt keeps using it even after calibration.
+_FOLD2_SCRYPT_N = _SCRYPT_N
+
+# Optional startup calibration: benchmark scrypt on this host and use the
+# largest power-of-two N that meets SCRYPT_TARGET_MS and SCRYPT_MAX_MEMORY
+# (never below SCRYPT_MIN_N). Replaces SCRYPT_N for new ciphertexts.
+SCRYPT_CALIBRATE = os.environ.get('SCRYPT_CALIBRATE', '0') == '1'
+SCRYPT_TARGET_MS = float(os.environ.get('SCRYPT_TARGET_MS', '100'))
+SCRYPT_MAX_MEMORY = int(os.environ.get('SCRYPT_MAX_MEMORY', str(64 * 1024 * 1024)))
+SCRYPT_MIN_N = int(os.environ.get('SCRYPT_MIN_N', str(2 ** 14)))
+
+# Format encrypt()/encrypt_raw() write: 'fold2' (the default, readable by
+# every deployed version) or 'fold3' (records its scrypt cost, so calibrated
+# N takes effect). Switch to fold3 only once every reader decrypts FOLD3.
+CIPHER_WRITE_FORMAT = os.environ.get('CIPHER_WRITE_FORMAT', 'fold2').strip().lower()
+if CIPHER_WRITE_FORMAT not in ('fold2', 'fold3'):
+    raise ValueError(f"CIPHER_WRITE_FORMAT must be 'fold2' or 'fold3', not {CIPHER_WRITE_FORMAT!r}")
+
+# Opt-in derived-key cache (see DerivedKeyCache). 0 disables it.
+KDF_CACHE_SIZE = int(os.environ.get('KDF_CACHE_SIZE', '0'))
+KDF_CACHE_TTL = float(os.environ.get('KDF_CACHE_TTL', '300'))
+
+# Where scrypt runs: 'sync' (inline, the library default), 'thread' or
+# 'process' (bounded pool, so one slow derivation does not stall the worker;
+# scrypt holds the GIL, so only 'process' frees the worker's other threads).
+KDF_EXECUTOR = os.environ.get('KDF_EXECUTOR', 'sync').strip().lower()
+KDF_WORKERS = int(os.environ.get('KDF_WORKERS', '2'))
+KDF_MAX_PENDING = int(os.environ.get('KDF_MAX_PENDING', '8'))
+KDF_TIMEOUT = float(os.environ.get('KDF_TIMEOUT', '10'))
+# Per-process ceiling on memory held by in-flight scrypt calls, and how many
+# callers may wait for room before new ones are rejected with 503.
+KDF_MEMORY_BUDGET = int(os.environ.get('KDF_MEMORY_BUDGET', str(128 * 1024 * 1024)))
+KDF_MAX_QUEUE = int(os.environ.get('KDF_MAX_QUEUE', '16'))
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+_STREAM_MAX_CHUNK_SIZE = 1 << 24
+_STREAM_NONCE_PREFIX_LEN = 7
+# magic(5) || kdf(3) || master_salt(16) || msg_salt(16) || nonce(12)
+_SESSION_HEADER_LEN = len(_SESSION_MAGIC) + 3 + 16 + 16 + 12
+# magic(5) || kdf(3) || salt(16) || nonce_prefix(7) || chunk_size(4)
+_STREAM_HEADER_LEN = len(_STREAM_MAGIC) + 3 + 16 + _STREAM_NONCE_PREFIX_LEN + 4
+_GCM_TAG_LEN = 16
+# encrypt_many derives one message subkey per block of this many records and
+# gives each record a random 96-bit nonce under it, far below the 2**32
+# random-nonce limit for a single AES-GCM key.
+_BATCH_KEY_BLOCK = 1024
 
 
 def _canonical_info(circuit_params: dict) -> bytes:
@@ -411,6 +520,530 @@ def _canonical_info(circuit_params: dict) -> bytes:
     return json.dumps(circuit_params, sort_keys=True, separators=(',', ':')).encode()
 
 
+def _pack_kdf_params(n: int, r: int, p: int) -> bytes:
+    """Encode scrypt (N, r, p) as log2(N) || r || p for ciphertext headers."""
+    return bytes((n.bit_length() - 1, r, p))
+
+
+def _unpack_kdf_params(raw: bytes) -> "tuple[int, int, int]":
+    """Decode and bound-check scrypt parameters read from a ciphertext header.
+
+    Only the r and p the encryptor writes are accepted, and N may not exceed
+    _SCRYPT_MAX_N, so the header cannot ask for more memory per derivation
+    than SCRYPT_MAX_MEMORY allows.
+    """
+    log2_n, r, p = raw[0], raw[1], raw[2]
+    n = 1 << log2_n
+    if not (1 <= log2_n and n <= _SCRYPT_MAX_N and r == _SCRYPT_R and p == _SCRYPT_P):
+        raise ValueError('Unsupported KDF parameters in ciphertext')
+    return n, r, p
+
+
+def _b64_blob(ciphertext) -> bytes:
+    if isinstance(ciphertext, str):
+        ciphertext = ciphertext.encode('ascii')
+    return base64.b64decode(ciphertext)
+
+
+def _decode_plaintext(pt: bytes):
+    try:
+        return pt.decode('utf-8')
+    except UnicodeDecodeError:
+        return pt
+
+
+def _parse_session_blob(blob: memoryview):
+    """Split a FOLD3 blob into (kdf, master_salt, msg_salt, nonce, ct).
+
+    The header fields are small copies; ct is a memoryview slice of `blob`.
+    """
+    if len(blob) < _SESSION_HEADER_LEN + _GCM_TAG_LEN:
+        raise ValueError('Ciphertext too short')
+    off = len(_SESSION_MAGIC)
+    kdf = _unpack_kdf_params(blob[off:off + 3])
+    master_salt = bytes(blob[off + 3:off + 19])
+    msg_salt = bytes(blob[off + 19:off + 35])
+    nonce = bytes(blob[off + 35:off + 47])
+    return kdf, master_salt, msg_salt, nonce, blob[off + 47:]
+
+
+def _byte_view(data) -> memoryview:
+    """Flat unsigned-byte memoryview over any bytes-like object."""
+    view = memoryview(data)
+    return view if view.format == 'B' and view.ndim == 1 else view.cast('B')
+
+
+def _plaintext_into(pt: bytes, out) -> int:
+    """Copy `pt` into the caller's writable buffer; return its length.
+
+    AESGCM has no decrypt-into API, so this is one copy of the plaintext
+    (sized and checked before decrypting, see _check_out_buffer).
+    """
+    _byte_view(out)[:len(pt)] = pt
+    return len(pt)
+
+
+def _check_out_buffer(out, ct: memoryview) -> None:
+    view = _byte_view(out)
+    if view.readonly:
+        raise TypeError('out must be a writable buffer')
+    if len(view) < len(ct) - _GCM_TAG_LEN:
+        raise ValueError(f'out buffer too small: need {len(ct) - _GCM_TAG_LEN} bytes')
+
+
+class DerivedKeyCache:
+    """Bounded LRU + TTL cache of derived keys for CircuitEncryption.
+
+    Entries are indexed by HMAC-SHA256 under a per-process random key over
+    (label, circuit info, kdf params, salt, password), so neither the raw
+    password nor an offline-crackable hash of it is kept in memory. Cached
+    keys live in bytearrays that are overwritten on eviction, expiry and
+    clear(). TTL is measured from insertion; hits do not extend it.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 300.0,
+                 clock=time.monotonic):
+        if max_entries < 1:
+            raise ValueError('max_entries must be >= 1')
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._index_key = os.urandom(32)
+        self._entries: "OrderedDict[bytes, tuple[float, bytearray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._derive_seconds = 0.0
+
+    def _index(self, password: bytes, salt: bytes, info: bytes, kdf, label: bytes) -> bytes:
+        h = hmac.new(self._index_key, digestmod=hashlib.sha256)
+        for part in (label, info, _pack_kdf_params(*kdf), salt, password):
+            h.update(len(part).to_bytes(4, 'big'))
+            h.update(part)
+        return h.digest()
+
+    @staticmethod
+    def _wipe(buf: bytearray) -> None:
+        for i in range(len(buf)):
+            buf[i] = 0
+
+    def _drop(self, index: bytes) -> None:
+        _, buf = self._entries.pop(index)
+        self._wipe(buf)
+        self.evictions += 1
+
+    def get_or_derive(self, password: bytes, salt: bytes, info: bytes, kdf,
+                      label: bytes, derive) -> bytes:
+        """Return the cached key or call `derive()` and remember its result."""
+        index = self._index(password, salt, info, kdf, label)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(index)
+            if entry is not None:
+                if now - entry[0] < self.ttl_seconds:
+                    self._entries.move_to_end(index)
+                    self.hits += 1
+                    return bytes(entry[1])
+                self._drop(index)
+            self.misses += 1
+
+        started = time.perf_counter()
+        key = derive()
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._derive_seconds += elapsed
+            for stale in [k for k, (t, _) in self._entries.items()
+                          if now - t >= self.ttl_seconds]:
+                self._drop(stale)
+            if index in self._entries:
+                self._drop(index)
+            self._entries[index] = (now, bytearray(key))
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+        return key
+
+    def clear(self) -> None:
+        with self._lock:
+            for index in list(self._entries):
+                self._drop(index)
+
+    def stats(self) -> dict:
+        """Counters for monitoring; saved_seconds estimates scrypt time avoided."""
+        with self._lock:
+            avg = self._derive_seconds / self.misses if self.misses else 0.0
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'avg_derive_ms': round(avg * 1000, 3),
+                'saved_seconds': round(self.hits * avg, 3),
+            }
+
+
+_DEFAULT_KEY_CACHE = (
+    DerivedKeyCache(KDF_CACHE_SIZE, KDF_CACHE_TTL) if KDF_CACHE_SIZE > 0 else None
+)
+
+
+class KdfUnavailableError(RuntimeError):
+    """A key derivation could not be scheduled or did not finish in time.
+    Routes translate this into 503 with a Retry-After header."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _scrypt(password: bytes, salt: bytes, n: int, r: int, p: int) -> bytes:
+    """Module-level (picklable) scrypt used inline and by the KDF pools."""
+    return Scrypt(salt=salt, length=32, n=n, r=r, p=p).derive(password)
+
+
+def scrypt_memory_cost(n: int, r: int, p: int) -> int:
+    """Approximate peak scrypt memory in bytes: V (128*r*N) + B (128*r*p) + XY (256*r)."""
+    return 128 * r * n + 128 * r * p + 256 * r
+
+
+def calibrate_scrypt_n(target_ms: float, max_memory: int, r: int = _SCRYPT_R,
+                       p: int = _SCRYPT_P, min_n: int = 2 ** 14,
+                       max_n: int = 2 ** 20, samples: int = 2) -> int:
+    """Return the largest power-of-two N (min_n <= N <= max_n) whose scrypt
+    run takes at most `target_ms` on this host and whose memory cost fits in
+    `max_memory`. `min_n` is a security floor and is returned even when it
+    misses the target. Each candidate is timed `samples` times (best-of)."""
+    if min_n < 2 or min_n & (min_n - 1):
+        raise ValueError('min_n must be a power of two >= 2')
+    best = min_n
+    n = min_n
+    while n <= max_n and scrypt_memory_cost(n, r, p) <= max_memory:
+        elapsed = min(_time_scrypt(n, r, p) for _ in range(max(1, samples)))
+        if elapsed * 1000 > target_ms:
+            break
+        best = n
+        n *= 2
+    return best
+
+
+def _time_scrypt(n: int, r: int, p: int) -> float:
+    started = time.perf_counter()
+    _scrypt(b'fold-calibration', os.urandom(16), n, r, p)
+    return time.perf_counter() - started
+
+
+class KdfAdmission:
+    """Per-process memory budget for concurrent scrypt calls.
+
+    acquire() blocks FIFO until the caller's cost fits under `budget_bytes`,
+    or fails fast with KdfUnavailableError when `max_queue` callers are
+    already waiting. A single call larger than the whole budget is rejected
+    outright: it could never fit, and admitting it would let one crafted
+    ciphertext header exceed the budget.
+    """
+
+    def __init__(self, budget_bytes: int, max_queue: int = 16):
+        self.budget_bytes = budget_bytes
+        self.max_queue = max(0, max_queue)
+        self._cond = threading.Condition()
+        self._in_use = 0
+        self._running = 0
+        self._waiters: "deque[object]" = deque()
+        self._avg_hold = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _fits(self, cost: int) -> bool:
+        return self._in_use + cost <= self.budget_bytes
+
+    def _retry_after(self) -> int:
+        per_slot = self._avg_hold or 0.1
+        waves = (len(self._waiters) + 1) / max(1, self._running)
+        return max(1, math.ceil(per_slot * waves))
+
+    def acquire(self, cost: int, timeout: "float | None" = None) -> float:
+        """Reserve `cost` bytes; returns a token to pass back to release()."""
+        with self._cond:
+            if cost > self.budget_bytes:
+                self.rejected += 1
+                raise KdfUnavailableError('Key derivation cost exceeds the memory budget')
+            if not self._waiters and self._fits(cost):
+                return self._admit(cost)
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise KdfUnavailableError('Key derivation memory budget exhausted',
+                                          retry_after=self._retry_after())
+            ticket = object()
+            self._waiters.append(ticket)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                while not (self._waiters[0] is ticket and self._fits(cost)):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.timeouts += 1
+                        raise KdfUnavailableError('Timed out waiting for key derivation memory',
+                                                  retry_after=self._retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+            return self._admit(cost)
+
+    def _admit(self, cost: int) -> float:
+        self._in_use += cost
+        self._running += 1
+        self.admitted += 1
+        return time.monotonic()
+
+    def release(self, cost: int, token: float) -> None:
+        held = time.monotonic() - token
+        with self._cond:
+            self._in_use -= cost
+            self._running -= 1
+            self._avg_hold = held if not self._avg_hold else 0.8 * self._avg_hold + 0.2 * held
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'budget_bytes': self.budget_bytes,
+                'in_use_bytes': self._in_use,
+                'running': self._running,
+                'waiting': len(self._waiters),
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
+
+
+_KDF_ADMISSION = KdfAdmission(KDF_MEMORY_BUDGET, KDF_MAX_QUEUE) if KDF_MEMORY_BUDGET > 0 else None
+
+
+class KdfExecutor:
+    """Runs scrypt inline ('sync') or on a bounded thread/process pool.
+
+    Prefer 'process': pyca/cryptography holds the GIL for the duration of
+    scrypt, so 'thread' only bounds concurrency and does not let other
+    request threads run meanwhile.
+
+    'process' workers are started with forkserver (spawn where forkserver is
+    unavailable), never forked from a threaded gunicorn worker, and run
+    hashlib.scrypt so the child never imports this module. A pool broken by
+    a crashed child is replaced on the next derivation.
+
+    At most `max_pending` derivations may be queued or running; further
+    submissions fail fast with KdfUnavailableError instead of piling up.
+    A derivation that outlives `timeout` is abandoned by the caller but keeps
+    its pending slot until the pool finishes it. With an `admission`
+    budget, each derivation first reserves its scrypt memory cost and gives
+    it back when the work (not the caller) finishes. The pool is created lazily
+    and re-created after fork, so it is safe to build at import time under
+    gunicorn.
+    """
+
+    MODES = ('sync', 'thread', 'process')
+
+    def __init__(self, mode: str = 'sync', max_workers: int = 2,
+                 max_pending: int = 8, timeout: float = 10.0,
+                 admission: "KdfAdmission | None" = None):
+        if mode not in self.MODES:
+            raise ValueError(f'KDF executor mode must be one of {self.MODES}, got {mode!r}')
+        self.mode = mode
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout
+        self.admission = admission
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _get_pool(self):
+        pid = os.getpid()
+        if self._pool_pid != pid:
+            # Futures of the parent's pool never complete in this process.
+            self._pool = None
+            self._pending = 0
+        if self._pool is None:
+            if self.mode == 'process':
+                methods = multiprocessing.get_all_start_methods()
+                ctx = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._pool = concurrent.futures.ProcessPoolExecutor(self.max_workers, mp_context=ctx)
+            else:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix='kdf')
+            self._pool_pid = pid
+        return self._pool
+
+    def _discard_pool(self, pool) -> None:
+        """Drop a pool whose worker process died and let _get_pool build a new one."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.warning('KDF process pool broken; it will be recreated')
+
+    def _pool_submit(self, pool, password: bytes, salt: bytes, n: int, r: int, p: int):
+        if self.mode == 'process':
+            return pool.submit(hashlib.scrypt, password, salt=salt, n=n, r=r, p=p,
+                               maxmem=scrypt_memory_cost(n, r, p) + (1 << 20), dklen=32)
+        return pool.submit(_scrypt, password, salt, n, r, p)
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    def submit(self, password: bytes, salt: bytes, n: int, r: int, p: int):
+        """Queue a derivation and return its Future (pool modes only)."""
+        cost = scrypt_memory_cost(n, r, p)
+        token = self.admission.acquire(cost, self.timeout) if self.admission else None
+        try:
+            with self._lock:
+                pool = self._get_pool()
+                if self._pending >= self.max_pending:
+                    self.rejected += 1
+                    raise KdfUnavailableError('Key derivation queue is full')
+                self._pending += 1
+            try:
+                try:
+                    future = self._pool_submit(pool, password, salt, n, r, p)
+                except concurrent.futures.BrokenExecutor:
+                    self._discard_pool(pool)
+                    with self._lock:
+                        pool = self._get_pool()
+                    future = self._pool_submit(pool, password, salt, n, r, p)
+            except Exception:
+                with self._lock:
+                    self._pending -= 1
+                raise
+        except Exception:
+            if token is not None:
+                self.admission.release(cost, token)
+            raise
+        future.add_done_callback(self._release)
+        if token is not None:
+            future.add_done_callback(lambda _f: self.admission.release(cost, token))
+        return future
+
+    def derive(self, password: bytes, salt: bytes, n: int, r: int, p: int) -> bytes:
+        if self.mode == 'sync':
+            if self.admission is None:
+                return _scrypt(password, salt, n, r, p)
+            cost = scrypt_memory_cost(n, r, p)
+            token = self.admission.acquire(cost, self.timeout)
+            try:
+                return _scrypt(password, salt, n, r, p)
+            finally:
+                self.admission.release(cost, token)
+        future = self.submit(password, salt, n, r, p)
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.BrokenExecutor:
+            # The next submit() sees the broken pool and replaces it.
+            raise KdfUnavailableError('Key derivation worker crashed', retry_after=1)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise KdfUnavailableError('Key derivation timed out',
+                                      retry_after=max(1, math.ceil(self.timeout)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'workers': self.max_workers,
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_DEFAULT_KDF_EXECUTOR = KdfExecutor(
+    KDF_EXECUTOR, KDF_WORKERS, KDF_MAX_PENDING, KDF_TIMEOUT, admission=_KDF_ADMISSION,
+)
+
+# Upper bound on the scrypt N accepted from a ciphertext header: the largest
+# power of two whose cost fits SCRYPT_MAX_MEMORY, and never below SCRYPT_N.
+# It comes from configuration, not calibration, so every worker and host
+# accepts the same blobs while a crafted header still cannot make a decrypt
+# allocate more than the operator allowed.
+_SCRYPT_MAX_N = max(_SCRYPT_N, 2)
+while scrypt_memory_cost(_SCRYPT_MAX_N * 2, _SCRYPT_R, _SCRYPT_P) <= SCRYPT_MAX_MEMORY:
+    _SCRYPT_MAX_N *= 2
+
+if SCRYPT_CALIBRATE:
+    _calibration_ceiling = SCRYPT_MAX_MEMORY
+    if KDF_MEMORY_BUDGET > 0:
+        _calibration_ceiling = min(_calibration_ceiling, KDF_MEMORY_BUDGET)
+    _calibration_started = time.perf_counter()
+    _SCRYPT_N = calibrate_scrypt_n(SCRYPT_TARGET_MS, _calibration_ceiling, min_n=SCRYPT_MIN_N)
+    logger.info(
+        'scrypt calibrated to N=2**%d (target %.0f ms, ceiling %d bytes) in %.2fs',
+        _SCRYPT_N.bit_length() - 1, SCRYPT_TARGET_MS, _calibration_ceiling,
+        time.perf_counter() - _calibration_started,
+    )
+
+if _KDF_ADMISSION is not None and scrypt_memory_cost(_SCRYPT_N, _SCRYPT_R, _SCRYPT_P) > KDF_MEMORY_BUDGET:
+    logger.warning(
+        'SCRYPT_N=%d needs %d bytes per derivation, more than KDF_MEMORY_BUDGET=%d; '
+        'every encrypt and decrypt will be rejected',
+        _SCRYPT_N, scrypt_memory_cost(_SCRYPT_N, _SCRYPT_R, _SCRYPT_P), KDF_MEMORY_BUDGET,
+    )
+
+
+class _ChunkReader:
+    """Pull exact-size blocks out of a file-like object or an iterable of
+    bytes. Buffers at most one block plus one source piece."""
+
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        self._read = getattr(source, 'read', None)
+        self._pieces = None if self._read is not None else iter(source)
+        self._buf = bytearray()
+        self._eof = False
+
+    def _next_piece(self, want: int) -> bytes:
+        if self._read is not None:
+            return self._read(want)
+        piece = next(self._pieces, b'')
+        if isinstance(piece, str):
+            piece = piece.encode('utf-8')
+        return piece
+
+    def read(self, n: int) -> bytes:
+        """Return exactly `n` bytes, or fewer only once the source is exhausted."""
+        while len(self._buf) < n and not self._eof:
+            piece = self._next_piece(n - len(self._buf))
+            if not piece:
+                self._eof = True
+                break
+            self._buf += piece
+        out = bytes(self._buf[:n])
+        del self._buf[:n]
+        return out
+
+
 class CircuitEncryption:
     """Authenticated encryption keyed from a user password and circuit params.
 
@@ -418,70 +1051,437 @@ class CircuitEncryption:
         CircuitEncryption(circuit_params: dict | None = None)
         .encrypt(plaintext: str | bytes, password: str | bytes) -> bytes (base64)
         .decrypt(ciphertext: str | bytes, password: str | bytes) -> str | bytes
-
-    Wire format (after base64 decode):
-        magic(5) || salt(16) || nonce(12) || aesgcm_ciphertext_and_tag(rest)
+        .encrypt_raw(plaintext, password) -> bytes (binary FOLD2/FOLD3 blob)
+        .decrypt_raw(blob: bytes-like, password, out=None) -> bytes | int
+        .encrypt_many(plaintexts, password, raw=False) -> list[bytes]
+        .decrypt_many(ciphertexts, password, raw=False, return_exceptions=False,
+                      max_derivations=None) -> list
+        .encrypt_stream(source, password, chunk_size=None) -> Iterator[bytes]
+        .decrypt_stream(source, password) -> Iterator[bytes]
+        .open_session(password, salt=None) -> CircuitKeySession
+
+    Pass `key_cache=DerivedKeyCache(...)` to memoize scrypt results (or set
+    KDF_CACHE_SIZE to enable a process-wide default cache), and
+    `kdf_executor=KdfExecutor(...)` to run scrypt off the calling thread.
+    Without either, scrypt runs inline exactly as before.
+
+    encrypt()/decrypt() are base64 wrappers around encrypt_raw()/decrypt_raw(),
+    which services storing raw bytes should call directly.
+
+    Wire format (after base64 decode), written by sessions and encrypt_many,
+    and by encrypt() when CIPHER_WRITE_FORMAT=fold3:
+        FOLD3 || kdf(3) || master_salt(16) || msg_salt(16) || nonce(12) || ct
+    kdf records log2(N), r, p so decrypt always uses the scrypt cost the data
+    was written with. The master key is scrypt(password, master_salt); each
+    message key is HKDF(master, salt=msg_salt). encrypt() uses a fresh master
+    salt per call; a session reuses one master across many messages.
     The circuit parameters are used as HKDF info AND AES-GCM AAD.
+
+    Single-shot wire format, written by encrypt() by default
+    (CIPHER_WRITE_FORMAT=fold2) so instances that predate FOLD3 can read it:
+        FOLD2 || salt(16) || nonce(12) || aesgcm_ciphertext_and_tag(rest)
+    derived with the static SCRYPT_N, since the blob does not record it.
+
+    Streaming wire format (raw bytes, no base64):
+        FOLDS || kdf(3) || salt(16) || nonce_prefix(7) || chunk_size(4)
+        followed by segments of aesgcm(chunk) (chunk_size + 16 bytes each,
+        the last one possibly shorter). Segment i uses the nonce
+        nonce_prefix || i(4, big-endian) || last_flag(1), and every segment
+        authenticates the header and the circuit params as AAD, so
+        reordering, truncation and cross-circuit splicing are all rejected.
     """
 
-    def __init__(self, circuit_params: "dict | None" = None):
+    def __init__(self, circuit_params: "dict | None" = None,
+                 key_cache: "DerivedKeyCache | None" = None,
+                 kdf_executor: "KdfExecutor | None" = None):
         self.circuit_params = dict(circuit_params or {})
         self._info = _canonical_info(self.circuit_params)
+        self._key_cache = key_cache if key_cache is not None else _DEFAULT_KEY_CACHE
+        self._kdf_executor = kdf_executor or _DEFAULT_KDF_EXECUTOR
 
     # -- key derivation -----------------------------------------------------
-    def _derive_key(self, password, salt: bytes) -> bytes:
+    def _derive_key(self, password, salt: bytes, kdf=None,
+                    label: bytes = b'fold-circuit-v2|') -> bytes:
         if isinstance(password, str):
             password = password.encode('utf-8')
-        base = Scrypt(
-            salt=salt,
-            length=32,
-            n=_SCRYPT_N,
-            r=_SCRYPT_R,
-            p=_SCRYPT_P,
-        ).derive(password)
+        kdf = kdf or (_SCRYPT_N, _SCRYPT_R, _SCRYPT_P)
+        if self._key_cache is not None:
+            return self._key_cache.get_or_derive(
+                password, salt, self._info, kdf, label,
+                lambda: self._derive_key_uncached(password, salt, kdf, label),
+            )
+        return self._derive_key_uncached(password, salt, kdf, label)
+
+    def _derive_key_uncached(self, password: bytes, salt: bytes, kdf,
+                             label: bytes) -> bytes:
+        base = self._kdf_executor.derive(password, salt, *kdf)
         # Mix circuit params into the key via HKDF so that changing the
         # circuit changes the effective key (domain separation).
         return HKDF(
             algorithm=hashes.SHA256(),
             length=32,
             salt=salt,
-            info=b'fold-circuit-v2|' + self._info,
+            info=label + self._info,
         ).derive(base)
 
     # -- encryption ---------------------------------------------------------
     def encrypt(self, plaintext, password) -> bytes:
-        if isinstance(plaintext, str):
-            plaintext = plaintext.encode('utf-8')
-        salt = os.urandom(16)
-        nonce = os.urandom(12)
-        key = self._derive_key(password, salt)
-        ct = AESGCM(key).encrypt(nonce, plaintext, self._info)
-        return base64.b64encode(_CIPHER_MAGIC + salt + nonce + ct)
+        return base64.b64encode(self.encrypt_raw(plaintext, password))
+
+    def encrypt_raw(self, plaintext, password) -> bytes:
+        """encrypt() without the base64 layer."""
+        if CIPHER_WRITE_FORMAT == 'fold2':
+            if isinstance(plaintext, str):
+                plaintext = plaintext.encode('utf-8')
+            salt = os.urandom(16)
+            nonce = os.urandom(12)
+            key = self._derive_key(password, salt, (_FOLD2_SCRYPT_N, _SCRYPT_R, _SCRYPT_P))
+            ct = AESGCM(key).encrypt(nonce, plaintext, self._info)
+            return _CIPHER_MAGIC + salt + nonce + ct
+        with self.open_session(password) as session:
+            return session.encrypt_raw(plaintext)
+
+    def _message_key(self, master_key, msg_salt: bytes) -> bytes:
+        """Cheap per-message subkey for the FOLD3 session format."""
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=msg_salt,
+            info=b'fold-message-v3|' + self._info,
+        ).derive(master_key)
 
     # -- decryption ---------------------------------------------------------
     def decrypt(self, ciphertext, password):
-        if isinstance(ciphertext, str):
-            ciphertext = ciphertext.encode('ascii')
-        blob = base64.b64decode(ciphertext)
-        if len(blob) < len(_CIPHER_MAGIC) + 16 + 12 + 16:
+        return _decode_plaintext(self.decrypt_raw(_b64_blob(ciphertext), password))
+
+    def decrypt_raw(self, blob, password, out=None):
+        """Decrypt a binary FOLD3 (or legacy FOLD2) blob.
+
+        `blob` may be bytes, bytearray or memoryview; the header is parsed
+        from memoryview slices and the ciphertext is never copied before
+        AES-GCM. Returns the plaintext bytes, or — if `out` (a writable
+        buffer of at least len(ciphertext) - 16 bytes) is given — writes the
+        plaintext into it and returns the number of bytes written.
+        """
+        blob = _byte_view(blob)
+        if blob[:len(_SESSION_MAGIC)] == _SESSION_MAGIC:
+            kdf, master_salt, msg_salt, nonce, ct = _parse_session_blob(blob)
+            if out is not None:
+                _check_out_buffer(out, ct)
+            master = self._derive_key(password, master_salt, kdf, label=b'fold-master-v3|')
+            key = self._message_key(master, msg_salt)
+        else:
+            if len(blob) < len(_CIPHER_MAGIC) + 16 + 12 + 16:
+                raise ValueError('Ciphertext too short')
+            if blob[:len(_CIPHER_MAGIC)] != _CIPHER_MAGIC:
+                raise ValueError('Unsupported ciphertext format')
+            off = len(_CIPHER_MAGIC)
+            salt = bytes(blob[off:off + 16])
+            nonce = bytes(blob[off + 16:off + 28])
+            ct = blob[off + 28:]
+            if out is not None:
+                _check_out_buffer(out, ct)
+            key = self._derive_key(password, salt, (_FOLD2_SCRYPT_N, _SCRYPT_R, _SCRYPT_P))
+        pt = AESGCM(key).decrypt(nonce, ct, self._info)
+        return pt if out is None else _plaintext_into(pt, out)
+
+    # -- batches ------------------------------------------------------------
+    def encrypt_many(self, plaintexts, password, raw: bool = False) -> list:
+        """Encrypt many records under one password with a single scrypt run.
+
+        Equivalent to [encrypt(p, password) for p in plaintexts] (or
+        encrypt_raw with raw=True), and every output decrypts on its own.
+        """
+        with self.open_session(password) as session:
+            return session.encrypt_many(plaintexts, raw=raw)
+
+    def decrypt_many(self, ciphertexts, password, raw: bool = False,
+                     return_exceptions: bool = False,
+                     max_derivations: "int | None" = None) -> list:
+        """Decrypt many blobs, deriving each distinct master key only once.
+
+        Blobs are grouped by (kdf, master salt), so a batch produced by
+        encrypt_many or one session costs a single scrypt run, and each
+        message subkey is derived once per group. Inputs are base64 (as from
+        encrypt) unless raw=True, in which case they are bytes-like and the
+        outputs are bytes. With return_exceptions=True a bad item yields its
+        exception in place instead of aborting the batch. max_derivations
+        caps the scrypt runs one batch may trigger; items needing more fail
+        with ValueError.
+        """
+        masters: dict = {}
+        aeads: dict = {}
+        results = []
+        for item in ciphertexts:
+            try:
+                blob = _byte_view(item if raw else _b64_blob(item))
+                if blob[:len(_SESSION_MAGIC)] == _SESSION_MAGIC:
+                    kdf, master_salt, msg_salt, nonce, ct = _parse_session_blob(blob)
+                    group = (kdf, master_salt)
+                    aead = aeads.get(group + (msg_salt,))
+                    if aead is None:
+                        if group not in masters:
+                            if max_derivations is not None and len(masters) >= max_derivations:
+                                raise ValueError('Too many distinct keys in batch')
+                            masters[group] = self._derive_key(
+                                password, master_salt, kdf, label=b'fold-master-v3|')
+                        aead = aeads[group + (msg_salt,)] = AESGCM(
+                            self._message_key(masters[group], msg_salt))
+                else:
+                    if len(blob) < len(_CIPHER_MAGIC) + 16 + 12 + 16:
+                        raise ValueError('Ciphertext too short')
+                    if blob[:len(_CIPHER_MAGIC)] != _CIPHER_MAGIC:
+                        raise ValueError('Unsupported ciphertext format')
+                    off = len(_CIPHER_MAGIC)
+                    salt = bytes(blob[off:off + 16])
+                    nonce = bytes(blob[off + 16:off + 28])
+                    ct = blob[off + 28:]
+                    aead = aeads.get(salt)
+                    if aead is None:
+                        if max_derivations is not None and len(masters) >= max_derivations:
+                            raise ValueError('Too many distinct keys in batch')
+                        masters[salt] = self._derive_key(
+                            password, salt, (_FOLD2_SCRYPT_N, _SCRYPT_R, _SCRYPT_P))
+                        aead = aeads[salt] = AESGCM(masters[salt])
+                pt = aead.decrypt(nonce, ct, self._info)
+                results.append(pt if raw else _decode_plaintext(pt))
+            except (ValueError, TypeError, InvalidTag) as exc:
+                if not return_exceptions:
+                    raise
+                results.append(exc)
+        return results
+
+    # -- sessions -----------------------------------------------------------
+    def open_session(self, password, salt: "bytes | None" = None) -> "CircuitKeySession":
+        """Run scrypt once and return a session that encrypts many messages
+        with per-message HKDF subkeys. Pass a persisted `salt` to reopen the
+        same long-term master key later."""
+        salt = os.urandom(16) if salt is None else bytes(salt)
+        if len(salt) != 16:
+            raise ValueError('Session salt must be 16 bytes')
+        kdf = (_SCRYPT_N, _SCRYPT_R, _SCRYPT_P)
+        master = self._derive_key(password, salt, kdf, label=b'fold-master-v3|')
+        return CircuitKeySession(self, master, salt, kdf)
+
+    # -- streaming ----------------------------------------------------------
+    def encrypt_stream(self, source, password, chunk_size: "int | None" = None):
+        """Encrypt `source` (file-like, bytes, or iterable of bytes/str chunks)
+        into a generator of raw ciphertext pieces. Memory use is bounded by
+        `chunk_size` regardless of the input length."""
+        chunk_size = _STREAM_CHUNK_SIZE if chunk_size is None else int(chunk_size)
+        if not 1 <= chunk_size <= _STREAM_MAX_CHUNK_SIZE:
+            raise ValueError(f'chunk_size must be in 1..{_STREAM_MAX_CHUNK_SIZE}')
+        kdf = (_SCRYPT_N, _SCRYPT_R, _SCRYPT_P)
+        salt = os.urandom(16)
+        prefix = os.urandom(_STREAM_NONCE_PREFIX_LEN)
+        header = (_STREAM_MAGIC + _pack_kdf_params(*kdf) + salt + prefix
+                  + struct.pack('>I', chunk_size))
+        aead = AESGCM(self._derive_key(password, salt, kdf, label=b'fold-stream-v1|'))
+        aad = header + self._info
+        yield header
+
+        reader = _ChunkReader(source)
+        block = reader.read(chunk_size)
+        counter = 0
+        while True:
+            nxt = reader.read(chunk_size) if len(block) == chunk_size else b''
+            last = not nxt
+            yield aead.encrypt(_stream_nonce(prefix, counter, last), block, aad)
+            if last:
+                return
+            counter += 1
+            block = nxt
+
+    def decrypt_stream(self, source, password):
+        """Decrypt a FOLDS stream, yielding plaintext chunks as bytes.
+
+        Each chunk is authenticated before it is yielded, but a truncated
+        stream is only detected when the generator is exhausted — callers
+        must not act on the output until iteration completes without error.
+        """
+        reader = _ChunkReader(source)
+        header = reader.read(_STREAM_HEADER_LEN)
+        if len(header) < _STREAM_HEADER_LEN:
             raise ValueError('Ciphertext too short')
-        if not blob.startswith(_CIPHER_MAGIC):
+        if not header.startswith(_STREAM_MAGIC):
             raise ValueError('Unsupported ciphertext format')
-        off = len(_CIPHER_MAGIC)
-        salt = blob[off:off + 16]
-        nonce = blob[off + 16:off + 28]
-        ct = blob[off + 28:]
-        key = self._derive_key(password, salt)
-        pt = AESGCM(key).decrypt(nonce, ct, self._info)
-        try:
-            return pt.decode('utf-8')
-        except UnicodeDecodeError:
-            return pt
+        off = len(_STREAM_MAGIC)
+        kdf = _unpack_kdf_params(header[off:off + 3])
+        salt = header[off + 3:off + 19]
+        prefix = header[off + 19:off + 19 + _STREAM_NONCE_PREFIX_LEN]
+        (chunk_size,) = struct.unpack('>I', header[-4:])
+        if not 1 <= chunk_size <= _STREAM_MAX_CHUNK_SIZE:
+            raise ValueError('Unsupported ciphertext format')
+        aead = AESGCM(self._derive_key(password, salt, kdf, label=b'fold-stream-v1|'))
+        aad = header + self._info
+
+        seg_len = chunk_size + _GCM_TAG_LEN
+        segment = reader.read(seg_len)
+        counter = 0
+        while True:
+            if len(segment) < _GCM_TAG_LEN:
+                raise ValueError('Truncated ciphertext stream')
+            nxt = reader.read(seg_len) if len(segment) == seg_len else b''
+            last = not nxt
+            yield aead.decrypt(_stream_nonce(prefix, counter, last), segment, aad)
+            if last:
+                return
+            counter += 1
+            segment = nxt
+
+
+class CircuitKeySession:
+    """Master key derived once from a password; see CircuitEncryption.open_session.
+
+    Every message gets a fresh 16-byte salt and HKDF subkey, so the per-call
+    cost is one HKDF + one AES-GCM instead of a full scrypt. Call close() (or
+    use as a context manager) to overwrite the master key when done.
+    """
+
+    def __init__(self, cipher: "CircuitEncryption", master_key: bytes,
+                 salt: bytes, kdf: "tuple[int, int, int]"):
+        self._cipher = cipher
+        self._master = bytearray(master_key)
+        self.salt = salt
+        self._kdf = kdf
+        self._header = _SESSION_MAGIC + _pack_kdf_params(*kdf) + salt
+
+    def encrypt(self, plaintext) -> bytes:
+        return base64.b64encode(self.encrypt_raw(plaintext))
+
+    def encrypt_raw(self, plaintext) -> bytes:
+        """encrypt() without the base64 layer."""
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode('utf-8')
+        msg_salt = os.urandom(16)
+        nonce = os.urandom(12)
+        key = self._cipher._message_key(self._live_master(), msg_salt)
+        ct = AESGCM(key).encrypt(nonce, plaintext, self._cipher._info)
+        return b''.join((self._header, msg_salt, nonce, ct))
+
+    def encrypt_many(self, plaintexts, raw: bool = False) -> list:
+        """encrypt() (or encrypt_raw() with raw=True) over many records.
+
+        One message subkey and AESGCM context serve each block of
+        _BATCH_KEY_BLOCK records, with a random nonce per record, so the
+        per-record cost is one AES-GCM call.
+        """
+        items = [p.encode('utf-8') if isinstance(p, str) else p for p in plaintexts]
+        master = self._live_master()
+        info = self._cipher._info
+        out = []
+        for start in range(0, len(items), _BATCH_KEY_BLOCK):
+            block = items[start:start + _BATCH_KEY_BLOCK]
+            msg_salt = os.urandom(16)
+            encrypt = AESGCM(self._cipher._message_key(master, msg_salt)).encrypt
+            prefix = self._header + msg_salt
+            nonces = os.urandom(12 * len(block))
+            for i, plaintext in enumerate(block):
+                nonce = nonces[12 * i:12 * i + 12]
+                blob = b''.join((prefix, nonce, encrypt(nonce, plaintext, info)))
+                out.append(blob if raw else base64.b64encode(blob))
+        return out
+
+    def decrypt(self, ciphertext):
+        return _decode_plaintext(self.decrypt_raw(_b64_blob(ciphertext)))
+
+    def decrypt_raw(self, blob, out=None):
+        """Binary counterpart of decrypt(); see CircuitEncryption.decrypt_raw."""
+        blob = _byte_view(blob)
+        if blob[:len(_SESSION_MAGIC)] != _SESSION_MAGIC:
+            raise ValueError('Unsupported ciphertext format')
+        kdf, master_salt, msg_salt, nonce, ct = _parse_session_blob(blob)
+        if kdf != self._kdf or not hmac.compare_digest(master_salt, self.salt):
+            raise ValueError('Ciphertext was not produced under this session key')
+        if out is not None:
+            _check_out_buffer(out, ct)
+        key = self._cipher._message_key(self._live_master(), msg_salt)
+        pt = AESGCM(key).decrypt(nonce, ct, self._cipher._info)
+        return pt if out is None else _plaintext_into(pt, out)
+
+    def _live_master(self) -> bytearray:
+        if not self._master:
+            raise ValueError('Session is closed')
+        return self._master
+
+    def close(self) -> None:
+        for i in range(len(self._master)):
+            self._master[i] = 0
+        self._master = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _stream_nonce(prefix: bytes, counter: int, last: bool) -> bytes:
+    if counter >= 1 << 32:
+        raise ValueError('Stream too long for a single nonce prefix')
+    return prefix + counter.to_bytes(4, 'big') + (b'\x01' if last else b'\x00')
 
 
 # ---------------------------------------------------------------------------
 # Circuit analysis (unchanged semantics)
 # ---------------------------------------------------------------------------
+def _resolve_mesh_links(mesh_points: list, card_indices=None) -> "list[tuple[int, int, str]]":
+    """Resolve up/down mesh references to (from_pos, to_pos, direction).
+
+    Builds an id -> positions index once; each id's positions are already in
+    card order (points are collected card by card), so the "higher card" /
+    "lower card" filters are a bisect on a parallel card_index list. Output
+    order matches the original nested scan over all points: for each point,
+    its upConnections then downConnections, targets in stack order.
+
+    `card_indices`, if given, supplies each point's card index instead of a
+    'card_index' key on the point (used by the compact analysis).
+    """
+    if card_indices is None:
+        card_indices = [point.get('card_index') for point in mesh_points]
+    index: "dict[object, tuple[list[int], list[int]]]" = {}
+    for pos, point in enumerate(mesh_points):
+        positions, target_cards = index.setdefault(point.get('id'), ([], []))
+        positions.append(pos)
+        target_cards.append(card_indices[pos])
+
+    links = []
+    for pos, point in enumerate(mesh_points):
+        card_idx = card_indices[pos]
+        for up_id in point.get('upConnections', []):
+            entry = index.get(up_id)
+            if entry is not None:
+                start = bisect.bisect_right(entry[1], card_idx)
+                links.extend((pos, dst, 'up') for dst in entry[0][start:])
+        for down_id in point.get('downConnections', []):
+            entry = index.get(down_id)
+            if entry is not None:
+                end = bisect.bisect_left(entry[1], card_idx)
+                links.extend((pos, dst, 'down') for dst in entry[0][:end])
+    return links
+
+
+def _circuit_summary(cards: list, num_nodes: int, num_connections: int, num_mesh_points: int,
+                     num_mesh_connections: int, logic_gate_types: list) -> dict:
+    return {
+        'num_cards': len(cards),
+        'card_types': [card.get('type') for card in cards],
+        'card_colors': [card.get('color') for card in cards],
+        'num_nodes': num_nodes,
+        'num_connections': num_connections,
+        'num_mesh_points': num_mesh_points,
+        'num_mesh_connections': num_mesh_connections,
+        'num_logic_gates': len(logic_gate_types),
+        'logic_gate_types': logic_gate_types,
+        'complexity_score': (
+            len(cards) * 5
+            + num_connections * 2
+            + num_mesh_connections * 3
+            + len(logic_gate_types) * 4
+        ),
+    }
+
+
 def analyze_circuit(circuit_data):
     cards = circuit_data.get('cards', [])
     all_nodes, all_connections, all_mesh_points, all_logic_gates = [], [], [], []
@@ -499,35 +1499,15 @@ def analyze_circuit(circuit_data):
             all_logic_gates.extend([{**gate, 'card_id': card_id, 'card_index': idx}
                                     for gate in card.get('logicGates', [])])
 
-    mesh_connections = []
-    for point in all_mesh_points:
-        card_idx = point.get('card_index')
-        for up_id in point.get('upConnections', []):
-            for target_point in all_mesh_points:
-                if target_point.get('id') == up_id and target_point.get('card_index') > card_idx:
-                    mesh_connections.append({'from_point': point, 'to_point': target_point, 'direction': 'up'})
-        for down_id in point.get('downConnections', []):
-            for target_point in all_mesh_points:
-                if target_point.get('id') == down_id and target_point.get('card_index') < card_idx:
-                    mesh_connections.append({'from_point': point, 'to_point': target_point, 'direction': 'down'})
+    mesh_connections = [
+        {'from_point': all_mesh_points[src], 'to_point': all_mesh_points[dst], 'direction': direction}
+        for src, dst, direction in _resolve_mesh_links(all_mesh_points)
+    ]
 
-    circuit_summary = {
-        'num_cards': len(cards),
-        'card_types': [card.get('type') for card in cards],
-        'card_colors': [card.get('color') for card in cards],
-        'num_nodes': len(all_nodes),
-        'num_connections': len(all_connections),
-        'num_mesh_points': len(all_mesh_points),
-        'num_mesh_connections': len(mesh_connections),
-        'num_logic_gates': len(all_logic_gates),
-        'logic_gate_types': [gate.get('type') for gate in all_logic_gates],
-        'complexity_score': (
-            len(cards) * 5
-            + len(all_connections) * 2
-            + len(mesh_connections) * 3
-            + len(all_logic_gates) * 4
-        ),
-    }
+    circuit_summary = _circuit_summary(
+        cards, len(all_nodes), len(all_connections), len(all_mesh_points),
+        len(mesh_connections), [gate.get('type') for gate in all_logic_gates],
+    )
 
     return {
         'nodes': all_nodes,
@@ -539,7 +1519,138 @@ def analyze_circuit(circuit_data):
     }
 
 
-def derive_circuit_parameters(circuit_analysis: dict) -> dict:
+class _AnnotatedItems(Sequence):
+    """Read-only list view that materialises {**item, card_id, card_index}
+    dicts (the analyze_circuit shape) on access."""
+
+    __slots__ = ('_items', '_cards', '_card_ids')
+
+    def __init__(self, items: list, cards: array, card_ids: list):
+        self._items, self._cards, self._card_ids = items, cards, card_ids
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        card_index = self._cards[i]
+        return {**self._items[i], 'card_id': self._card_ids[card_index], 'card_index': card_index}
+
+
+class _MeshLinkItems(Sequence):
+    """Read-only list view of mesh connections in the analyze_circuit shape."""
+
+    __slots__ = ('_points', '_src', '_dst', '_up')
+
+    def __init__(self, points: _AnnotatedItems, src: array, dst: array, up: bytearray):
+        self._points, self._src, self._dst, self._up = points, src, dst, up
+
+    def __len__(self) -> int:
+        return len(self._src)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return {'from_point': self._points[self._src[i]], 'to_point': self._points[self._dst[i]],
+                'direction': 'up' if self._up[i] else 'down'}
+
+
+class CircuitAnalysis:
+    """Column-oriented result of analyze_circuit_compact.
+
+    Elements are kept as references to the (validated) input dicts plus a
+    card_index column per element kind; mesh connections are three parallel
+    columns of point positions and direction flags rather than pairs of
+    embedded point dicts. `summary` is identical to analyze_circuit's.
+    Indexing by the old keys ('nodes', 'mesh_connections', ...) returns lazy
+    views that build the old per-element dicts on access, and to_dict()
+    materialises the full old shape.
+    """
+
+    __slots__ = ('card_ids', 'node_items', 'node_cards', 'connection_items', 'connection_cards',
+                 'mesh_items', 'mesh_cards', 'gate_items', 'gate_cards',
+                 'link_src', 'link_dst', 'link_up', 'summary')
+
+    _VIEW_KEYS = ('nodes', 'connections', 'mesh_points', 'mesh_connections', 'logic_gates')
+
+    @property
+    def nodes(self) -> _AnnotatedItems:
+        return _AnnotatedItems(self.node_items, self.node_cards, self.card_ids)
+
+    @property
+    def connections(self) -> _AnnotatedItems:
+        return _AnnotatedItems(self.connection_items, self.connection_cards, self.card_ids)
+
+    @property
+    def mesh_points(self) -> _AnnotatedItems:
+        return _AnnotatedItems(self.mesh_items, self.mesh_cards, self.card_ids)
+
+    @property
+    def mesh_connections(self) -> _MeshLinkItems:
+        return _MeshLinkItems(self.mesh_points, self.link_src, self.link_dst, self.link_up)
+
+    @property
+    def logic_gates(self) -> _AnnotatedItems:
+        return _AnnotatedItems(self.gate_items, self.gate_cards, self.card_ids)
+
+    def __getitem__(self, key: str):
+        if key == 'summary' or key in self._VIEW_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def to_dict(self) -> dict:
+        """The analyze_circuit dict, fully materialised."""
+        result = {key: list(getattr(self, key)) for key in self._VIEW_KEYS}
+        result['summary'] = self.summary
+        return result
+
+
+def analyze_circuit_compact(circuit_data) -> CircuitAnalysis:
+    """analyze_circuit without per-element copies; see CircuitAnalysis."""
+    cards = circuit_data.get('cards', [])
+    analysis = CircuitAnalysis()
+    analysis.card_ids = []
+    analysis.node_items, analysis.node_cards = [], array('i')
+    analysis.connection_items, analysis.connection_cards = [], array('i')
+    analysis.mesh_items, analysis.mesh_cards = [], array('i')
+    analysis.gate_items, analysis.gate_cards = [], array('i')
+
+    for idx, card in enumerate(cards):
+        analysis.card_ids.append(card.get('id', f'unknown-{idx}'))
+        nodes = card.get('nodes', [])
+        analysis.node_items.extend(nodes)
+        analysis.node_cards.extend(itertools.repeat(idx, len(nodes)))
+        if 'matrixConnections' in card:
+            active = [conn for conn in card['matrixConnections'] if conn.get('active', False)]
+            analysis.connection_items.extend(active)
+            analysis.connection_cards.extend(itertools.repeat(idx, len(active)))
+        points = card.get('meshInteractionPoints', [])
+        analysis.mesh_items.extend(points)
+        analysis.mesh_cards.extend(itertools.repeat(idx, len(points)))
+        if 'logicGates' in card:
+            gates = card.get('logicGates', [])
+            analysis.gate_items.extend(gates)
+            analysis.gate_cards.extend(itertools.repeat(idx, len(gates)))
+
+    links = _resolve_mesh_links(analysis.mesh_items, analysis.mesh_cards)
+    analysis.link_src = array('I', [src for src, _, _ in links])
+    analysis.link_dst = array('I', [dst for _, dst, _ in links])
+    analysis.link_up = bytearray(direction == 'up' for _, _, direction in links)
+
+    analysis.summary = _circuit_summary(
+        cards, len(analysis.node_items), len(analysis.connection_items),
+        len(analysis.mesh_items), len(links),
+        [gate.get('type') for gate in analysis.gate_items],
+    )
+    return analysis
+
+
+def _kdf_description() -> str:
+    return 'scrypt(N=%d,r=%d,p=%d)+HKDF-SHA256' % (_SCRYPT_N, _SCRYPT_R, _SCRYPT_P)
+
+
+def derive_circuit_parameters(circuit_analysis: "dict | CircuitAnalysis") -> dict:
     """Compute a small, structured parameter object describing the circuit's
     contribution to the cipher. These values are *public* — the secret is the
     user's password. The parameters bind ciphertexts to a given circuit
@@ -555,7 +1666,7 @@ def derive_circuit_parameters(circuit_analysis: dict) -> dict:
     return {
         'version': 2,
         'algorithm': 'AES-256-GCM',
-        'kdf': 'scrypt(N=%d,r=%d,p=%d)+HKDF-SHA256' % (_SCRYPT_N, _SCRYPT_R, _SCRYPT_P),
+        'kdf': _kdf_description(),
         'circuit_seed': circuit_seed,
         'summary': {
             'num_cards': summary['num_cards'],
@@ -569,11 +1680,540 @@ def derive_circuit_parameters(circuit_analysis: dict) -> dict:
     }
 
 
-def create_encryption_from_analysis(circuit_analysis: dict) -> "CircuitEncryption":
+def create_encryption_from_analysis(circuit_analysis: "dict | CircuitAnalysis") -> "CircuitEncryption":
     """Factory used by tests and server code to build a configured cipher."""
     return CircuitEncryption(derive_circuit_parameters(circuit_analysis))
 
 
+# ---------------------------------------------------------------------------
+# Content-addressed result cache for /api/generate_encryption.
+# Keyed by a digest of the *validated* circuit, so reordered JSON keys or
+# fields that validation drops still hit. An optional Redis tier (REDIS_URL)
+# lets every gunicorn worker share results; Redis failures degrade to a miss.
+# ---------------------------------------------------------------------------
+class CircuitResultCache:
+    """LRU + TTL cache of {parameters, parameters_signature, analysis} dicts.
+
+    Cached values are shared between requests and must be treated as
+    read-only by callers.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 600.0,
+                 redis_client=None, namespace: str = 'fold:circuit-result:',
+                 clock=time.monotonic):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._redis = redis_client
+        self._namespace = namespace
+        self._clock = clock
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(cleaned: dict) -> str:
+        """Digest of the validated circuit plus the active KDF settings, since
+        the latter are embedded in the signed parameters, and a fingerprint of
+        the signing key, so a SECRET_KEY rotation stops serving old signatures
+        from shared entries."""
+        h = hashlib.sha256(b'fold-circuit-result-v1|')
+        h.update(_sign(b'fold-circuit-result-key-id').encode())
+        h.update(b'|')
+        h.update(_kdf_description().encode())
+        h.update(b'|')
+        h.update(_canonical_info(cleaned))
+        return h.hexdigest()
+
+    def get(self, key: str) -> "dict | None":
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(self._namespace + key)
+            except Exception:
+                logger.warning('Result cache: Redis GET failed', exc_info=True)
+                raw = None
+            value = None
+            if raw is not None:
+                try:
+                    value = json.loads(raw)
+                except ValueError:
+                    pass
+                if not isinstance(value, dict):
+                    logger.warning('Result cache: ignoring corrupt Redis entry %s', key)
+                    value = None
+            if value is not None:
+                self._remember(key, value, now)
+                with self._lock:
+                    self.shared_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: dict) -> None:
+        self._remember(key, value, self._clock())
+        if self._redis is not None:
+            try:
+                self._redis.set(self._namespace + key, json.dumps(value),
+                                ex=max(1, int(self.ttl_seconds)))
+            except Exception:
+                logger.warning('Result cache: Redis SET failed', exc_info=True)
+
+    def _remember(self, key: str, value: dict, now: float) -> None:
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'shared': self._redis is not None,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+            }
+
+
+def _redis_client():
+    """Return a Redis client for REDIS_URL, or None if unset/unavailable."""
+    if not REDIS_URL:
+        return None
+    try:
+        import redis
+    except ImportError:
+        logger.warning('REDIS_URL is set but the redis package is not installed; '
+                       'shared caches fall back to per-worker memory.')
+        return None
+    return redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+
+_RESULT_CACHE = (
+    CircuitResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, redis_client=_redis_client())
+    if RESULT_CACHE_SIZE > 0 else None
+)
+
+
+# ---------------------------------------------------------------------------
+# Per-user history storage. Keyed by a server-minted session id when available,
+# falling back to a per-IP hash. Every backend keeps at most
+# MAX_HISTORY_RECORDS per user (oldest dropped first) and at most
+# MAX_HISTORY_USERS users (least recently written dropped first), with O(1)
+# work per append. Only the sqlite and redis backends are shared between
+# gunicorn workers and survive worker recycling.
+# ---------------------------------------------------------------------------
+def _history_aggregates(count: int, complexity_sum: float, complexity_max, distinct_seeds: int) -> dict:
+    return {
+        'count': count,
+        'mean_complexity': complexity_sum / count if count else 0.0,
+        'max_complexity': complexity_max if count else 0,
+        'distinct_seeds': distinct_seeds,
+    }
+
+
+class _HistoryBucket:
+    __slots__ = ('records', 'next_seq', 'count', 'complexity_sum', 'complexity_max', 'seeds')
+
+    def __init__(self, max_records: int):
+        self.records: deque = deque(maxlen=max_records)
+        self.next_seq = 0
+        self.count = 0
+        self.complexity_sum = 0.0
+        self.complexity_max = None
+        self.seeds: set = set()
+
+
+class MemoryHistoryStore:
+    """Per-process history: an LRU OrderedDict of bounded deques.
+
+    Every stored record gets a per-user ``seq`` (0, 1, 2, ...) used as the
+    pagination cursor. Aggregates are running totals over everything the
+    user has generated, not just the retained window.
+    """
+
+    backend = 'memory'
+
+    def __init__(self, max_records: int = MAX_HISTORY_RECORDS,
+                 max_users: int = MAX_HISTORY_USERS):
+        self.max_records = max(1, max_records)
+        self.max_users = max(1, max_users)
+        self._users: "OrderedDict[str, _HistoryBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def append(self, user_id: str, record: dict) -> int:
+        complexity = record.get('complexity', 0)
+        with self._lock:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                bucket = self._users[user_id] = _HistoryBucket(self.max_records)
+            else:
+                self._users.move_to_end(user_id)
+            seq = bucket.next_seq
+            bucket.next_seq += 1
+            bucket.records.append(dict(record, seq=seq))
+            bucket.count += 1
+            bucket.complexity_sum += complexity
+            if bucket.complexity_max is None or complexity > bucket.complexity_max:
+                bucket.complexity_max = complexity
+            if record.get('circuit_seed') is not None:
+                bucket.seeds.add(record['circuit_seed'])
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return seq
+
+    def latest_seq(self, user_id: str) -> int:
+        with self._lock:
+            bucket = self._users.get(user_id)
+            return bucket.next_seq - 1 if bucket is not None else -1
+
+    def page(self, user_id: str, after: int = -1, since: "float | None" = None,
+             limit: "int | None" = None) -> list:
+        """Records with seq > after (and timestamp > since), oldest first."""
+        with self._lock:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                return []
+            first_seq = bucket.next_seq - len(bucket.records)
+            selected = itertools.islice(bucket.records, max(0, after + 1 - first_seq), None)
+            if since is not None:
+                selected = (r for r in selected if r['timestamp'] > since)
+            return list(itertools.islice(selected, limit))
+
+    def records(self, user_id: str) -> list:
+        return self.page(user_id)
+
+    def aggregates(self, user_id: str) -> dict:
+        with self._lock:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                return _history_aggregates(0, 0.0, None, 0)
+            return _history_aggregates(bucket.count, bucket.complexity_sum,
+                                       bucket.complexity_max, len(bucket.seeds))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'backend': self.backend, 'users': len(self._users)}
+
+
+class SqliteHistoryStore:
+    """History in a WAL-mode SQLite file shared by every worker on the host.
+
+    Records carry a per-user sequence number, so trimming deletes exactly one
+    row by primary key, and the user count and per-user aggregates live in
+    rows updated on append instead of being recomputed. Connections are per
+    thread and per process.
+
+    The layout version is kept in PRAGMA user_version. Files from the first
+    layout (version 1, written before aggregates and timestamps existed) are
+    migrated in place on open; their aggregates are rebuilt from the records
+    still retained.
+    """
+
+    backend = 'sqlite'
+    SCHEMA_VERSION = 2
+
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS history_users ('
+        ' user_id TEXT PRIMARY KEY, last_used INTEGER NOT NULL,'
+        ' next_seq INTEGER NOT NULL, count INTEGER NOT NULL,'
+        ' complexity_sum REAL NOT NULL, complexity_max REAL NOT NULL,'
+        ' distinct_seeds INTEGER NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS history_users_last_used'
+        ' ON history_users (last_used)',
+        'CREATE TABLE IF NOT EXISTS history_records ('
+        ' user_id TEXT NOT NULL, seq INTEGER NOT NULL, ts REAL NOT NULL,'
+        ' record TEXT NOT NULL, PRIMARY KEY (user_id, seq)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS history_seeds ('
+        ' user_id TEXT NOT NULL, seed TEXT NOT NULL,'
+        ' PRIMARY KEY (user_id, seed)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS history_meta ('
+        ' key TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+        "INSERT OR IGNORE INTO history_meta VALUES ('users', 0), ('clock', 0)",
+    )
+
+    def __init__(self, path: str = HISTORY_SQLITE_PATH,
+                 max_records: int = MAX_HISTORY_RECORDS,
+                 max_users: int = MAX_HISTORY_USERS):
+        self.path = path
+        self.max_records = max(1, max_records)
+        self.max_users = max(1, max_users)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with self._transaction(conn):
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version == 0 and conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'history_records'").fetchone():
+                version = 1
+            if version > self.SCHEMA_VERSION:
+                raise RuntimeError(f'{path} has history schema version {version}, '
+                                   f'newer than this build ({self.SCHEMA_VERSION})')
+            if version == 1:
+                self._migrate_v1(conn)
+            for statement in self._SCHEMA:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+
+    def _migrate_v1(self, conn: sqlite3.Connection) -> None:
+        """Rebuild version-1 tables (no aggregates, no ts column) in the current layout."""
+        conn.execute('DROP INDEX IF EXISTS history_users_last_used')
+        conn.execute('ALTER TABLE history_users RENAME TO history_users_v1')
+        conn.execute('ALTER TABLE history_records RENAME TO history_records_v1')
+        for statement in self._SCHEMA:
+            conn.execute(statement)
+        users = conn.execute('SELECT user_id, last_used, next_seq FROM history_users_v1').fetchall()
+        for user_id, last_used, next_seq in users:
+            count, complexity_sum, complexity_max, seeds = 0, 0.0, 0, set()
+            rows = conn.execute('SELECT seq, record FROM history_records_v1 '
+                                'WHERE user_id = ? ORDER BY seq', (user_id,)).fetchall()
+            for seq, raw in rows:
+                record = json.loads(raw)
+                complexity = record.get('complexity', 0)
+                complexity_max = complexity if not count else max(complexity_max, complexity)
+                count += 1
+                complexity_sum += complexity
+                if record.get('circuit_seed') is not None:
+                    seeds.add(str(record['circuit_seed']))
+                conn.execute('INSERT INTO history_records VALUES (?, ?, ?, ?)',
+                             (user_id, seq, record.get('timestamp', 0.0),
+                              json.dumps(dict(record, seq=seq), separators=(',', ':'))))
+            conn.execute('INSERT INTO history_users VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (user_id, last_used, next_seq, count, complexity_sum,
+                          complexity_max, len(seeds)))
+            conn.executemany('INSERT INTO history_seeds VALUES (?, ?)',
+                             [(user_id, seed) for seed in seeds])
+        conn.execute('DROP TABLE history_records_v1')
+        conn.execute('DROP TABLE history_users_v1')
+        logger.info('Migrated %s to history schema version %d (%d users)',
+                    self.path, self.SCHEMA_VERSION, len(users))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _transaction(conn: sqlite3.Connection):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def append(self, user_id: str, record: dict) -> int:
+        complexity = record.get('complexity', 0)
+        seed = record.get('circuit_seed')
+        conn = self._conn()
+        with self._transaction(conn):
+            clock = conn.execute(
+                "UPDATE history_meta SET value = value + 1 WHERE key = 'clock' "
+                'RETURNING value').fetchone()[0]
+            row = conn.execute(
+                'UPDATE history_users SET last_used = ?, next_seq = next_seq + 1,'
+                ' count = count + 1, complexity_sum = complexity_sum + ?,'
+                ' complexity_max = max(complexity_max, ?) '
+                'WHERE user_id = ? RETURNING next_seq',
+                (clock, complexity, complexity, user_id)).fetchone()
+            if row is None:
+                conn.execute('INSERT INTO history_users VALUES (?, ?, 1, 1, ?, ?, 0)',
+                             (user_id, clock, complexity, complexity))
+                users = conn.execute(
+                    "UPDATE history_meta SET value = value + 1 WHERE key = 'users' "
+                    'RETURNING value').fetchone()[0]
+                seq = 0
+            else:
+                users = None
+                seq = row[0] - 1
+            if seed is not None:
+                added = conn.execute('INSERT OR IGNORE INTO history_seeds VALUES (?, ?)',
+                                     (user_id, str(seed))).rowcount
+                if added:
+                    conn.execute('UPDATE history_users SET distinct_seeds = distinct_seeds + 1 '
+                                 'WHERE user_id = ?', (user_id,))
+            conn.execute('INSERT INTO history_records VALUES (?, ?, ?, ?)',
+                         (user_id, seq, record.get('timestamp', 0.0),
+                          json.dumps(dict(record, seq=seq), separators=(',', ':'))))
+            if seq >= self.max_records:
+                conn.execute('DELETE FROM history_records WHERE user_id = ? AND seq = ?',
+                             (user_id, seq - self.max_records))
+            if users is not None and users > self.max_users:
+                victim = conn.execute(
+                    'SELECT user_id FROM history_users ORDER BY last_used LIMIT 1'
+                ).fetchone()[0]
+                for table in ('history_records', 'history_seeds', 'history_users'):
+                    conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (victim,))
+                conn.execute("UPDATE history_meta SET value = value - 1 WHERE key = 'users'")
+        return seq
+
+    def latest_seq(self, user_id: str) -> int:
+        row = self._conn().execute(
+            'SELECT next_seq FROM history_users WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] - 1 if row else -1
+
+    def page(self, user_id: str, after: int = -1, since: "float | None" = None,
+             limit: "int | None" = None) -> list:
+        """Records with seq > after (and timestamp > since), oldest first."""
+        sql = 'SELECT record FROM history_records WHERE user_id = ? AND seq > ?'
+        args: list = [user_id, after]
+        if since is not None:
+            sql += ' AND ts > ?'
+            args.append(since)
+        sql += ' ORDER BY seq LIMIT ?'
+        args.append(-1 if limit is None else limit)
+        return [json.loads(r[0]) for r in self._conn().execute(sql, args).fetchall()]
+
+    def records(self, user_id: str) -> list:
+        return self.page(user_id)
+
+    def aggregates(self, user_id: str) -> dict:
+        row = self._conn().execute(
+            'SELECT count, complexity_sum, complexity_max, distinct_seeds '
+            'FROM history_users WHERE user_id = ?', (user_id,)).fetchone()
+        return _history_aggregates(*row) if row else _history_aggregates(0, 0.0, None, 0)
+
+    def stats(self) -> dict:
+        users = self._conn().execute(
+            "SELECT value FROM history_meta WHERE key = 'users'").fetchone()[0]
+        return {'backend': self.backend, 'users': users, 'path': self.path}
+
+
+class RedisHistoryStore:
+    """History in Redis: per user a record list, a metadata hash (next seq and
+    aggregates) and a seed set, plus one sorted set ordering users by last
+    write. Lua scripts keep appends, trimming, eviction and paging atomic.
+    """
+
+    backend = 'redis'
+
+    # The record arrives as a JSON object; seq is spliced in as text so that
+    # cjson never re-encodes (and rounds) the float timestamp.
+    _APPEND_SCRIPT = """
+local user = ARGV[1]
+local list_key = KEYS[1] .. 'records:' .. user
+local meta_key = KEYS[1] .. 'meta:' .. user
+local seq = redis.call('HINCRBY', meta_key, 'next_seq', 1) - 1
+redis.call('RPUSH', list_key, '{"seq":' .. seq .. ',' .. string.sub(ARGV[2], 2))
+redis.call('LTRIM', list_key, -tonumber(ARGV[3]), -1)
+redis.call('HINCRBY', meta_key, 'count', 1)
+redis.call('HINCRBYFLOAT', meta_key, 'complexity_sum', ARGV[5])
+local current_max = redis.call('HGET', meta_key, 'complexity_max')
+if not current_max or tonumber(ARGV[5]) > tonumber(current_max) then
+    redis.call('HSET', meta_key, 'complexity_max', ARGV[5])
+end
+if ARGV[6] ~= '' and redis.call('SADD', KEYS[1] .. 'seeds:' .. user, ARGV[6]) == 1 then
+    redis.call('HINCRBY', meta_key, 'distinct_seeds', 1)
+end
+local clock = redis.call('INCR', KEYS[3])
+redis.call('ZADD', KEYS[2], clock, user)
+if redis.call('ZCARD', KEYS[2]) > tonumber(ARGV[4]) then
+    local victim = redis.call('ZPOPMIN', KEYS[2])[1]
+    redis.call('DEL', KEYS[1] .. 'records:' .. victim, KEYS[1] .. 'meta:' .. victim,
+               KEYS[1] .. 'seeds:' .. victim)
+end
+return seq
+"""
+
+    _PAGE_SCRIPT = """
+local next_seq = tonumber(redis.call('HGET', KEYS[2], 'next_seq') or '0')
+local first_seq = next_seq - redis.call('LLEN', KEYS[1])
+local start = math.max(0, tonumber(ARGV[1]) + 1 - first_seq)
+local stop = -1
+if tonumber(ARGV[2]) >= 0 then
+    stop = start + tonumber(ARGV[2]) - 1
+end
+return redis.call('LRANGE', KEYS[1], start, stop)
+"""
+
+    def __init__(self, client, max_records: int = MAX_HISTORY_RECORDS,
+                 max_users: int = MAX_HISTORY_USERS, namespace: str = 'fold:history:'):
+        self.max_records = max(1, max_records)
+        self.max_users = max(1, max_users)
+        self._client = client
+        self._namespace = namespace
+        self._users_key = namespace + 'users'
+        self._clock_key = namespace + 'clock'
+        self._append = client.register_script(self._APPEND_SCRIPT)
+        self._page = client.register_script(self._PAGE_SCRIPT)
+
+    def append(self, user_id: str, record: dict) -> int:
+        record = {k: v for k, v in record.items() if k != 'seq'}
+        seed = record.get('circuit_seed')
+        return int(self._append(
+            keys=[self._namespace, self._users_key, self._clock_key],
+            args=[user_id, json.dumps(record, separators=(',', ':')),
+                  self.max_records, self.max_users, record.get('complexity', 0),
+                  '' if seed is None else str(seed)],
+        ))
+
+    def latest_seq(self, user_id: str) -> int:
+        next_seq = self._client.hget(self._namespace + 'meta:' + user_id, 'next_seq')
+        return int(next_seq) - 1 if next_seq is not None else -1
+
+    def page(self, user_id: str, after: int = -1, since: "float | None" = None,
+             limit: "int | None" = None) -> list:
+        """Records with seq > after (and timestamp > since), oldest first."""
+        raw = self._page(
+            keys=[self._namespace + 'records:' + user_id, self._namespace + 'meta:' + user_id],
+            args=[after, -1 if limit is None or since is not None else limit],
+        )
+        records = [json.loads(r) for r in raw]
+        if since is not None:
+            records = [r for r in records if r['timestamp'] > since][:limit]
+        return records
+
+    def records(self, user_id: str) -> list:
+        return self.page(user_id)
+
+    def aggregates(self, user_id: str) -> dict:
+        count, total, maximum, distinct = self._client.hmget(
+            self._namespace + 'meta:' + user_id,
+            'count', 'complexity_sum', 'complexity_max', 'distinct_seeds')
+        if count is None:
+            return _history_aggregates(0, 0.0, None, 0)
+        return _history_aggregates(int(count), float(total), float(maximum), int(distinct or 0))
+
+    def stats(self) -> dict:
+        return {'backend': self.backend, 'users': self._client.zcard(self._users_key)}
+
+
+def _build_history_store():
+    if HISTORY_BACKEND == 'sqlite':
+        return SqliteHistoryStore(HISTORY_SQLITE_PATH)
+    if HISTORY_BACKEND == 'redis':
+        client = _redis_client()
+        if client is not None:
+            return RedisHistoryStore(client)
+        logger.warning('HISTORY_BACKEND=redis needs REDIS_URL and the redis package; '
+                       'using per-worker memory history.')
+    elif HISTORY_BACKEND != 'memory':
+        raise ValueError('HISTORY_BACKEND must be memory, sqlite or redis')
+    return MemoryHistoryStore()
+
+
+_HISTORY_STORE = _build_history_store()
+
+
 # ---------------------------------------------------------------------------
 # Session bootstrap endpoint
 # ---------------------------------------------------------------------------
@@ -591,6 +2231,14 @@ def api_session():
 # ---------------------------------------------------------------------------
 # API Routes
 # ---------------------------------------------------------------------------
+@app.errorhandler(KdfUnavailableError)
+def handle_kdf_unavailable(e):
+    response = jsonify({'error': 'Server busy, retry later'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
 @app.route('/api/generate_encryption', methods=['POST'])
 @require_auth
 @limiter.limit("10 per minute")
@@ -610,37 +2258,30 @@ def api_generate_encryption():
         if err:
             return jsonify({'error': err}), 400
 
-        analysis = analyze_circuit(cleaned)
-        parameters = derive_circuit_parameters(analysis)
+        cache_key = CircuitResultCache.key_for(cleaned) if _RESULT_CACHE else None
+        result = _RESULT_CACHE.get(cache_key) if _RESULT_CACHE else None
+        if result is None:
+            analysis = analyze_circuit_compact(cleaned)
+            parameters = derive_circuit_parameters(analysis)
+            # Sign the parameters with a key derived from SECRET_KEY (not API_KEY).
+            param_bytes = _canonical_info(parameters)
+            result = {
+                'parameters': parameters,
+                'parameters_signature': _sign(param_bytes),
+                'analysis': analysis['summary'],
+            }
+            if _RESULT_CACHE:
+                _RESULT_CACHE.put(cache_key, result)
 
         record = {
             'timestamp': time.time(),
             'cards_count': len(cleaned.get('cards', [])),
-            'complexity': analysis['summary']['complexity_score'],
-            'circuit_seed': parameters['circuit_seed'],
+            'complexity': result['analysis']['complexity_score'],
+            'circuit_seed': result['parameters']['circuit_seed'],
         }
-        user_id = _get_user_id()
-        bucket = encryption_records_by_user.setdefault(user_id, [])
-        bucket.append(record)
-        while len(bucket) > MAX_HISTORY_RECORDS:
-            bucket.pop(0)
-        # Global cap on distinct users to prevent unbounded memory growth.
-        while len(encryption_records_by_user) > MAX_HISTORY_USERS:
-            # Drop an arbitrary oldest key (dict insertion order).
-            victim = next(iter(encryption_records_by_user))
-            if victim == user_id:
-                break
-            encryption_records_by_user.pop(victim, None)
-
-        # Sign the parameters with a key derived from SECRET_KEY (not API_KEY).
-        param_bytes = _canonical_info(parameters)
-        signature = _sign(param_bytes)
+        _HISTORY_STORE.append(_get_user_id(), record)
 
-        return jsonify({
-            'parameters': parameters,
-            'parameters_signature': signature,
-            'analysis': analysis['summary'],
-        })
+        return jsonify(result)
 
     except Exception:
         logger.exception('Error generating encryption parameters')
@@ -651,11 +2292,147 @@ def api_generate_encryption():
 @require_auth
 @limiter.limit("60 per minute")
 def api_history():
+    """Paginated history for the caller.
+
+    Query parameters (all optional):
+      after  — cursor: only records with seq > after (use next_cursor).
+      since  — only records with timestamp > since.
+      limit  — page size, at most MAX_HISTORY_RECORDS.
+
+    Responses carry an ETag derived from the caller's newest seq, so polling
+    with If-None-Match gets a body-less 304 until something new is recorded.
+    """
     user_id = _get_user_id()
-    return jsonify({
-        'records': encryption_records_by_user.get(user_id, []),
-        'user_isolated': True,
-    })
+    try:
+        after = int(request.args.get('after', -1))
+        since = request.args.get('since')
+        since = float(since) if since is not None else None
+        limit = int(request.args.get('limit', MAX_HISTORY_RECORDS))
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    if limit < 1 or (since is not None and not math.isfinite(since)):
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    limit = min(limit, MAX_HISTORY_RECORDS)
+
+    latest = _HISTORY_STORE.latest_seq(user_id)
+    if after > latest:
+        # The user's history was evicted and restarted; resend from scratch.
+        after = -1
+    etag = hashlib.sha256(
+        ('%s|%d|%d|%r|%d' % (user_id, latest, after, since, limit)).encode()
+    ).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        records = _HISTORY_STORE.page(user_id, after=after, since=since, limit=limit + 1)
+        has_more = len(records) > limit
+        records = records[:limit]
+        response = jsonify({
+            'records': records,
+            'next_cursor': records[-1]['seq'] if records else latest,
+            'has_more': has_more,
+            'aggregates': _HISTORY_STORE.aggregates(user_id),
+            'user_isolated': True,
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# ---------------------------------------------------------------------------
+# Batch encryption endpoints (server-to-server)
+# Body is either a JSON object {password, parameters, parameters_signature,
+# records: [...]} or NDJSON whose first line is that object without
+# `records` and whose remaining lines are one JSON string record each.
+# `parameters` must be exactly as returned (and signed) by
+# /api/generate_encryption. Results stream back as NDJSON in input order,
+# one {"i": index, ...} line per record.
+# ---------------------------------------------------------------------------
+class _BatchRequestError(ValueError):
+    pass
+
+
+def _read_batch_request() -> "tuple[CircuitEncryption, str, list]":
+    request.max_content_length = BATCH_MAX_REQUEST_SIZE
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        try:
+            lines = [json.loads(line) for line in request.get_data().splitlines() if line.strip()]
+        except ValueError:
+            raise _BatchRequestError('Invalid NDJSON body')
+        if not lines:
+            raise _BatchRequestError('Missing batch header line')
+        header, records = lines[0], lines[1:]
+    else:
+        header = request.get_json(silent=True)
+        records = header.get('records') if isinstance(header, dict) else None
+        if not isinstance(records, list):
+            raise _BatchRequestError('Body must be a JSON object with a records array')
+    if not isinstance(header, dict):
+        raise _BatchRequestError('Batch header must be a JSON object')
+    if len(records) > BATCH_MAX_RECORDS:
+        raise _BatchRequestError(f'Too many records (max {BATCH_MAX_RECORDS})')
+    password = header.get('password')
+    if not isinstance(password, str) or not password:
+        raise _BatchRequestError('Missing password')
+    parameters = header.get('parameters')
+    if not isinstance(parameters, dict) or not _verify_signature(
+            _canonical_info(parameters), header.get('parameters_signature')):
+        raise _BatchRequestError('Invalid parameters signature')
+    return CircuitEncryption(parameters), password, records
+
+
+def _ndjson_response(lines) -> Response:
+    return Response(
+        (json.dumps(line, separators=(',', ':')) + '\n' for line in lines),
+        mimetype='application/x-ndjson',
+    )
+
+
+@app.route('/api/batch/encrypt', methods=['POST'])
+@require_api_key
+@limiter.limit("10 per minute")
+def api_batch_encrypt():
+    """Encrypt string records under one password (one scrypt run)."""
+    try:
+        cipher, password, records = _read_batch_request()
+    except _BatchRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    valid = [i for i, record in enumerate(records) if isinstance(record, str)]
+    # All key derivation happens here, before the response starts, so KDF
+    # overload still surfaces as a 503.
+    blobs = dict(zip(valid, cipher.encrypt_many([records[i] for i in valid], password)))
+
+    def lines():
+        for i in range(len(records)):
+            blob = blobs.pop(i, None)
+            if blob is None:
+                yield {'i': i, 'error': 'Record must be a string'}
+            else:
+                yield {'i': i, 'ciphertext': blob.decode('ascii')}
+    return _ndjson_response(lines())
+
+
+@app.route('/api/batch/decrypt', methods=['POST'])
+@require_api_key
+@limiter.limit("10 per minute")
+def api_batch_decrypt():
+    """Decrypt base64 ciphertexts; bad records fail individually."""
+    try:
+        cipher, password, records = _read_batch_request()
+    except _BatchRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    results = cipher.decrypt_many(records, password, return_exceptions=True,
+                                  max_derivations=BATCH_MAX_DERIVATIONS)
+
+    def lines():
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                yield {'i': i, 'error': 'Decryption failed'}
+            elif isinstance(result, bytes):
+                yield {'i': i, 'plaintext_b64': base64.b64encode(result).decode('ascii')}
+            else:
+                yield {'i': i, 'plaintext': result}
+    return _ndjson_response(lines())
 
 
 @app.route('/', defaults={'path': ''})
@@ -673,27 +2450,44 @@ def serve(path):
 
 @app.route('/api/status')
 def api_status():
-    pqc_status = 'unavailable'
-    try:
-        req = urllib.request.Request(f'{PQC_SERVICE_URL}/pqc/status', method='GET')
-        with urllib.request.urlopen(req, timeout=2) as resp:
-            if resp.status == 200:
-                pqc_status = 'online'
-    except Exception:
-        pass
+    # Answered from the background prober's cached state; never blocks on
+    # the sidecar.
+    if _get_pqc_engine() is not None:
+        pqc_engine, pqc_health = 'inprocess', {'status': 'online'}
+    else:
+        pqc_engine, pqc_health = 'http', _get_pqc_prober().snapshot()
     return jsonify({
         'status': 'online',
         'version': '2.1.0',
-        'pqc_status': pqc_status,
+        'pqc_status': pqc_health['status'],
+        'pqc_health': pqc_health,
+        'pqc_engine': pqc_engine,
         'pqc_algorithm': 'ML-KEM-768',
+        'kdf_cache': _DEFAULT_KEY_CACHE.stats() if _DEFAULT_KEY_CACHE else None,
+        'kdf_executor': _DEFAULT_KDF_EXECUTOR.stats(),
+        'kdf_admission': _KDF_ADMISSION.stats() if _KDF_ADMISSION else None,
+        'result_cache': _RESULT_CACHE.stats() if _RESULT_CACHE else None,
+        'history': _HISTORY_STORE.stats(),
         'endpoints': [
             '/api/session',
             '/api/generate_encryption',
             '/api/history',
+            '/api/batch/encrypt',
+            '/api/batch/decrypt',
             '/api/status',
             '/api/pqc/keypair',
             '/api/pqc/encrypt',
             '/api/pqc/decrypt',
+            '/api/pqc/delete_key',
+            '/api/pqc/encrypt_batch',
+            '/api/pqc/decrypt_batch',
+            '/api/pqc/encrypt_envelope',
+            '/api/pqc/decrypt_envelope',
+            '/api/pqc/session_open',
+            '/api/pqc/session_accept',
+            '/api/pqc/session_encrypt',
+            '/api/pqc/session_decrypt',
+            '/api/pqc/session_close',
             '/api/pqc/status',
         ],
     })
@@ -703,39 +2497,375 @@ def api_status():
 # PQC proxy
 # ---------------------------------------------------------------------------
 _PQC_MAX_PROXY_BODY = int(os.environ.get('PQC_MAX_PROXY_BODY', str(256 * 1024)))  # 256 KB
+PQC_POOL_SIZE = int(os.environ.get('PQC_POOL_SIZE', '8'))
+PQC_PROXY_TIMEOUT = float(os.environ.get('PQC_PROXY_TIMEOUT', '15'))
+PQC_HEALTH_INTERVAL = float(os.environ.get('PQC_HEALTH_INTERVAL', '5'))
+PQC_HEALTH_TIMEOUT = float(os.environ.get('PQC_HEALTH_TIMEOUT', '2'))
+# Consecutive failed probes/proxy calls after which proxy routes fail fast.
+PQC_FAIL_FAST_AFTER = int(os.environ.get('PQC_FAIL_FAST_AFTER', '3'))
+# auto: run pqc/handlers.py in-process when oqs and the pqc modules import,
+# else proxy to the sidecar. inprocess / http force one side (inprocess still
+# falls back to http, loudly, if the import fails).
+PQC_ENGINE = os.environ.get('PQC_ENGINE', 'auto').strip().lower()
+if PQC_ENGINE not in ('auto', 'inprocess', 'http'):
+    raise ValueError('PQC_ENGINE must be auto, inprocess or http')
+PQC_MODULE_DIR = os.environ.get(
+    'PQC_MODULE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pqc'))
+# gunicorn worker processes (the production Dockerfile's --workers). With
+# more than one, in-process PQC sessions must live in Redis so every worker
+# sees them; `python app.py` is a single process.
+GUNICORN_WORKERS = int(os.environ.get('GUNICORN_WORKERS', '4'))
+
+# Errors that mean a kept-alive socket was closed by the sidecar while idle.
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
 
+class PqcPoolExhausted(RuntimeError):
+    """All pooled sidecar connections stayed busy for the whole timeout."""
 
-def _proxy_to_pqc(path: str):
-    target_url = f'{PQC_SERVICE_URL}/pqc/{path}'
+
+class _PooledResponse:
+    """Sidecar response whose connection goes back to the pool once the body
+    has been fully read, or is closed if the caller stops early."""
+
+    def __init__(self, pool: "PqcConnectionPool", conn, resp):
+        self._pool = pool
+        self._conn = conn
+        self._resp = resp
+        self.status = resp.status
+        self.headers = resp.headers
+
+    def iter_chunks(self, chunk_size: int = 16 * 1024):
+        try:
+            while True:
+                chunk = self._resp.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def read(self) -> bytes:
+        return b''.join(self.iter_chunks())
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        reusable = self._resp.isclosed() and not self._resp.will_close
+        self._pool._checkin(conn, reusable)
+
+
+class PqcConnectionPool:
+    """Per-process keep-alive pool of http.client connections to the sidecar.
+
+    At most `max_connections` sockets exist at once. A request that fails
+    because a reused idle socket went stale is retried once on a fresh
+    connection; any other failure is raised to the caller.
+    """
+
+    def __init__(self, base_url: str, max_connections: int = 8, timeout: float = 15.0):
+        parsed = urlparse(base_url)
+        self._conn_cls = (http.client.HTTPSConnection if parsed.scheme == 'https'
+                          else http.client.HTTPConnection)
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._base_path = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self.max_connections = max(1, max_connections)
+        self._idle: "deque" = deque()
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.retries = 0
+
+    def _checkout(self, timeout: float):
+        if not self._slots.acquire(timeout=timeout):
+            raise PqcPoolExhausted('No free PQC sidecar connection')
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop(), True
+            self.created += 1
+        return self._conn_cls(self._host, self._port, timeout=timeout), False
+
+    def _checkin(self, conn, reusable: bool) -> None:
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def request(self, method: str, path: str, body: "bytes | None" = None,
+                headers: "dict | None" = None,
+                timeout: "float | None" = None) -> _PooledResponse:
+        timeout = self.timeout if timeout is None else timeout
+        for attempt in range(2):
+            conn, reused = self._checkout(timeout)
+            try:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request(method, self._base_path + path, body=body, headers=headers or {})
+                return _PooledResponse(self, conn, conn.getresponse())
+            except _STALE_CONNECTION_ERRORS:
+                self._checkin(conn, reusable=False)
+                if reused and attempt == 0:
+                    self.retries += 1
+                    continue
+                raise
+            except BaseException:
+                self._checkin(conn, reusable=False)
+                raise
+        raise AssertionError('unreachable')
+
+    def close(self) -> None:
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'max_connections': self.max_connections,
+                'idle': len(self._idle),
+                'created': self.created,
+                'reused': self.reused,
+                'stale_retries': self.retries,
+            }
+
+
+_pqc_pool: "PqcConnectionPool | None" = None
+_pqc_pool_pid: "int | None" = None
+_pqc_pool_lock = threading.Lock()
+
+
+def _get_pqc_pool() -> PqcConnectionPool:
+    """Lazily build the pool in each gunicorn worker (sockets are not fork-safe)."""
+    global _pqc_pool, _pqc_pool_pid
+    with _pqc_pool_lock:
+        if _pqc_pool is None or _pqc_pool_pid != os.getpid():
+            _pqc_pool = PqcConnectionPool(PQC_SERVICE_URL, PQC_POOL_SIZE, PQC_PROXY_TIMEOUT)
+            _pqc_pool_pid = os.getpid()
+        return _pqc_pool
+
+
+class PqcHealthProber:
+    """Background sidecar health check with a cached, lock-protected snapshot.
+
+    A daemon thread calls `probe()` every `interval` seconds; proxy calls
+    also report their outcome via record_success()/record_failure(), so an
+    outage is noticed between probes. After `fail_threshold` consecutive
+    failures is_down() is true and proxy routes answer 503 immediately.
+    """
+
+    def __init__(self, probe, interval: float = 5.0, fail_threshold: int = 3):
+        self._probe = probe
+        self.interval = interval
+        self.fail_threshold = max(1, fail_threshold)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._status = 'unknown'
+        self._last_latency_ms = None
+        self._last_checked = None
+        self._last_error = None
+        self._consecutive_failures = 0
+        self._checks = 0
+        self._errors = 0
+
+    def record_success(self, latency_ms: float) -> None:
+        with self._lock:
+            self._status = 'online'
+            self._last_latency_ms = round(latency_ms, 3)
+            self._last_checked = time.time()
+            self._consecutive_failures = 0
+            self._checks += 1
+
+    def record_failure(self, error: BaseException) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            self._errors += 1
+            self._checks += 1
+            self._last_checked = time.time()
+            self._last_error = type(error).__name__
+            if self._consecutive_failures >= self.fail_threshold or self._status == 'unknown':
+                self._status = 'unavailable'
+
+    def check_once(self) -> None:
+        started = time.perf_counter()
+        try:
+            self._probe()
+        except Exception as e:
+            self.record_failure(e)
+        else:
+            self.record_success((time.perf_counter() - started) * 1000)
+
+    def _run(self) -> None:
+        while True:
+            self.check_once()
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='pqc-health', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def is_down(self) -> bool:
+        with self._lock:
+            return self._consecutive_failures >= self.fail_threshold
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'status': self._status,
+                'last_latency_ms': self._last_latency_ms,
+                'last_checked': self._last_checked,
+                'last_error': self._last_error,
+                'consecutive_failures': self._consecutive_failures,
+                'checks': self._checks,
+                'errors': self._errors,
+            }
+
+
+def _probe_pqc_status() -> None:
+    resp = _get_pqc_pool().request('GET', '/pqc/status', timeout=PQC_HEALTH_TIMEOUT)
+    resp.read()
+    if resp.status != 200:
+        raise RuntimeError(f'PQC status returned HTTP {resp.status}')
+
+
+_pqc_prober: "PqcHealthProber | None" = None
+_pqc_prober_pid: "int | None" = None
+
+
+def _get_pqc_prober() -> PqcHealthProber:
+    """Start one prober thread per worker process on first use."""
+    global _pqc_prober, _pqc_prober_pid
+    with _pqc_pool_lock:
+        if _pqc_prober is None or _pqc_prober_pid != os.getpid():
+            _pqc_prober = PqcHealthProber(_probe_pqc_status, PQC_HEALTH_INTERVAL,
+                                          PQC_FAIL_FAST_AFTER)
+            _pqc_prober_pid = os.getpid()
+            _pqc_prober.start()
+        return _pqc_prober
+
+
+def _load_pqc_engine(mode: str = PQC_ENGINE, module_dir: str = PQC_MODULE_DIR):
+    """Import the sidecar's handlers module for in-process PQC, or None.
+
+    None means "proxy over HTTP": either mode is http, or oqs / lattice.py
+    are not importable in this image.
+    """
+    if mode == 'http':
+        return None
     try:
-        body = request.get_data(cache=False)
-        if len(body) > _PQC_MAX_PROXY_BODY:
+        if importlib.util.find_spec('oqs') is None:
+            raise ImportError('oqs (liboqs-python) is not installed')
+        # The sidecar uses flat imports (from lattice import ...). Appended,
+        # not prepended, so nothing in pqc/ can shadow an app dependency.
+        if module_dir not in sys.path:
+            sys.path.append(module_dir)
+        engine = importlib.import_module('handlers')
+        if not hasattr(engine, 'OPERATIONS'):
+            raise ImportError(f'{engine.__file__} is not the PQC handlers module')
+    except Exception as e:
+        log = logger.warning if mode == 'inprocess' else logger.info
+        log('In-process PQC engine unavailable (%s); proxying to %s', e, PQC_SERVICE_URL)
+        return None
+    # Sessions opened in one worker must be visible to the others.
+    engine.SESSIONS_REQUIRE_SHARED = GUNICORN_WORKERS > 1
+    logger.info('PQC engine: in-process (%s)', engine.__file__)
+    return engine
+
+
+_pqc_engine = None
+_pqc_engine_loaded = False
+_pqc_engine_lock = threading.Lock()
+
+
+def _get_pqc_engine():
+    """Resolve the in-process engine once per process; None means HTTP."""
+    global _pqc_engine, _pqc_engine_loaded
+    if not _pqc_engine_loaded:
+        with _pqc_engine_lock:
+            if not _pqc_engine_loaded:
+                _pqc_engine = _load_pqc_engine()
+                _pqc_engine_loaded = True
+    return _pqc_engine
+
+
+def _call_pqc_engine(engine, path: str, max_body: int):
+    """Run a PQC operation in this process with the sidecar's request and
+    response shapes."""
+    if path == 'status':
+        payload, status = engine.status()
+    else:
+        if len(request.get_data()) > max_body:
             return jsonify({'error': 'Request too large for PQC proxy'}), 413
+        payload, status = engine.OPERATIONS[path](request.get_json(silent=True))
+    return jsonify(payload), status
+
+
+def _proxy_to_pqc(path: str, max_body: int = _PQC_MAX_PROXY_BODY):
+    engine = _get_pqc_engine()
+    if engine is not None:
+        return _call_pqc_engine(engine, path, max_body)
+    prober = _get_pqc_prober()
+    if prober.is_down():
+        response = jsonify({'error': 'PQC service unavailable'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, math.ceil(prober.interval)))
+        return response
+    # Read before the try: an oversized body is the client's 413, not a
+    # sidecar failure.
+    body = request.get_data(cache=False)
+    if len(body) > max_body:
+        return jsonify({'error': 'Request too large for PQC proxy'}), 413
+    started = time.perf_counter()
+    try:
         headers = {'Content-Type': 'application/json'}
         # The sidecar authenticates with the shared API_KEY. The frontend never
         # sees this key; the proxy injects it here.
         headers['X-API-Key'] = API_KEY
-        req = urllib.request.Request(
-            target_url,
-            data=body if request.method == 'POST' else None,
+        upstream = _get_pqc_pool().request(
+            request.method,
+            f'/pqc/{path}',
+            body=body if request.method == 'POST' else None,
             headers=headers,
-            method=request.method,
-        )
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            return app.response_class(
-                response=resp.read(),
-                status=resp.status,
-                mimetype='application/json',
-            )
-    except urllib.error.HTTPError as e:
-        return app.response_class(
-            response=e.read(),
-            status=e.code,
-            mimetype='application/json',
         )
-    except Exception:
+    except Exception as e:
+        prober.record_failure(e)
         logger.exception('PQC proxy error for %s', path)
         return jsonify({'error': 'PQC service unavailable'}), 503
+    prober.record_success((time.perf_counter() - started) * 1000)
+
+    # Stream the sidecar body through instead of buffering it; the pooled
+    # connection is released when the client has consumed (or dropped) it.
+    response = app.response_class(
+        response=upstream.iter_chunks(),
+        status=upstream.status,
+        mimetype='application/json',
+    )
+    length = upstream.headers.get('Content-Length')
+    if length is not None:
+        response.headers['Content-Length'] = length
+    response.call_on_close(upstream.close)
+    return response
 
 
 @app.route('/api/pqc/status')
@@ -764,6 +2894,83 @@ def api_pqc_decrypt():
     return _proxy_to_pqc('decrypt')
 
 
+@app.route('/api/pqc/delete_key', methods=['POST'])
+@require_auth
+@limiter.limit("30 per minute")
+def api_pqc_delete_key():
+    return _proxy_to_pqc('delete_key')
+
+
+# Batches share the /api/batch/* body cap instead of the single-message one.
+@app.route('/api/pqc/encrypt_batch', methods=['POST'])
+@require_auth
+@limiter.limit("10 per minute")
+def api_pqc_encrypt_batch():
+    request.max_content_length = BATCH_MAX_REQUEST_SIZE
+    return _proxy_to_pqc('encrypt_batch', BATCH_MAX_REQUEST_SIZE)
+
+
+@app.route('/api/pqc/decrypt_batch', methods=['POST'])
+@require_auth
+@limiter.limit("10 per minute")
+def api_pqc_decrypt_batch():
+    request.max_content_length = BATCH_MAX_REQUEST_SIZE
+    return _proxy_to_pqc('decrypt_batch', BATCH_MAX_REQUEST_SIZE)
+
+
+@app.route('/api/pqc/encrypt_envelope', methods=['POST'])
+@require_auth
+@limiter.limit("10 per minute")
+def api_pqc_encrypt_envelope():
+    request.max_content_length = BATCH_MAX_REQUEST_SIZE
+    return _proxy_to_pqc('encrypt_envelope', BATCH_MAX_REQUEST_SIZE)
+
+
+@app.route('/api/pqc/decrypt_envelope', methods=['POST'])
+@require_auth
+@limiter.limit("10 per minute")
+def api_pqc_decrypt_envelope():
+    request.max_content_length = BATCH_MAX_REQUEST_SIZE
+    return _proxy_to_pqc('decrypt_envelope', BATCH_MAX_REQUEST_SIZE)
+
+
+# Sessions: one KEM at setup, then AES-GCM only per message, so the
+# per-message routes get a higher limit than /api/pqc/encrypt.
+@app.route('/api/pqc/session_open', methods=['POST'])
+@require_auth
+@limiter.limit("10 per minute")
+def api_pqc_session_open():
+    return _proxy_to_pqc('session_open')
+
+
+@app.route('/api/pqc/session_accept', methods=['POST'])
+@require_auth
+@limiter.limit("10 per minute")
+def api_pqc_session_accept():
+    return _proxy_to_pqc('session_accept')
+
+
+@app.route('/api/pqc/session_encrypt', methods=['POST'])
+@require_auth
+@limiter.limit("120 per minute")
+def api_pqc_session_encrypt():
+    return _proxy_to_pqc('session_encrypt')
+
+
+@app.route('/api/pqc/session_decrypt', methods=['POST'])
+@require_auth
+@limiter.limit("120 per minute")
+def api_pqc_session_decrypt():
+    return _proxy_to_pqc('session_decrypt')
+
+
+@app.route('/api/pqc/session_close', methods=['POST'])
+@require_auth
+@limiter.limit("60 per minute")
+def api_pqc_session_close():
+    return _proxy_to_pqc('session_close')
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     host = os.environ.get('HOST', '0.0.0.0')
@@ -799,4 +3006,5 @@ if __name__ == '__main__':
                 'is restricted to 127.0.0.1.', host,
             )
 
+    GUNICORN_WORKERS = 1
     app.run(host=host, port=port, debug=debug)
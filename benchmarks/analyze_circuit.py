@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Scaling benchmark for analyze_circuit's mesh-connection resolution.
+
+Compares the indexed resolver in app.py against the original nested scan
+(copied below as `naive_mesh_connections`) on synthetic stacks of growing
+height, checks both produce identical output, and prints time per mesh point
+so linear vs quadratic growth is visible at a glance. The last two columns
+are the memory each analysis keeps alive: the dict-per-element
+analyze_circuit vs the column-oriented analyze_circuit_compact.
+
+    python benchmarks/analyze_circuit.py [--max-cards 640]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('API_KEY', 'bench-api-key')
+os.environ.setdefault('SECRET_KEY', 'bench-secret-key-' + 'a' * 32)
+
+from app import analyze_circuit, analyze_circuit_compact  # noqa: E402
+
+
+def naive_mesh_connections(all_mesh_points):
+    """The pre-index O(P^2 x C) resolver, kept verbatim as the reference."""
+    mesh_connections = []
+    for point in all_mesh_points:
+        card_idx = point.get('card_index')
+        for up_id in point.get('upConnections', []):
+            for target_point in all_mesh_points:
+                if target_point.get('id') == up_id and target_point.get('card_index') > card_idx:
+                    mesh_connections.append({'from_point': point, 'to_point': target_point, 'direction': 'up'})
+        for down_id in point.get('downConnections', []):
+            for target_point in all_mesh_points:
+                if target_point.get('id') == down_id and target_point.get('card_index') < card_idx:
+                    mesh_connections.append({'from_point': point, 'to_point': target_point, 'direction': 'down'})
+    return mesh_connections
+
+
+def make_stack(num_cards: int, points_per_card: int = 32, links: int = 8, seed: int = 0) -> dict:
+    """Dense mesh: every point links up/down to points on nearby cards."""
+    rng = random.Random(seed)
+    cards = []
+    for c in range(num_cards):
+        points = []
+        for i in range(points_per_card):
+            def ref(offset):
+                return f'm{min(max(c + offset, 0), num_cards - 1)}-{rng.randrange(points_per_card)}'
+            points.append({
+                'id': f'm{c}-{i}',
+                'x': rng.random(), 'y': rng.random(),
+                'upConnections': [ref(rng.randint(1, 3)) for _ in range(links)],
+                'downConnections': [ref(-rng.randint(1, 3)) for _ in range(links)],
+            })
+        cards.append({'id': f'card{c}', 'type': 'basic', 'color': 'gray',
+                      'nodes': [], 'matrixConnections': [], 'logicGates': [],
+                      'meshInteractionPoints': points})
+    return {'cards': cards}
+
+
+def best_of(fn, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def retained_kib(fn, circuit) -> float:
+    """KiB still allocated once fn(circuit) returns, with its result held."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn(circuit)  # noqa: F841 - keep it alive while measuring
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return retained / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-cards', type=int, default=640)
+    parser.add_argument('--naive-max-cards', type=int, default=80,
+                        help='skip the quadratic reference above this size')
+    args = parser.parse_args()
+
+    print(f'{"cards":>6} {"points":>7} {"links":>8} {"indexed ms":>11} {"us/point":>9} {"naive ms":>10} '
+          f'{"dict KiB":>9} {"compact KiB":>12}')
+    num_cards = 5
+    while num_cards <= args.max_cards:
+        circuit = make_stack(num_cards)
+        analysis = analyze_circuit(circuit)
+        points = len(analysis['mesh_points'])
+        indexed = best_of(lambda: analyze_circuit(circuit))
+        naive_ms = '-'
+        if num_cards <= args.naive_max_cards:
+            reference = naive_mesh_connections(analysis['mesh_points'])
+            assert reference == analysis['mesh_connections'], 'resolver output diverged'
+            naive = best_of(lambda: naive_mesh_connections(analysis['mesh_points']), repeat=1)
+            naive_ms = f'{naive * 1000:.1f}'
+        print(f'{num_cards:>6} {points:>7} {len(analysis["mesh_connections"]):>8} '
+              f'{indexed * 1000:>11.1f} {indexed / points * 1e6:>9.2f} {naive_ms:>10} '
+              f'{retained_kib(analyze_circuit, circuit):>9.0f} '
+              f'{retained_kib(analyze_circuit_compact, circuit):>12.0f}')
+        num_cards *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Throughput benchmark for validate_circuit_data.
+
+Compares the single-pass validator in app.py against the original one
+(copied below as `reference_validate_circuit_data`) on
+synthetic stacks at the request-size caps, checks both produce identical
+output, and prints circuits per second for each.
+
+    python benchmarks/validate_circuit.py [--rounds 2000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('API_KEY', 'bench-api-key')
+os.environ.setdefault('SECRET_KEY', 'bench-secret-key-' + 'a' * 32)
+
+from app import (  # noqa: E402
+    ALLOWED_CARD_TYPES,
+    ALLOWED_GATE_TYPES,
+    MAX_CARDS,
+    MAX_NODES_PER_CARD,
+    _safe_float,
+    validate_circuit_data,
+)
+
+
+def reference_validate_circuit_data(data):
+    """The original validator, kept verbatim as the reference."""
+    if not isinstance(data, dict):
+        return None, 'Request body must be a JSON object'
+    cards = data.get('cards')
+    if not isinstance(cards, list) or len(cards) == 0:
+        return None, 'Missing or empty cards array'
+    if len(cards) > MAX_CARDS:
+        return None, f'Too many cards (max {MAX_CARDS})'
+
+    cleaned_cards = []
+    for idx, card in enumerate(cards):
+        if not isinstance(card, dict):
+            return None, f'Card at index {idx} is not an object'
+
+        card_type = str(card.get('type', 'basic'))
+        if card_type not in ALLOWED_CARD_TYPES:
+            card_type = 'basic'
+
+        color = str(card.get('color', 'gray'))[:20]
+
+        raw_nodes = card.get('nodes', [])
+        if not isinstance(raw_nodes, list):
+            raw_nodes = []
+        nodes = []
+        for node in raw_nodes[:MAX_NODES_PER_CARD]:
+            if isinstance(node, dict):
+                nodes.append({
+                    'id': str(node.get('id', ''))[:64],
+                    'x': _safe_float(node.get('x', 0)),
+                    'y': _safe_float(node.get('y', 0)),
+                    'type': str(node.get('type', 'input'))[:20],
+                    'connections': [str(c)[:64] for c in node.get('connections', [])[:16] if isinstance(c, str)],
+                })
+
+        raw_conns = card.get('matrixConnections', [])
+        if not isinstance(raw_conns, list):
+            raw_conns = []
+        connections = []
+        for conn in raw_conns[:64]:
+            if isinstance(conn, dict) and conn.get('active'):
+                connections.append({
+                    'id': str(conn.get('id', ''))[:64],
+                    'active': True,
+                    'fromX': _safe_float(conn.get('fromX', 0)),
+                    'fromY': _safe_float(conn.get('fromY', 0)),
+                    'toX': _safe_float(conn.get('toX', 0)),
+                    'toY': _safe_float(conn.get('toY', 0)),
+                })
+
+        raw_mesh = card.get('meshInteractionPoints', [])
+        if not isinstance(raw_mesh, list):
+            raw_mesh = []
+        mesh_points = []
+        for pt in raw_mesh[:32]:
+            if isinstance(pt, dict):
+                mesh_points.append({
+                    'id': str(pt.get('id', ''))[:64],
+                    'x': _safe_float(pt.get('x', 0)),
+                    'y': _safe_float(pt.get('y', 0)),
+                    'upConnections': [str(c)[:64] for c in pt.get('upConnections', [])[:16] if isinstance(c, str)],
+                    'downConnections': [str(c)[:64] for c in pt.get('downConnections', [])[:16] if isinstance(c, str)],
+                })
+
+        raw_gates = card.get('logicGates', [])
+        if not isinstance(raw_gates, list):
+            raw_gates = []
+        logic_gates = []
+        for gate in raw_gates[:16]:
+            if isinstance(gate, dict):
+                gate_type = str(gate.get('type', 'BUFFER'))
+                if gate_type not in ALLOWED_GATE_TYPES:
+                    gate_type = 'BUFFER'
+                logic_gates.append({
+                    'id': str(gate.get('id', ''))[:64],
+                    'type': gate_type,
+                    'x': _safe_float(gate.get('x', 0)),
+                    'y': _safe_float(gate.get('y', 0)),
+                })
+
+        cleaned_cards.append({
+            'id': str(card.get('id', f'card-{idx}'))[:64],
+            'type': card_type,
+            'color': color,
+            'nodes': nodes,
+            'matrixConnections': connections,
+            'meshInteractionPoints': mesh_points,
+            'logicGates': logic_gates,
+        })
+
+    return {'cards': cleaned_cards}, None
+
+
+def make_circuit(num_cards: int, seed: int = 0) -> dict:
+    """A full-size stack as the frontend sends it (after a JSON round-trip)."""
+    rng = random.Random(seed)
+
+    def ids(prefix, n):
+        return [f'{prefix}-{rng.randrange(1000)}' for _ in range(n)]
+
+    cards = []
+    for c in range(num_cards):
+        cards.append({
+            'id': f'card-{c}', 'type': rng.choice(sorted(ALLOWED_CARD_TYPES)), 'color': 'blue',
+            'nodes': [{'id': f'n{c}-{i}', 'x': rng.randint(0, 400), 'y': rng.random() * 400,
+                       'type': 'input', 'connections': ids('n', 4)} for i in range(MAX_NODES_PER_CARD)],
+            'matrixConnections': [{'id': f'mc{i}', 'active': rng.random() < 0.7,
+                                   'fromX': rng.random(), 'fromY': rng.random(),
+                                   'toX': rng.random(), 'toY': rng.random()} for i in range(64)],
+            'meshInteractionPoints': [{'id': f'm{c}-{i}', 'x': rng.random(), 'y': rng.random(),
+                                       'upConnections': ids('m', 4), 'downConnections': ids('m', 4)}
+                                      for i in range(32)],
+            'logicGates': [{'id': f'g{i}', 'type': rng.choice(sorted(ALLOWED_GATE_TYPES)),
+                            'x': rng.random(), 'y': rng.random()} for i in range(16)],
+        })
+    return json.loads(json.dumps({'cards': cards}))
+
+
+def best_rates(fns, circuit, rounds: int, batch: int = 5) -> list:
+    """Circuits/second for each fn, best batch of `rounds`, interleaved so
+    that machine noise hits every candidate alike."""
+    best = [float('inf')] * len(fns)
+    for _ in range(max(1, rounds // batch)):
+        for k, fn in enumerate(fns):
+            started = time.perf_counter()
+            for _ in range(batch):
+                fn(circuit)
+            best[k] = min(best[k], (time.perf_counter() - started) / batch)
+    return [1 / b for b in best]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f'{"cards":>6} {"current/s":>11} {"reference/s":>12} {"speedup":>8}')
+    for num_cards in sorted({1, 5, MAX_CARDS}):
+        circuit = make_circuit(num_cards)
+        assert validate_circuit_data(circuit) == reference_validate_circuit_data(circuit), \
+            'validator output diverged'
+        current, reference = best_rates(
+            (validate_circuit_data, reference_validate_circuit_data),
+            circuit, max(5, args.rounds // num_cards))
+        print(f'{num_cards:>6} {current:>11.0f} {reference:>12.0f} {current / reference:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Cost of derive_lattice_params as the connection count grows.
+
+Compares the original per-connection `bytes +=` packing (copied below as
+`reference_derive`) against the NumPy-packed derivation with the params cache
+disabled ("cold") and on a repeated circuit ("cached"), after checking all
+three produce identical parameters.
+
+    python benchmarks/derive_params.py [--max-connections 20000]
+"""
+import argparse
+import hashlib
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np  # noqa: E402
+
+import lattice  # noqa: E402
+
+
+def reference_derive(circuit_analysis: dict) -> dict:
+    """The pre-vectorization derive_lattice_params, kept as the reference."""
+    summary = circuit_analysis["summary"]
+    fingerprint = "".join(
+        summary.get("card_types", [])
+        + summary.get("card_colors", [])
+        + [str(t) for t in summary.get("logic_gate_types", [])]
+        + [str(summary.get("num_nodes", 0))]
+        + [str(summary.get("num_connections", 0))]
+    )
+    seed_bytes = hashlib.shake_256(fingerprint.encode()).digest(64)
+    num_mesh = summary.get("num_mesh_points", 0)
+    rng = np.random.default_rng(np.frombuffer(seed_bytes[:32], dtype=np.uint64))
+    noise_vector = rng.integers(-3, 4, size=max(num_mesh, 8)).tolist()
+    binding_input = b""
+    for conn in circuit_analysis.get("connections", []):
+        binding_input += struct.pack("4f", conn.get("fromX", 0.0), conn.get("fromY", 0.0),
+                                     conn.get("toX", 0.0), conn.get("toY", 0.0))
+    binding_vector = hashlib.shake_256(seed_bytes + binding_input).digest(32)
+    gate_mod = 1
+    for g in summary.get("logic_gate_types", []):
+        gate_mod = (gate_mod * lattice._GATE_MAP.get(g, 1)) % 257
+    return {
+        "kem_algorithm": "ML-KEM-768",
+        "k": 3,
+        "seed": seed_bytes,
+        "noise_vector": noise_vector,
+        "binding_vector": binding_vector,
+        "gate_mod": gate_mod,
+        "circuit_seed_hex": seed_bytes[:16].hex(),
+    }
+
+
+def make_analysis(num_connections: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {
+        "summary": {
+            "card_types": ["logic", "memory"], "card_colors": ["#4a6fa5"],
+            "logic_gate_types": ["AND", "XOR"], "num_nodes": num_connections // 2,
+            "num_connections": num_connections, "num_mesh_points": 64,
+        },
+        "connections": [
+            {"fromX": rng.random(), "fromY": rng.random(), "toX": rng.random(), "toY": rng.random()}
+            for _ in range(num_connections)
+        ],
+    }
+
+
+def best_ms(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-connections", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"connections":>11} {"reference ms":>13} {"cold ms":>8} {"cached ms":>10} {"speedup":>8}')
+    n = 10
+    while n <= args.max_connections:
+        analysis = make_analysis(n)
+        cache_size = lattice.PARAMS_CACHE_SIZE
+        lattice.PARAMS_CACHE_SIZE = 0
+        assert lattice.derive_lattice_params(analysis) == reference_derive(analysis)
+        cold = best_ms(lambda: lattice.derive_lattice_params(analysis), args.repeat)
+        lattice.PARAMS_CACHE_SIZE = cache_size
+        assert lattice.derive_lattice_params(analysis) == reference_derive(analysis)
+        cached = best_ms(lambda: lattice.derive_lattice_params(analysis), args.repeat)
+        reference = best_ms(lambda: reference_derive(analysis), args.repeat)
+        print(f"{n:>11} {reference:>13.2f} {cold:>8.2f} {cached:>10.2f} {reference / cached:>7.1f}x")
+        n *= 4
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+gunicorn.conf.py — Production runtime for the PQC sidecar.
+
+    gunicorn --config gunicorn.conf.py server:app
+
+Threaded workers (gthread): liboqs and AES-GCM release the GIL, so a few
+threads per worker overlap KEM calls, and several workers use several cores.
+The app (server -> handlers -> lattice -> liboqs) is preloaded in the master
+and must pass a KEM round-trip self-test before any worker is forked.
+`python server.py` still runs the Flask development server, behind the
+loopback-only debug guard.
+"""
+
+import logging
+import os
+
+logger = logging.getLogger("gunicorn.error")
+
+bind = f"{os.environ.get('PQC_HOST', '0.0.0.0')}:{os.environ.get('PQC_PORT', '5001')}"
+worker_class = "gthread"
+# Several workers need Redis to share /pqc/session_* state (see on_starting),
+# so without REDIS_URL the default is a single worker.
+_default_workers = min(os.cpu_count() or 1, 4) if os.environ.get("REDIS_URL") else 1
+workers = int(os.environ.get("PQC_WORKERS", str(_default_workers)))
+threads = int(os.environ.get("PQC_THREADS", "4"))
+timeout = int(os.environ.get("PQC_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("PQC_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("PQC_KEEPALIVE", "5"))
+max_requests = int(os.environ.get("PQC_MAX_REQUESTS", "1000"))
+max_requests_jitter = max(max_requests // 20, 1) if max_requests else 0
+
+# Import server.py (and with it liboqs) once in the master; workers inherit
+# the loaded shared library and module state through fork.
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("PQC_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    # Runs in the master after preload, before binding or forking. A
+    # RuntimeError here makes gunicorn exit 1, so a broken liboqs build never
+    # starts serving.
+    import handlers
+    import lattice
+    import sessions
+
+    params = lattice.self_test()
+    # Fail before forking if PQC_KEYSTORE_KEY does not open PQC_KEYSTORE_PATH.
+    handlers.get_keystore()
+    # Sessions opened in one worker must be visible to the others.
+    handlers.SESSIONS_REQUIRE_SHARED = workers > 1
+    sessions.create_store(require_shared=handlers.SESSIONS_REQUIRE_SHARED)
+    server.log.info(
+        "PQC self-test passed (%s, %d workers x %d threads)",
+        params["kem_algorithm"], workers, threads,
+    )
+
+
+def post_fork(server, worker):
+    # Threads do not survive fork, so each worker starts its own keypair
+    # producer here.
+    import handlers
+
+    handlers.get_keypair_pool()
+    server.log.info("PQC worker %s booted", worker.pid)
+
+
+def worker_int(worker):
+    worker.log.info("PQC worker %s interrupted; finishing in-flight requests", worker.pid)
+
+
+def worker_abort(worker):
+    worker.log.warning(
+        "PQC worker %s aborted after %ss; raise PQC_TIMEOUT for large payloads",
+        worker.pid, timeout,
+    )
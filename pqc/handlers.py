@@ -0,0 +1,654 @@
+"""
+handlers.py — Transport-independent PQC operations.
+
+Each handler takes the parsed JSON request body and returns
+(response_dict, http_status). server.py wraps them in Flask routes; the main
+fold backend can import this module directly (PQC_ENGINE=inprocess) and call
+the same functions without the HTTP hop, so both paths share one request /
+response contract.
+"""
+
+import base64
+import binascii
+import concurrent.futures
+import logging
+import os
+import threading
+
+import keystore
+import sessions
+from keypool import KeypairPool
+from lattice import (
+    CircuitLatticeKEM,
+    PostQuantumCircuitEncryption,
+    SessionExpired,
+    envelope_recipients,
+    params_cache_stats,
+)
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_ANALYSIS = {"summary": {}, "connections": []}
+
+_keypair_pool = None
+_keypair_pool_pid = None
+_keypair_pool_lock = threading.Lock()
+
+_keystore = None
+_keystore_pid = None
+_keystore_lock = threading.Lock()
+
+# /pqc/*_batch: items per request and KEM threads per worker process.
+BATCH_MAX_ITEMS = int(os.environ.get("PQC_BATCH_MAX_ITEMS", "256"))
+BATCH_WORKERS = int(os.environ.get("PQC_BATCH_WORKERS", "4"))
+
+_batch_executor = None
+_batch_executor_pid = None
+_batch_executor_lock = threading.Lock()
+
+# Set when several worker processes serve sessions: by gunicorn.conf.py for
+# the sidecar, and by the main backend when it runs these handlers in-process.
+# The store must then be Redis, or session operations answer 503.
+SESSIONS_REQUIRE_SHARED = False
+
+_session_store = None
+_session_store_pid = None
+_session_store_lock = threading.Lock()
+
+
+def get_keypair_pool() -> KeypairPool:
+    """Start one keypair producer per worker process on first use."""
+    global _keypair_pool, _keypair_pool_pid
+    with _keypair_pool_lock:
+        if _keypair_pool is None or _keypair_pool_pid != os.getpid():
+            # Keypairs are circuit-independent; any params will do.
+            _keypair_pool = KeypairPool(CircuitLatticeKEM({}).generate_keypair)
+            _keypair_pool_pid = os.getpid()
+            _keypair_pool.start()
+        return _keypair_pool
+
+
+def get_keystore() -> "keystore.KeyStore | None":
+    """This process's keystore, or None when PQC_KEYSTORE_KEY is unset.
+
+    Opened once per process: flock is per open file, so forked workers must
+    not share the master's descriptor.
+    """
+    global _keystore, _keystore_pid
+    if not keystore.KEYSTORE_KEY:
+        return None
+    with _keystore_lock:
+        if _keystore is None or _keystore_pid != os.getpid():
+            _keystore = keystore.KeyStore(keystore.KEYSTORE_PATH, keystore.KEYSTORE_KEY,
+                                          max_keys=keystore.KEYSTORE_MAX_KEYS)
+            _keystore_pid = os.getpid()
+        return _keystore
+
+
+def get_session_store():
+    """This process's session store (Redis clients do not survive fork either).
+
+    RuntimeError when SESSIONS_REQUIRE_SHARED is set and Redis is not usable.
+    """
+    global _session_store, _session_store_pid
+    with _session_store_lock:
+        if _session_store is None or _session_store_pid != os.getpid():
+            _session_store = sessions.create_store(require_shared=SESSIONS_REQUIRE_SHARED)
+            _session_store_pid = os.getpid()
+        return _session_store
+
+
+def _session_store_or_error():
+    """(store, None), or (None, 503 response) when sessions cannot be shared."""
+    try:
+        return get_session_store(), None
+    except RuntimeError as e:
+        return None, ({"error": str(e)}, 503)
+
+
+def status():
+    return {
+        "status": "online",
+        "algorithm": "ML-KEM-768",
+        "symmetric": "AES-256-GCM",
+        "keypair_pool": get_keypair_pool().stats(),
+        "params_cache": params_cache_stats(),
+        "keystore": get_keystore() is not None,
+        "sessions": _session_stats(),
+    }, 200
+
+
+def _session_stats() -> dict:
+    store, error = _session_store_or_error()
+    if error:
+        return {"backend": None, "error": error[0]["error"]}
+    return store.stats()
+
+
+def keypair(body):
+    """Generate a ML-KEM-768 keypair bound to the supplied circuit analysis.
+
+    SECURITY: Secret key is NEVER returned. With the keystore configured it is
+    stored server-side and the response carries an opaque key_handle for
+    /pqc/decrypt; otherwise the client must supply its own secret key.
+    """
+    body = body or {}
+    circuit_analysis = body.get("circuit_analysis", _DEFAULT_ANALYSIS)
+
+    enc = PostQuantumCircuitEncryption.from_analysis(circuit_analysis)
+    pk, sk = get_keypair_pool().take()
+
+    store = get_keystore()
+    response = {
+        "public_key": base64.b64encode(pk).decode(),
+        "secret_key_stored": store is not None,
+        "params": enc.describe(),
+    }
+    if store is not None:
+        try:
+            response["key_handle"] = store.put(sk)
+        except keystore.KeyStoreFull:
+            logger.warning("keystore full; refusing /pqc/keypair")
+            return {"error": "key store is full; delete unused key handles"}, 503
+    # SECURITY FIX: Never return secret_key to frontend
+    return response, 200
+
+
+def encrypt(body):
+    """
+    Encrypt a plaintext using ML-KEM-768 + AES-256-GCM.
+
+    Body: { circuit_analysis, public_key (b64), plaintext (str or b64 bytes) }
+    """
+    if not body:
+        return {"error": "missing body"}, 400
+
+    circuit_analysis = body.get("circuit_analysis", _DEFAULT_ANALYSIS)
+    pk_b64 = body.get("public_key")
+    plaintext = body.get("plaintext", "")
+
+    if not pk_b64:
+        return {"error": "public_key required"}, 400
+
+    try:
+        public_key = base64.b64decode(pk_b64)
+        enc = PostQuantumCircuitEncryption.from_analysis(circuit_analysis)
+        kem_ct, payload = enc.encrypt(plaintext, public_key)
+        return {
+            "kem_ciphertext": base64.b64encode(kem_ct).decode(),
+            "payload": base64.b64encode(payload).decode(),
+            "params": enc.describe(),
+        }, 200
+    except Exception:
+        logger.exception("encrypt error")
+        return {"error": "encryption failed"}, 500
+
+
+def decrypt(body):
+    """
+    Decrypt using ML-KEM-768 + AES-256-GCM.
+
+    Body: { circuit_analysis, secret_key (b64) | key_handle, kem_ciphertext (b64), payload (b64) }
+
+    SECURITY: secret_key was never returned by the keypair endpoint; the client
+    either supplies a key it manages itself or the key_handle the keystore issued.
+    """
+    if not body:
+        return {"error": "missing body"}, 400
+
+    circuit_analysis = body.get("circuit_analysis", _DEFAULT_ANALYSIS)
+    sk_b64 = body.get("secret_key")
+    key_handle = body.get("key_handle")
+    kem_ct_b64 = body.get("kem_ciphertext")
+    payload_b64 = body.get("payload")
+
+    if not all([sk_b64 or key_handle, kem_ct_b64, payload_b64]):
+        return {"error": "secret_key, kem_ciphertext, and payload required"}, 400
+
+    store = None if sk_b64 else get_keystore()
+    if not sk_b64 and store is None:
+        return {"error": "key_handle requires the sidecar keystore"}, 400
+
+    try:
+        if sk_b64:
+            secret_key = base64.b64decode(sk_b64)
+        else:
+            try:
+                secret_key = store.get(str(key_handle))
+            except KeyError:
+                return {"error": "unknown key_handle"}, 404
+        kem_ct = base64.b64decode(kem_ct_b64)
+        payload = base64.b64decode(payload_b64)
+
+        enc = PostQuantumCircuitEncryption.from_analysis(circuit_analysis)
+        plaintext = enc.decrypt(kem_ct, payload, secret_key)
+        return {"plaintext": plaintext.decode("utf-8", errors="replace")}, 200
+    except Exception:
+        logger.exception("decrypt error")
+        return {"error": "decryption failed"}, 500
+
+
+def delete_key(body):
+    """Delete a stored secret key. Body: { key_handle }. 404 if unknown."""
+    if not body or not body.get("key_handle"):
+        return {"error": "key_handle required"}, 400
+    store = get_keystore()
+    if store is None:
+        return {"error": "key_handle requires the sidecar keystore"}, 400
+    try:
+        store.delete(str(body["key_handle"]))
+    except KeyError:
+        return {"error": "unknown key_handle"}, 404
+    return {"deleted": True}, 200
+
+
+# ---------------------------------------------------------------------------
+# Batches
+# ---------------------------------------------------------------------------
+
+def _get_batch_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """One KEM thread pool per worker process (threads do not survive fork).
+    liboqs runs under ctypes with the GIL released, so the threads overlap."""
+    global _batch_executor, _batch_executor_pid
+    with _batch_executor_lock:
+        if _batch_executor is None or _batch_executor_pid != os.getpid():
+            _batch_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=BATCH_WORKERS, thread_name_prefix="pqc-batch")
+            _batch_executor_pid = os.getpid()
+        return _batch_executor
+
+
+def _batch_items(body):
+    """(items, None) or (None, error response) for a batch request body."""
+    if not body:
+        return None, ({"error": "missing body"}, 400)
+    items = body.get("items")
+    if not isinstance(items, list) or not items:
+        return None, ({"error": "items must be a non-empty list"}, 400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, ({"error": f"at most {BATCH_MAX_ITEMS} items per batch"}, 413)
+    return items, None
+
+
+def _b64_field(item, name):
+    value = item.get(name) if isinstance(item, dict) else None
+    if not value:
+        raise ValueError(f"{name} required")
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, TypeError):
+        raise ValueError(f"{name} is not valid base64") from None
+
+
+def _secret_key_from(source: dict, handle_cache: "dict | None" = None) -> bytes:
+    """
+    The secret key a request names: base64 secret_key, or key_handle looked up
+    in the keystore. ValueError for a missing/invalid key, KeyError for an
+    unknown handle.
+    """
+    if source.get("secret_key"):
+        return _b64_field(source, "secret_key")
+    handle = source.get("key_handle")
+    if not handle:
+        raise ValueError("secret_key or key_handle required")
+    store = get_keystore()
+    if store is None:
+        raise ValueError("key_handle requires the sidecar keystore")
+    handle = str(handle)
+    if handle_cache is None:
+        return store.get(handle)
+    if handle not in handle_cache:
+        handle_cache[handle] = store.get(handle)
+    return handle_cache[handle]
+
+
+def encrypt_batch(body):
+    """
+    Encrypt many plaintexts under one circuit analysis.
+
+    Body: { circuit_analysis, items: [{ public_key (b64), plaintext }] }
+    Returns one result per item, in order: { kem_ciphertext, payload } or
+    { error }. Lattice params are derived once for the whole batch.
+    """
+    items, error = _batch_items(body)
+    if error:
+        return error
+    try:
+        enc = PostQuantumCircuitEncryption.from_analysis(body.get("circuit_analysis", _DEFAULT_ANALYSIS))
+    except Exception:
+        logger.exception("encrypt_batch params error")
+        return {"error": "invalid circuit_analysis"}, 400
+
+    def encrypt_one(item):
+        try:
+            public_key = _b64_field(item, "public_key")
+        except ValueError as e:
+            return {"error": str(e)}
+        try:
+            kem_ct, payload = enc.encrypt(item.get("plaintext", ""), public_key)
+        except Exception:
+            logger.exception("encrypt_batch item error")
+            return {"error": "encryption failed"}
+        return {
+            "kem_ciphertext": base64.b64encode(kem_ct).decode(),
+            "payload": base64.b64encode(payload).decode(),
+        }
+
+    results = list(_get_batch_executor().map(encrypt_one, items))
+    return {"results": results, "params": enc.describe()}, 200
+
+
+def decrypt_batch(body):
+    """
+    Decrypt many payloads under one circuit analysis.
+
+    Body: { circuit_analysis, secret_key (b64) | key_handle,
+            items: [{ kem_ciphertext (b64), payload (b64), secret_key? | key_handle? }] }
+    A top-level key applies to every item that does not carry its own.
+    Each distinct (secret key, kem_ciphertext) pair is decapsulated once.
+    Returns one result per item, in order: { plaintext } or { error }.
+    """
+    items, error = _batch_items(body)
+    if error:
+        return error
+    try:
+        enc = PostQuantumCircuitEncryption.from_analysis(body.get("circuit_analysis", _DEFAULT_ANALYSIS))
+    except Exception:
+        logger.exception("decrypt_batch params error")
+        return {"error": "invalid circuit_analysis"}, 400
+
+    handle_keys = {}
+
+    def secret_key_for(item):
+        source = item if (item.get("secret_key") or item.get("key_handle")) else body
+        try:
+            return _secret_key_from(source, handle_keys)
+        except KeyError:
+            raise ValueError("unknown key_handle") from None
+
+    # Parse everything up front; a bad item only fails itself.
+    parsed = []
+    for item in items:
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("item must be an object")
+            parsed.append((secret_key_for(item), _b64_field(item, "kem_ciphertext"),
+                           _b64_field(item, "payload")))
+        except ValueError as e:
+            parsed.append(str(e))
+        except Exception:
+            logger.exception("decrypt_batch key error")
+            parsed.append("decryption failed")
+
+    def decapsulate(pair):
+        try:
+            return enc.kem.decapsulate(*pair)
+        except Exception:
+            logger.exception("decrypt_batch decapsulation error")
+            return None
+
+    pairs = list(dict.fromkeys((p[0], p[1]) for p in parsed if isinstance(p, tuple)))
+    aes_keys = dict(zip(pairs, _get_batch_executor().map(decapsulate, pairs)))
+
+    results = []
+    for p in parsed:
+        if isinstance(p, str):
+            results.append({"error": p})
+            continue
+        aes_key = aes_keys[(p[0], p[1])]
+        try:
+            if aes_key is None:
+                raise ValueError("decapsulation failed")
+            plaintext = enc.cipher.decrypt(p[2], aes_key)
+        except Exception:
+            results.append({"error": "decryption failed"})
+            continue
+        results.append({"plaintext": plaintext.decode("utf-8", errors="replace")})
+    return {"results": results, "decapsulations": len(pairs)}, 200
+
+
+# ---------------------------------------------------------------------------
+# Multi-recipient envelopes
+# ---------------------------------------------------------------------------
+
+def encrypt_envelope(body):
+    """
+    Encrypt one plaintext for many recipients: the payload is encrypted once
+    and its data key wrapped per recipient.
+
+    Body: { circuit_analysis, public_keys: [b64, ...], plaintext }
+    Returns { envelope (b64), recipients: [hex id, ...], params }.
+    """
+    if not body:
+        return {"error": "missing body"}, 400
+    public_keys = body.get("public_keys")
+    if not isinstance(public_keys, list) or not public_keys:
+        return {"error": "public_keys must be a non-empty list"}, 400
+    if len(public_keys) > BATCH_MAX_ITEMS:
+        return {"error": f"at most {BATCH_MAX_ITEMS} recipients per envelope"}, 413
+    try:
+        keys = [_b64_field({"public_key": pk}, "public_key") for pk in public_keys]
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    try:
+        enc = PostQuantumCircuitEncryption.from_analysis(body.get("circuit_analysis", _DEFAULT_ANALYSIS))
+        envelope = enc.encrypt_envelope(body.get("plaintext", ""), keys)
+        return {
+            "envelope": base64.b64encode(envelope).decode(),
+            "recipients": [rid.hex() for rid in envelope_recipients(envelope)],
+            "params": enc.describe(),
+        }, 200
+    except Exception:
+        logger.exception("encrypt_envelope error")
+        return {"error": "encryption failed"}, 500
+
+
+def decrypt_envelope(body):
+    """
+    Open the caller's slot of a multi-recipient envelope.
+
+    Body: { circuit_analysis, secret_key (b64) | key_handle, envelope (b64) }
+    404 when the envelope has no slot for that key.
+    """
+    if not body:
+        return {"error": "missing body"}, 400
+    if not all([body.get("secret_key") or body.get("key_handle"), body.get("envelope")]):
+        return {"error": "secret_key (or key_handle) and envelope required"}, 400
+
+    try:
+        secret_key = _secret_key_from(body)
+    except KeyError:
+        return {"error": "unknown key_handle"}, 404
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    try:
+        envelope = base64.b64decode(body["envelope"])
+        enc = PostQuantumCircuitEncryption.from_analysis(body.get("circuit_analysis", _DEFAULT_ANALYSIS))
+        plaintext = enc.decrypt_envelope(envelope, secret_key)
+    except LookupError:
+        return {"error": "no envelope slot for this key"}, 404
+    except Exception:
+        logger.exception("decrypt_envelope error")
+        return {"error": "decryption failed"}, 500
+    return {"plaintext": plaintext.decode("utf-8", errors="replace")}, 200
+
+
+# ---------------------------------------------------------------------------
+# Sessions
+# ---------------------------------------------------------------------------
+
+def _session_limits(body):
+    """(ttl, max_messages): the client may ask for less than the configured caps."""
+    ttl, max_messages = sessions.SESSION_TTL, sessions.SESSION_MAX_MESSAGES
+    try:
+        if body.get("ttl") is not None:
+            ttl = min(ttl, float(body["ttl"]))
+        if body.get("max_messages") is not None:
+            max_messages = min(max_messages, int(body["max_messages"]))
+    except (TypeError, ValueError):
+        raise ValueError("ttl and max_messages must be numbers") from None
+    if ttl <= 0 or max_messages <= 0:
+        raise ValueError("ttl and max_messages must be positive")
+    return ttl, max_messages
+
+
+def _session_response(session_id, session):
+    return {
+        "session_id": session_id,
+        "expires_at": session.expires_at,
+        "max_messages": session.max_messages,
+    }
+
+
+def session_open(body):
+    """
+    Encapsulate once to a recipient's public key and keep the AES key
+    server-side, so /pqc/session_encrypt can send many messages under it.
+
+    Body: { circuit_analysis, public_key (b64), ttl?, max_messages? }
+    Returns { session_id, kem_ciphertext (b64), expires_at, max_messages, params }.
+    The recipient passes kem_ciphertext to /pqc/session_accept.
+    """
+    if not body:
+        return {"error": "missing body"}, 400
+    try:
+        public_key = _b64_field(body, "public_key")
+        ttl, max_messages = _session_limits(body)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    store, error = _session_store_or_error()
+    if error:
+        return error
+
+    try:
+        enc = PostQuantumCircuitEncryption.from_analysis(body.get("circuit_analysis", _DEFAULT_ANALYSIS))
+        kem_ct, session = enc.open_session(public_key, ttl, max_messages)
+        session_id = store.put(session)
+    except Exception:
+        logger.exception("session_open error")
+        return {"error": "session setup failed"}, 500
+    response = _session_response(session_id, session)
+    response["kem_ciphertext"] = base64.b64encode(kem_ct).decode()
+    response["params"] = enc.describe()
+    return response, 200
+
+
+def session_accept(body):
+    """
+    Decapsulate a session's kem_ciphertext once; the returned session_id
+    decrypts that sender's messages via /pqc/session_decrypt.
+
+    Body: { circuit_analysis, secret_key (b64) | key_handle, kem_ciphertext (b64), ttl?, max_messages? }
+    """
+    if not body:
+        return {"error": "missing body"}, 400
+    if not all([body.get("secret_key") or body.get("key_handle"), body.get("kem_ciphertext")]):
+        return {"error": "secret_key (or key_handle) and kem_ciphertext required"}, 400
+    try:
+        secret_key = _secret_key_from(body)
+        kem_ct = _b64_field(body, "kem_ciphertext")
+        ttl, max_messages = _session_limits(body)
+    except KeyError:
+        return {"error": "unknown key_handle"}, 404
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    store, error = _session_store_or_error()
+    if error:
+        return error
+
+    try:
+        enc = PostQuantumCircuitEncryption.from_analysis(body.get("circuit_analysis", _DEFAULT_ANALYSIS))
+        session = enc.accept_session(kem_ct, secret_key, ttl, max_messages)
+        session_id = store.put(session)
+    except Exception:
+        logger.exception("session_accept error")
+        return {"error": "session setup failed"}, 500
+    return _session_response(session_id, session), 200
+
+
+def _session_call(body, field, name):
+    """Shared lookup / error mapping for session_encrypt and session_decrypt."""
+    if not body:
+        return None, ({"error": "missing body"}, 400)
+    if not body.get("session_id"):
+        return None, ({"error": "session_id required"}, 400)
+    store, error = _session_store_or_error()
+    if error:
+        return None, error
+    try:
+        session = store.get(str(body["session_id"]))
+    except KeyError:
+        return None, ({"error": "unknown or expired session"}, 404)
+    try:
+        if name == "encrypt":
+            return session.encrypt(body.get(field, "")), None
+        return session.decrypt(_b64_field(body, field)), None
+    except KeyError:
+        return None, ({"error": "unknown or expired session"}, 404)
+    except SessionExpired as e:
+        return None, ({"error": str(e)}, 410)
+    except PermissionError as e:
+        return None, ({"error": str(e)}, 409)
+    except ValueError as e:
+        return None, ({"error": str(e)}, 400)
+    except Exception:
+        logger.exception("session_%s error", name)
+        return None, ({"error": f"{name}ion failed"}, 500)
+
+
+def session_encrypt(body):
+    """
+    Encrypt one message under an open session: no KEM, a counter nonce.
+
+    Body: { session_id, plaintext (str) }
+    Returns { payload (b64) }, decryptable with /pqc/session_decrypt or, with
+    the session key, CircuitCipher.decrypt. 410 once the session is expired
+    or out of messages; 409 on a decrypt-only (accepted) session.
+    """
+    payload, error = _session_call(body, "plaintext", "encrypt")
+    if error:
+        return error
+    return {"payload": base64.b64encode(payload).decode()}, 200
+
+
+def session_decrypt(body):
+    """
+    Decrypt one message of a session.
+
+    Body: { session_id, payload (b64) }
+    """
+    plaintext, error = _session_call(body, "payload", "decrypt")
+    if error:
+        return error
+    return {"plaintext": plaintext.decode("utf-8", errors="replace")}, 200
+
+
+def session_close(body):
+    """Forget a session before it expires. Body: { session_id }"""
+    if not body or not body.get("session_id"):
+        return {"error": "session_id required"}, 400
+    store, error = _session_store_or_error()
+    if error:
+        return error
+    return {"closed": store.close(str(body["session_id"]))}, 200
+
+
+# POST operations by URL suffix (/pqc/<name>), shared by server.py and the
+# main backend's in-process engine.
+OPERATIONS = {
+    "keypair": keypair,
+    "encrypt": encrypt,
+    "decrypt": decrypt,
+    "delete_key": delete_key,
+    "encrypt_batch": encrypt_batch,
+    "decrypt_batch": decrypt_batch,
+    "encrypt_envelope": encrypt_envelope,
+    "decrypt_envelope": decrypt_envelope,
+    "session_open": session_open,
+    "session_accept": session_accept,
+    "session_encrypt": session_encrypt,
+    "session_decrypt": session_decrypt,
+    "session_close": session_close,
+}
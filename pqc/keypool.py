@@ -0,0 +1,142 @@
+"""
+keypool.py — Pre-generated ML-KEM keypairs for /pqc/keypair.
+
+ML-KEM keypairs do not depend on the circuit (the topology is only mixed in
+at encapsulation time by CircuitLatticeKEM._bind), so one pool per worker
+process serves every request. A background thread refills it at the lowest
+scheduling priority; callers take a pair in O(1) and fall back to inline
+generation when the pool is empty.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Keypairs kept ready per worker process. 0 disables the pool.
+KEYPAIR_POOL_SIZE = int(os.environ.get("PQC_KEYPAIR_POOL_SIZE", "32"))
+
+_RATE_WINDOW = 60.0  # seconds of production history behind refill_per_sec
+
+
+class KeypairPool:
+    """
+    Bounded pool of (public_key, secret_key) pairs with a refill thread.
+
+    take() never blocks on the producer: it pops a pooled pair or, when the
+    pool is empty, generates one inline and counts a miss.
+    """
+
+    def __init__(self, generate, capacity: int = KEYPAIR_POOL_SIZE, clock=time.monotonic):
+        self._generate = generate
+        self.capacity = capacity
+        self._clock = clock
+        self._pairs = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._produced_at = deque()
+        self.hits = 0
+        self.misses = 0
+        self.produced = 0
+        self.errors = 0
+
+    # -- Consumer side ---------------------------------------------------------
+
+    def take(self):
+        try:
+            pair = self._pairs.popleft()
+        except IndexError:
+            pair = None
+        with self._lock:
+            if pair is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._wake.set()
+        return pair if pair is not None else self._generate()
+
+    # -- Producer side ---------------------------------------------------------
+
+    def start(self) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="pqc-keypool", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._pairs.clear()
+
+    def fill_once(self) -> int:
+        """Top the pool up to capacity; returns how many pairs were added."""
+        added = 0
+        while len(self._pairs) < self.capacity and not self._stop.is_set():
+            try:
+                pair = self._generate()
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                logger.exception("keypair pool refill failed")
+                return added
+            self._pairs.append(pair)
+            self._record_production()
+            added += 1
+        return added
+
+    def _run(self) -> None:
+        _lower_thread_priority()
+        while not self._stop.is_set():
+            self._wake.clear()
+            errors = self.errors
+            self.fill_once()
+            if self.errors != errors:
+                # Back off, then retry without waiting for the next take().
+                self._stop.wait(1.0)
+                continue
+            self._wake.wait()
+
+    def _record_production(self) -> None:
+        now = self._clock()
+        with self._lock:
+            self.produced += 1
+            self._produced_at.append(now)
+            while self._produced_at and self._produced_at[0] < now - _RATE_WINDOW:
+                self._produced_at.popleft()
+
+    # -- Metrics ---------------------------------------------------------------
+
+    def stats(self) -> dict:
+        now = self._clock()
+        with self._lock:
+            recent = sum(1 for t in self._produced_at if t >= now - _RATE_WINDOW)
+            running = self._thread is not None and self._thread.is_alive()
+        return {
+            "capacity": self.capacity,
+            "depth": len(self._pairs),
+            "hits": self.hits,
+            "misses": self.misses,
+            "produced": self.produced,
+            "errors": self.errors,
+            "refill_per_sec": round(recent / _RATE_WINDOW, 3),
+            "running": running,
+        }
+
+
+def _lower_thread_priority() -> None:
+    # On Linux each thread is its own task, so this nices only the producer;
+    # liboqs keygen runs in ctypes with the GIL released, so request threads
+    # win the CPU whenever they need it.
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
@@ -0,0 +1,207 @@
+"""
+keystore.py — Encrypted-at-rest ML-KEM secret keys, addressed by opaque handle.
+
+/pqc/keypair stores the secret key here and returns a handle, so /pqc/decrypt
+can take the ~40-byte handle instead of a 2.4 KB base64 secret key and the
+sidecar can keep warm decapsulation contexts for it (lattice.DECAP_CACHE_SIZE).
+
+File layout: one 64-byte header, then fixed-size records appended in order,
+so record i lives at HEADER_SIZE + i * record_size and a lookup is one slice
+of a read-only mmap. Each record is
+
+    tag (16) || nonce (12) || AES-256-GCM(secret_key) (secret_len + 16)
+
+with AAD = magic || index || tag, so a record cannot be moved to another
+slot or paired with another handle. The handle is base64url(index || tag);
+the random tag makes handles unguessable even though indexes are sequential.
+
+Appends take an exclusive flock, so gunicorn workers can share one file;
+readers remap when a handle points past the region they have mapped.
+
+delete() zeroes a record in place. The file holds at most max_keys slots
+(PQC_KEYSTORE_MAX_KEYS); once it is that large, put() reuses a zeroed slot
+under a fresh tag, so old handles for the slot stay dead, and raises
+KeyStoreFull when every slot is live.
+"""
+
+import base64
+import fcntl
+import hmac
+import mmap
+import os
+import struct
+import threading
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+KEYSTORE_KEY = os.environ.get("PQC_KEYSTORE_KEY", "")
+KEYSTORE_PATH = os.environ.get("PQC_KEYSTORE_PATH", "/tmp/pqc-keystore.bin")
+KEYSTORE_MAX_KEYS = int(os.environ.get("PQC_KEYSTORE_MAX_KEYS", "100000"))
+
+MAGIC = b"FOLDKS01"
+HEADER_SIZE = 64
+_TAG_LEN = 16
+_FREE_TAG = bytes(_TAG_LEN)
+_NONCE_LEN = 12
+_HANDLE = struct.Struct(">Q16s")
+# magic || record_size || secret_len || check nonce || check tag
+_HEADER = struct.Struct(">8sII12s16s")
+
+ML_KEM_768_SECRET_KEY_LEN = 2400
+
+
+class KeyStoreFull(RuntimeError):
+    """Every one of the store's max_keys slots holds a live key."""
+
+
+def _derive_key(passphrase: str) -> bytes:
+    return HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=None, info=b"fold-pqc-keystore-v1",
+    ).derive(passphrase.encode())
+
+
+class KeyStore:
+    """Append-only file of encrypted secret keys; see module docstring."""
+
+    def __init__(self, path: str, passphrase: str, secret_len: int = ML_KEM_768_SECRET_KEY_LEN,
+                 max_keys: int = KEYSTORE_MAX_KEYS):
+        if not passphrase:
+            raise ValueError("PQC_KEYSTORE_KEY must be set to use the keystore")
+        self.path = path
+        self.secret_len = secret_len
+        self.max_keys = max(1, max_keys)
+        self.record_size = _TAG_LEN + _NONCE_LEN + secret_len + 16
+        self._aead = AESGCM(_derive_key(passphrase))
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._init_header()
+        self._mm = None
+        self._mapped_records = -1
+        self._remap()
+
+    # -- File management -------------------------------------------------------
+
+    def _init_header(self) -> None:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                nonce = os.urandom(_NONCE_LEN)
+                check = self._aead.encrypt(nonce, b"", MAGIC)
+                header = _HEADER.pack(MAGIC, self.record_size, self.secret_len, nonce, check)
+                os.pwrite(self._fd, header.ljust(HEADER_SIZE, b"\0"), 0)
+                os.fsync(self._fd)
+            raw = os.pread(self._fd, _HEADER.size, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if len(raw) != _HEADER.size:
+            raise ValueError(f"{self.path} is not a PQC keystore")
+        magic, record_size, secret_len, nonce, check = _HEADER.unpack(raw)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a PQC keystore")
+        if (record_size, secret_len) != (self.record_size, self.secret_len):
+            raise ValueError(f"{self.path} holds {secret_len}-byte keys, not {self.secret_len}")
+        try:
+            self._aead.decrypt(nonce, check, MAGIC)
+        except InvalidTag:
+            raise ValueError(f"PQC_KEYSTORE_KEY does not match {self.path}") from None
+
+    def _remap(self) -> None:
+        with self._lock:
+            size = os.fstat(self._fd).st_size
+            records = (size - HEADER_SIZE) // self.record_size
+            if records == self._mapped_records:
+                return
+            # Readers may still hold the previous map; it is released once
+            # the last of them drops it.
+            self._mm = mmap.mmap(self._fd, HEADER_SIZE + records * self.record_size,
+                                 prot=mmap.PROT_READ)
+            self._mapped_records = records
+
+    def close(self) -> None:
+        self._mm = None
+        os.close(self._fd)
+
+    def __len__(self) -> int:
+        self._remap()
+        return self._mapped_records
+
+    # -- Records ---------------------------------------------------------------
+
+    def _aad(self, index: int, tag: bytes) -> bytes:
+        return MAGIC + index.to_bytes(8, "big") + tag
+
+    def put(self, secret_key: bytes) -> str:
+        """Encrypt and append secret_key; returns its handle."""
+        if len(secret_key) != self.secret_len:
+            raise ValueError(f"secret key must be {self.secret_len} bytes")
+        tag = os.urandom(_TAG_LEN)
+        nonce = os.urandom(_NONCE_LEN)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self._fd).st_size
+            index = (size - HEADER_SIZE) // self.record_size
+            if index >= self.max_keys:
+                index = self._free_slot()
+            offset = HEADER_SIZE + index * self.record_size
+            ct = self._aead.encrypt(nonce, secret_key, self._aad(index, tag))
+            os.pwrite(self._fd, tag + nonce + ct, offset)
+            # A handle we hand out must survive a crash.
+            os.fdatasync(self._fd)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return base64.urlsafe_b64encode(_HANDLE.pack(index, tag)).decode().rstrip("=")
+
+    def _free_slot(self) -> int:
+        """Index of a deleted record. Caller holds the exclusive flock."""
+        self._remap()
+        mm = self._mm
+        for index in range(self._mapped_records):
+            offset = HEADER_SIZE + index * self.record_size
+            if mm[offset:offset + _TAG_LEN] == _FREE_TAG:
+                return index
+        raise KeyStoreFull(f"{self.path} holds {self.max_keys} live keys")
+
+    def _locate(self, handle: str) -> "tuple[int, bytes]":
+        """(index, tag) of a live record. KeyError if the handle is unknown."""
+        try:
+            index, tag = _HANDLE.unpack(base64.urlsafe_b64decode(handle + "=" * (-len(handle) % 4)))
+        except (ValueError, TypeError, struct.error):
+            raise KeyError("unknown key handle") from None
+        if tag == _FREE_TAG:
+            raise KeyError("unknown key handle")
+        if index >= self._mapped_records:
+            self._remap()
+            if index >= self._mapped_records:
+                raise KeyError("unknown key handle")
+        return index, tag
+
+    def get(self, handle: str) -> bytes:
+        """Secret key for handle. KeyError if the handle is unknown or deleted."""
+        index, tag = self._locate(handle)
+        offset = HEADER_SIZE + index * self.record_size
+        record = self._mm[offset:offset + self.record_size]
+        if not hmac.compare_digest(record[:_TAG_LEN], tag):
+            raise KeyError("unknown key handle")
+        nonce = record[_TAG_LEN:_TAG_LEN + _NONCE_LEN]
+        try:
+            return self._aead.decrypt(nonce, record[_TAG_LEN + _NONCE_LEN:], self._aad(index, tag))
+        except InvalidTag:
+            raise ValueError(f"keystore record {index} is corrupt") from None
+
+    def delete(self, handle: str) -> None:
+        """Zero handle's record so its slot can be reused. KeyError if unknown."""
+        index, tag = self._locate(handle)
+        offset = HEADER_SIZE + index * self.record_size
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # Re-read under the lock: another worker may have deleted or
+            # reused the slot since we looked.
+            if not hmac.compare_digest(os.pread(self._fd, _TAG_LEN, offset), tag):
+                raise KeyError("unknown key handle")
+            os.pwrite(self._fd, bytes(self.record_size), offset)
+            os.fdatasync(self._fd)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
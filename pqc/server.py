@@ -2,9 +2,10 @@
 server.py — PQC encryption service
 Exposes the PostQuantumCircuitEncryption pipeline over HTTP.
 Meant to run alongside (or replace) the main fold backend.
+Request handling lives in handlers.py so the main backend can run the same
+operations in-process.
 """
 
-import base64
 import ipaddress
 import os
 import logging
@@ -16,7 +17,7 @@ from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
-from lattice import PostQuantumCircuitEncryption, derive_lattice_params
+import handlers
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
@@ -41,8 +42,7 @@ if not API_KEY:
     )
 
 # Optional Redis backend for Flask-Limiter. Without it, rate limits are
-# per-worker (fine when the sidecar runs as a single process, as in the default
-# Docker setup, but inaccurate under multi-worker deployments).
+# per-worker: each gunicorn worker (PQC_WORKERS) keeps its own counters.
 REDIS_URL = os.environ.get("REDIS_URL", "").strip()
 
 app = Flask(__name__)
@@ -53,9 +53,8 @@ if REDIS_URL:
     _limiter_kwargs["storage_uri"] = REDIS_URL
 else:
     logger.info(
-        "REDIS_URL not set; Flask-Limiter is using in-memory storage. "
-        "Fine for the single-process sidecar default; set REDIS_URL if you "
-        "run multiple workers."
+        "REDIS_URL not set; Flask-Limiter is using in-memory storage, so "
+        "limits are counted per worker. Set REDIS_URL when PQC_WORKERS > 1."
     )
 limiter = Limiter(
     get_remote_address,
@@ -82,101 +81,113 @@ def require_api_key(f):
 
 @app.route("/pqc/status")
 def status():
-    return jsonify({"status": "online", "algorithm": "ML-KEM-768", "symmetric": "AES-256-GCM"})
+    payload, code = handlers.status()
+    return jsonify(payload), code
 
 
 @app.route("/pqc/keypair", methods=["POST"])
 @require_api_key
 @limiter.limit("20 per minute")
 def keypair():
-    """Generate a ML-KEM-768 keypair bound to the supplied circuit analysis.
-    
-    SECURITY: Secret key is NEVER returned. It must be stored securely server-side
-    or provided by the client for subsequent decrypt operations.
-    """
-    body = request.get_json(silent=True) or {}
-    circuit_analysis = body.get("circuit_analysis", {"summary": {}, "connections": []})
-
-    enc = PostQuantumCircuitEncryption.from_analysis(circuit_analysis)
-    pk, _ = enc.generate_keypair()
-
-    # SECURITY FIX: Never return secret_key to frontend
-    return jsonify({
-        "public_key": base64.b64encode(pk).decode(),
-        "secret_key_stored": True,  # Indicate key was generated but not returned
-        "params": enc.describe(),
-    })
+    payload, code = handlers.keypair(request.get_json(silent=True))
+    return jsonify(payload), code
 
 
 @app.route("/pqc/encrypt", methods=["POST"])
 @require_api_key
 @limiter.limit("30 per minute")
 def encrypt():
-    """
-    Encrypt a plaintext using ML-KEM-768 + AES-256-GCM.
-
-    Body: { circuit_analysis, public_key (b64), plaintext (str or b64 bytes) }
-    """
-    body = request.get_json(silent=True)
-    if not body:
-        return jsonify({"error": "missing body"}), 400
-
-    circuit_analysis = body.get("circuit_analysis", {"summary": {}, "connections": []})
-    pk_b64 = body.get("public_key")
-    plaintext = body.get("plaintext", "")
-
-    if not pk_b64:
-        return jsonify({"error": "public_key required"}), 400
-
-    try:
-        public_key = base64.b64decode(pk_b64)
-        enc = PostQuantumCircuitEncryption.from_analysis(circuit_analysis)
-        kem_ct, payload = enc.encrypt(plaintext, public_key)
-        return jsonify({
-            "kem_ciphertext": base64.b64encode(kem_ct).decode(),
-            "payload": base64.b64encode(payload).decode(),
-            "params": enc.describe(),
-        })
-    except Exception:
-        logger.exception("encrypt error")
-        return jsonify({"error": "encryption failed"}), 500
+    payload, code = handlers.encrypt(request.get_json(silent=True))
+    return jsonify(payload), code
 
 
 @app.route("/pqc/decrypt", methods=["POST"])
 @require_api_key
 @limiter.limit("30 per minute")
 def decrypt():
-    """
-    Decrypt using ML-KEM-768 + AES-256-GCM.
-
-    Body: { circuit_analysis, secret_key (b64), kem_ciphertext (b64), payload (b64) }
-    
-    SECURITY: secret_key must be provided by client - it was never returned by keypair endpoint.
-    The client is responsible for secure key storage.
-    """
-    body = request.get_json(silent=True)
-    if not body:
-        return jsonify({"error": "missing body"}), 400
-
-    circuit_analysis = body.get("circuit_analysis", {"summary": {}, "connections": []})
-    sk_b64 = body.get("secret_key")
-    kem_ct_b64 = body.get("kem_ciphertext")
-    payload_b64 = body.get("payload")
-
-    if not all([sk_b64, kem_ct_b64, payload_b64]):
-        return jsonify({"error": "secret_key, kem_ciphertext, and payload required"}), 400
-
-    try:
-        secret_key = base64.b64decode(sk_b64)
-        kem_ct = base64.b64decode(kem_ct_b64)
-        payload = base64.b64decode(payload_b64)
-
-        enc = PostQuantumCircuitEncryption.from_analysis(circuit_analysis)
-        plaintext = enc.decrypt(kem_ct, payload, secret_key)
-        return jsonify({"plaintext": plaintext.decode("utf-8", errors="replace")})
-    except Exception:
-        logger.exception("decrypt error")
-        return jsonify({"error": "decryption failed"}), 500
+    payload, code = handlers.decrypt(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+@app.route("/pqc/delete_key", methods=["POST"])
+@require_api_key
+@limiter.limit("30 per minute")
+def delete_key():
+    payload, code = handlers.delete_key(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+@app.route("/pqc/encrypt_batch", methods=["POST"])
+@require_api_key
+@limiter.limit("10 per minute")
+def encrypt_batch():
+    payload, code = handlers.encrypt_batch(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+@app.route("/pqc/decrypt_batch", methods=["POST"])
+@require_api_key
+@limiter.limit("10 per minute")
+def decrypt_batch():
+    payload, code = handlers.decrypt_batch(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+@app.route("/pqc/encrypt_envelope", methods=["POST"])
+@require_api_key
+@limiter.limit("10 per minute")
+def encrypt_envelope():
+    payload, code = handlers.encrypt_envelope(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+@app.route("/pqc/decrypt_envelope", methods=["POST"])
+@require_api_key
+@limiter.limit("30 per minute")
+def decrypt_envelope():
+    payload, code = handlers.decrypt_envelope(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+# Sessions: setup pays for the KEM once, per-message calls are AES-GCM only.
+@app.route("/pqc/session_open", methods=["POST"])
+@require_api_key
+@limiter.limit("20 per minute")
+def session_open():
+    payload, code = handlers.session_open(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+@app.route("/pqc/session_accept", methods=["POST"])
+@require_api_key
+@limiter.limit("20 per minute")
+def session_accept():
+    payload, code = handlers.session_accept(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+@app.route("/pqc/session_encrypt", methods=["POST"])
+@require_api_key
+@limiter.limit("300 per minute")
+def session_encrypt():
+    payload, code = handlers.session_encrypt(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+@app.route("/pqc/session_decrypt", methods=["POST"])
+@require_api_key
+@limiter.limit("300 per minute")
+def session_decrypt():
+    payload, code = handlers.session_decrypt(request.get_json(silent=True))
+    return jsonify(payload), code
+
+
+@app.route("/pqc/session_close", methods=["POST"])
+@require_api_key
+@limiter.limit("60 per minute")
+def session_close():
+    payload, code = handlers.session_close(request.get_json(silent=True))
+    return jsonify(payload), code
 
 
 if __name__ == "__main__":
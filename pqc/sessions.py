@@ -0,0 +1,264 @@
+"""
+sessions.py — Server-side PQC sessions: encapsulate once, encrypt many.
+
+/pqc/session_open runs one ML-KEM encapsulation and keeps the resulting
+lattice.CircuitSession under a random session id, so later messages cost one
+AES-GCM call and carry a 12-byte counter nonce instead of a fresh 1088-byte
+kem_ciphertext.
+
+Two backends:
+
+* MemorySessionStore — per worker process. Sessions live in the worker that
+  opened them, so it is only used with a single worker: gunicorn.conf.py
+  refuses to start several sidecar workers without Redis, and the main
+  backend's in-process engine answers 503 to session calls instead.
+* RedisSessionStore — used when REDIS_URL is set and the redis package is
+  importable. The AES key is kept wrapped (AES-GCM under a key derived from
+  API_KEY); the message counter and the highest decrypted sequence number
+  are Redis hash fields updated atomically, so every worker hands out
+  distinct nonces and rejects the same replays. Each worker still caches the
+  unwrapped AESGCM instance for sessions it has seen.
+
+Both enforce PQC_SESSION_TTL and PQC_SESSION_MAX_MESSAGES.
+"""
+
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from lattice import CircuitSession, SessionExpired
+
+logger = logging.getLogger(__name__)
+
+# Seconds a session stays usable after it is opened.
+SESSION_TTL = float(os.environ.get("PQC_SESSION_TTL", "900"))
+# Messages (encrypts or decrypts) allowed per session before a new one is needed.
+SESSION_MAX_MESSAGES = int(os.environ.get("PQC_SESSION_MAX_MESSAGES", "100000"))
+# Sessions held per worker (memory store) or cached per worker (Redis store).
+SESSION_CACHE_SIZE = int(os.environ.get("PQC_SESSION_CACHE_SIZE", "1024"))
+
+_REDIS_PREFIX = "fold:pqc:session:"
+# Bump the counter only if the session still exists, so a late message cannot
+# resurrect an expired or closed session as a fresh hash.
+_RESERVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+return redis.call('HINCRBY', KEYS[1], 'used', 1)
+"""
+# Raise the highest decrypted sequence number, shared by every worker:
+# 1 if ARGV[1] is above it, 0 for a replay, -1 if the session is gone.
+_ADVANCE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+if tonumber(ARGV[1]) <= tonumber(redis.call('HGET', KEYS[1], 'seen') or '0') then return 0 end
+redis.call('HSET', KEYS[1], 'seen', ARGV[1])
+return 1
+"""
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(18)
+
+
+class MemorySessionStore:
+    """Bounded LRU of live sessions in this process."""
+
+    backend = "memory"
+
+    def __init__(self, capacity: int = SESSION_CACHE_SIZE, clock=time.time):
+        self.capacity = capacity
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def put(self, session: CircuitSession) -> str:
+        session_id = new_session_id()
+        with self._lock:
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.capacity:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        return session_id
+
+    def get(self, session_id: str) -> CircuitSession:
+        """Live session for session_id. KeyError if unknown or expired."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise KeyError("unknown or expired session")
+            if session.expired():
+                del self._sessions[session_id]
+                raise KeyError("unknown or expired session")
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def close(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": self.backend, "sessions": len(self._sessions),
+                    "capacity": self.capacity, "evicted": self.evicted}
+
+
+class _RedisSession(CircuitSession):
+    """CircuitSession whose message counters live in a Redis hash."""
+
+    def __init__(self, client, redis_key: str, reserve, advance, **kwargs):
+        super().__init__(**kwargs)
+        self._client = client
+        self._redis_key = redis_key
+        self._reserve_script = reserve
+        self._advance_script = advance
+
+    def _reserve(self) -> int:
+        used = int(self._reserve_script(keys=[self._redis_key], client=self._client))
+        if used < 0:
+            # Closed or expired through another worker since we cached it.
+            raise KeyError("unknown or expired session")
+        if used > self.max_messages:
+            raise SessionExpired("session message limit reached")
+        return used
+
+    def _advance(self, counter: int) -> None:
+        accepted = int(self._advance_script(keys=[self._redis_key], args=[counter],
+                                            client=self._client))
+        if accepted < 0:
+            raise KeyError("unknown or expired session")
+        if accepted == 0:
+            raise ValueError("replayed or out-of-order session message")
+        super()._advance(counter)
+
+
+class RedisSessionStore:
+    """Sessions shared by every worker through Redis; see module docstring."""
+
+    backend = "redis"
+
+    def __init__(self, client, api_key: str, capacity: int = SESSION_CACHE_SIZE,
+                 clock=time.time):
+        self._client = client
+        self._wrap = AESGCM(HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None, info=b"fold-pqc-session-v1",
+        ).derive(api_key.encode()))
+        self._reserve = client.register_script(_RESERVE_SCRIPT)
+        self._advance = client.register_script(_ADVANCE_SCRIPT)
+        self._clock = clock
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, session_id: str) -> str:
+        return _REDIS_PREFIX + session_id
+
+    def put(self, session: CircuitSession) -> str:
+        session_id = new_session_id()
+        key = self._key(session_id)
+        nonce = os.urandom(12)
+        wrapped = nonce + self._wrap.encrypt(nonce, session.export_key(), key.encode())
+        ttl = max(1, int(session.expires_at - self._clock()))
+        pipe = self._client.pipeline()
+        pipe.hset(key, mapping={
+            "key": wrapped,
+            "aad": session.aad,
+            "can_encrypt": int(session.can_encrypt),
+            "expires_at": repr(session.expires_at),
+            "max_messages": session.max_messages,
+            "used": 0,
+        })
+        pipe.expire(key, ttl)
+        pipe.execute()
+        return session_id
+
+    def get(self, session_id: str) -> CircuitSession:
+        """Live session for session_id. KeyError if unknown or expired."""
+        with self._lock:
+            session = self._cache.get(session_id)
+            if session is not None:
+                self._cache.move_to_end(session_id)
+        if session is None:
+            session = self._load(session_id)
+        if session.expired():
+            self._forget(session_id)
+            raise KeyError("unknown or expired session")
+        return session
+
+    def _load(self, session_id: str) -> CircuitSession:
+        key = self._key(session_id)
+        record = self._client.hgetall(key)
+        if not record:
+            raise KeyError("unknown or expired session")
+        wrapped = record[b"key"]
+        try:
+            aes_key = self._wrap.decrypt(wrapped[:12], wrapped[12:], key.encode())
+        except InvalidTag:
+            raise KeyError("unknown or expired session") from None
+        session = _RedisSession(
+            self._client, key, self._reserve, self._advance,
+            aes_key=aes_key, aad=record[b"aad"],
+            can_encrypt=record[b"can_encrypt"] == b"1",
+            ttl=0, max_messages=int(record[b"max_messages"]), clock=self._clock,
+            expires_at=float(record[b"expires_at"]),
+        )
+        with self._lock:
+            self._cache[session_id] = session
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return session
+
+    def _forget(self, session_id: str) -> None:
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    def close(self, session_id: str) -> bool:
+        self._forget(session_id)
+        return bool(self._client.delete(self._key(session_id)))
+
+    def ping(self) -> None:
+        self._client.ping()
+
+    def stats(self) -> dict:
+        with self._lock:
+            cached = len(self._cache)
+        return {"backend": self.backend, "cached": cached, "capacity": self.capacity}
+
+
+def create_store(require_shared: bool = False):
+    """Redis-backed store when REDIS_URL is set and usable, else in-memory.
+
+    With require_shared (several workers serving sessions), a store the other
+    workers cannot see is an error rather than a logged warning, and Redis
+    must answer a PING.
+    """
+    redis_url = os.environ.get("REDIS_URL", "")
+    api_key = os.environ.get("API_KEY", "")
+    if not redis_url:
+        problem = "REDIS_URL is not set"
+    elif not api_key:
+        problem = "API_KEY is not set"
+    else:
+        try:
+            import redis
+        except ImportError:
+            problem = "the redis package is not installed"
+        else:
+            store = RedisSessionStore(redis.Redis.from_url(redis_url), api_key)
+            if require_shared:
+                try:
+                    store.ping()
+                except redis.RedisError as e:
+                    raise RuntimeError(f"PQC session store: Redis at REDIS_URL is unreachable ({e})") from e
+            return store
+    if require_shared:
+        raise RuntimeError(f"PQC sessions need Redis with several worker processes, but {problem}")
+    if redis_url:
+        logger.warning("PQC sessions are per-worker: %s", problem)
+    return MemorySessionStore()
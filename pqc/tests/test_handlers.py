@@ -0,0 +1,355 @@
+"""Tests for the transport-independent handlers shared by server.py and the
+main backend's in-process PQC engine."""
+
+import base64
+
+import pytest
+
+import handlers
+import keystore
+import sessions
+from lattice import PostQuantumCircuitEncryption
+
+ANALYSIS = {"summary": {"num_cards": 2, "card_types": ["logic"]}, "connections": []}
+
+
+def test_status_shape():
+    payload, status = handlers.status()
+    assert status == 200
+    assert payload["algorithm"] == "ML-KEM-768"
+    assert payload["keypair_pool"]["capacity"] >= 0
+
+
+def test_keypair_served_from_pool():
+    pool = handlers.get_keypair_pool()
+    pool.fill_once()
+    before = pool.stats()["hits"]
+    payload, status = handlers.keypair({"circuit_analysis": ANALYSIS})
+    assert status == 200
+    assert pool.stats()["hits"] == before + 1
+
+
+def test_keypair_never_returns_secret_key():
+    payload, status = handlers.keypair({"circuit_analysis": ANALYSIS})
+    assert status == 200
+    assert "secret_key" not in payload
+    assert base64.b64decode(payload["public_key"])
+
+
+def test_encrypt_decrypt_roundtrip():
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pk, sk = enc.generate_keypair()
+    payload, status = handlers.encrypt({
+        "circuit_analysis": ANALYSIS,
+        "public_key": base64.b64encode(pk).decode(),
+        "plaintext": "in-process",
+    })
+    assert status == 200
+    payload, status = handlers.decrypt({
+        "circuit_analysis": ANALYSIS,
+        "secret_key": base64.b64encode(sk).decode(),
+        "kem_ciphertext": payload["kem_ciphertext"],
+        "payload": payload["payload"],
+    })
+    assert (payload, status) == ({"plaintext": "in-process"}, 200)
+
+
+def test_validation_errors():
+    assert handlers.encrypt(None) == ({"error": "missing body"}, 400)
+    assert handlers.encrypt({"plaintext": "x"}) == ({"error": "public_key required"}, 400)
+    assert handlers.decrypt({"secret_key": "eA=="})[1] == 400
+
+
+def test_decrypt_failure_is_opaque():
+    payload, status = handlers.decrypt({
+        "secret_key": "eA==", "kem_ciphertext": "eA==", "payload": "eA==",
+    })
+    assert (payload, status) == ({"error": "decryption failed"}, 500)
+
+
+def test_operations_table():
+    assert set(handlers.OPERATIONS) == {
+        "keypair", "encrypt", "decrypt", "delete_key", "encrypt_batch", "decrypt_batch",
+        "encrypt_envelope", "decrypt_envelope", "session_open", "session_accept",
+        "session_encrypt", "session_decrypt", "session_close",
+    }
+
+
+@pytest.fixture
+def with_keystore(monkeypatch, tmp_path):
+    monkeypatch.setattr(keystore, "KEYSTORE_KEY", "handler-test-passphrase")
+    monkeypatch.setattr(keystore, "KEYSTORE_PATH", str(tmp_path / "keys.bin"))
+    monkeypatch.setattr(handlers, "_keystore", None)
+
+
+def test_keypair_without_keystore_returns_no_handle(monkeypatch):
+    monkeypatch.setattr(keystore, "KEYSTORE_KEY", "")
+    payload, status = handlers.keypair({"circuit_analysis": ANALYSIS})
+    assert status == 200
+    assert payload["secret_key_stored"] is False
+    assert "key_handle" not in payload
+    body = {"key_handle": "x", "kem_ciphertext": "eA==", "payload": "eA=="}
+    assert handlers.decrypt(body)[1] == 400
+
+
+def test_decrypt_with_key_handle(with_keystore):
+    keys, status = handlers.keypair({"circuit_analysis": ANALYSIS})
+    assert status == 200 and keys["secret_key_stored"] is True
+    sealed, _ = handlers.encrypt({
+        "circuit_analysis": ANALYSIS, "public_key": keys["public_key"], "plaintext": "by handle",
+    })
+    payload, status = handlers.decrypt({
+        "circuit_analysis": ANALYSIS,
+        "key_handle": keys["key_handle"],
+        "kem_ciphertext": sealed["kem_ciphertext"],
+        "payload": sealed["payload"],
+    })
+    assert (payload, status) == ({"plaintext": "by handle"}, 200)
+
+
+def test_unknown_key_handle(with_keystore):
+    body = {"key_handle": "A" * 32, "kem_ciphertext": "eA==", "payload": "eA=="}
+    assert handlers.decrypt(body) == ({"error": "unknown key_handle"}, 404)
+
+
+def test_delete_key(with_keystore):
+    keys, _ = handlers.keypair({"circuit_analysis": ANALYSIS})
+    assert handlers.delete_key({"key_handle": keys["key_handle"]}) == ({"deleted": True}, 200)
+    assert handlers.delete_key({"key_handle": keys["key_handle"]})[1] == 404
+    body = {"key_handle": keys["key_handle"], "kem_ciphertext": "eA==", "payload": "eA=="}
+    assert handlers.decrypt(body) == ({"error": "unknown key_handle"}, 404)
+    assert handlers.delete_key({})[1] == 400
+
+
+def test_keypair_when_keystore_full(with_keystore, monkeypatch):
+    monkeypatch.setattr(keystore, "KEYSTORE_MAX_KEYS", 1)
+    assert handlers.keypair({"circuit_analysis": ANALYSIS})[1] == 200
+    assert handlers.keypair({"circuit_analysis": ANALYSIS})[1] == 503
+
+
+def _sealed_items(pk, messages):
+    payload, status = handlers.encrypt_batch({
+        "circuit_analysis": ANALYSIS,
+        "items": [{"public_key": base64.b64encode(pk).decode(), "plaintext": m} for m in messages],
+    })
+    assert status == 200
+    return payload["results"]
+
+
+def test_encrypt_batch_then_decrypt_batch():
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pk, sk = enc.generate_keypair()
+    sealed = _sealed_items(pk, ["a", "b", "c"])
+    payload, status = handlers.decrypt_batch({
+        "circuit_analysis": ANALYSIS,
+        "secret_key": base64.b64encode(sk).decode(),
+        "items": sealed,
+    })
+    assert status == 200
+    assert payload["results"] == [{"plaintext": m} for m in "abc"]
+    assert payload["decapsulations"] == 3
+
+
+def test_decrypt_batch_dedupes_kem_ciphertexts():
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pk, sk = enc.generate_keypair()
+    kem_ct, aes_key = enc.kem.encapsulate(pk)
+    items = [
+        {"kem_ciphertext": base64.b64encode(kem_ct).decode(),
+         "payload": base64.b64encode(enc.cipher.encrypt(m, aes_key)).decode()}
+        for m in ("one", "two", "three")
+    ]
+    payload, _ = handlers.decrypt_batch({
+        "circuit_analysis": ANALYSIS, "secret_key": base64.b64encode(sk).decode(), "items": items,
+    })
+    assert [r["plaintext"] for r in payload["results"]] == ["one", "two", "three"]
+    assert payload["decapsulations"] == 1
+
+
+def test_batch_item_errors_do_not_fail_the_batch():
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pk, sk = enc.generate_keypair()
+    good = _sealed_items(pk, ["ok"])[0]
+    tampered = dict(good, payload=base64.b64encode(b"\0" * 40).decode())
+    payload, status = handlers.decrypt_batch({
+        "circuit_analysis": ANALYSIS,
+        "secret_key": base64.b64encode(sk).decode(),
+        "items": [good, {"payload": good["payload"]}, tampered, "nope", dict(good, kem_ciphertext="!!")],
+    })
+    assert status == 200
+    results = payload["results"]
+    assert results[0] == {"plaintext": "ok"}
+    assert results[1] == {"error": "kem_ciphertext required"}
+    assert results[2] == {"error": "decryption failed"}
+    assert results[3] == {"error": "item must be an object"}
+    assert results[4] == {"error": "kem_ciphertext is not valid base64"}
+
+    sealed = handlers.encrypt_batch({"items": [{"plaintext": "x"}]})[0]["results"]
+    assert sealed == [{"error": "public_key required"}]
+
+
+def test_batch_limits(monkeypatch):
+    assert handlers.encrypt_batch({"items": []})[1] == 400
+    assert handlers.decrypt_batch(None)[1] == 400
+    monkeypatch.setattr(handlers, "BATCH_MAX_ITEMS", 2)
+    assert handlers.encrypt_batch({"items": [{}] * 3})[1] == 413
+
+
+def test_decrypt_batch_with_key_handle(with_keystore):
+    keys, _ = handlers.keypair({"circuit_analysis": ANALYSIS})
+    sealed = _sealed_items(base64.b64decode(keys["public_key"]), ["h1", "h2"])
+    payload, _ = handlers.decrypt_batch({
+        "circuit_analysis": ANALYSIS, "key_handle": keys["key_handle"], "items": sealed,
+    })
+    assert payload["results"] == [{"plaintext": "h1"}, {"plaintext": "h2"}]
+
+
+def test_envelope_round_trip_for_each_recipient():
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pairs = [enc.generate_keypair() for _ in range(3)]
+    sealed, status = handlers.encrypt_envelope({
+        "circuit_analysis": ANALYSIS,
+        "public_keys": [base64.b64encode(pk).decode() for pk, _ in pairs],
+        "plaintext": "to all",
+    })
+    assert status == 200
+    assert len(sealed["recipients"]) == 3
+    for _, sk in pairs:
+        payload, status = handlers.decrypt_envelope({
+            "circuit_analysis": ANALYSIS,
+            "secret_key": base64.b64encode(sk).decode(),
+            "envelope": sealed["envelope"],
+        })
+        assert (payload, status) == ({"plaintext": "to all"}, 200)
+
+
+def test_envelope_non_recipient_gets_404():
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    (pk, _), (_, outsider) = enc.generate_keypair(), enc.generate_keypair()
+    sealed, _ = handlers.encrypt_envelope({
+        "circuit_analysis": ANALYSIS, "public_keys": [base64.b64encode(pk).decode()], "plaintext": "x",
+    })
+    payload, status = handlers.decrypt_envelope({
+        "circuit_analysis": ANALYSIS,
+        "secret_key": base64.b64encode(outsider).decode(),
+        "envelope": sealed["envelope"],
+    })
+    assert status == 404
+
+
+def test_envelope_validation():
+    assert handlers.encrypt_envelope({"public_keys": []})[1] == 400
+    assert handlers.encrypt_envelope({"public_keys": ["!!"]}) == (
+        {"error": "public_key is not valid base64"}, 400)
+    assert handlers.decrypt_envelope({"envelope": "eA=="})[1] == 400
+
+
+@pytest.fixture
+def memory_sessions(monkeypatch):
+    store = sessions.MemorySessionStore(capacity=16)
+    monkeypatch.setattr(handlers, "get_session_store", lambda: store)
+    return store
+
+
+def _open_session(pk, **limits):
+    payload, status = handlers.session_open(dict(
+        {"circuit_analysis": ANALYSIS, "public_key": base64.b64encode(pk).decode()}, **limits))
+    assert status == 200
+    return payload
+
+
+def test_session_round_trip(memory_sessions):
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pk, sk = enc.generate_keypair()
+    opened = _open_session(pk)
+    accepted, status = handlers.session_accept({
+        "circuit_analysis": ANALYSIS,
+        "secret_key": base64.b64encode(sk).decode(),
+        "kem_ciphertext": opened["kem_ciphertext"],
+    })
+    assert status == 200
+    assert accepted["session_id"] != opened["session_id"]
+    for message in ("first", "second", "third"):
+        sealed, status = handlers.session_encrypt({"session_id": opened["session_id"], "plaintext": message})
+        assert status == 200
+        payload, status = handlers.session_decrypt({
+            "session_id": accepted["session_id"], "payload": sealed["payload"],
+        })
+        assert (payload, status) == ({"plaintext": message}, 200)
+
+
+def test_session_payload_opens_with_one_shot_decrypt(memory_sessions):
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pk, sk = enc.generate_keypair()
+    opened = _open_session(pk)
+    sealed, _ = handlers.session_encrypt({"session_id": opened["session_id"], "plaintext": "compat"})
+    payload, status = handlers.decrypt({
+        "circuit_analysis": ANALYSIS,
+        "secret_key": base64.b64encode(sk).decode(),
+        "kem_ciphertext": opened["kem_ciphertext"],
+        "payload": sealed["payload"],
+    })
+    assert (payload, status) == ({"plaintext": "compat"}, 200)
+
+
+def test_session_message_limit_and_close(memory_sessions):
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pk, _ = enc.generate_keypair()
+    opened = _open_session(pk, max_messages=2)
+    assert opened["max_messages"] == 2
+    body = {"session_id": opened["session_id"], "plaintext": "x"}
+    assert handlers.session_encrypt(body)[1] == 200
+    assert handlers.session_encrypt(body)[1] == 200
+    assert handlers.session_encrypt(body) == ({"error": "session message limit reached"}, 410)
+    assert handlers.session_close({"session_id": opened["session_id"]}) == ({"closed": True}, 200)
+    assert handlers.session_encrypt(body) == ({"error": "unknown or expired session"}, 404)
+
+
+def test_accepted_session_is_decrypt_only(memory_sessions):
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pk, sk = enc.generate_keypair()
+    opened = _open_session(pk)
+    accepted, _ = handlers.session_accept({
+        "circuit_analysis": ANALYSIS,
+        "secret_key": base64.b64encode(sk).decode(),
+        "kem_ciphertext": opened["kem_ciphertext"],
+    })
+    assert handlers.session_encrypt({"session_id": accepted["session_id"], "plaintext": "x"})[1] == 409
+
+
+def test_session_replay_rejected(memory_sessions):
+    enc = PostQuantumCircuitEncryption.from_analysis(ANALYSIS)
+    pk, sk = enc.generate_keypair()
+    opened = _open_session(pk)
+    accepted, _ = handlers.session_accept({
+        "circuit_analysis": ANALYSIS,
+        "secret_key": base64.b64encode(sk).decode(),
+        "kem_ciphertext": opened["kem_ciphertext"],
+    })
+    sealed, _ = handlers.session_encrypt({"session_id": opened["session_id"], "plaintext": "once"})
+    body = {"session_id": accepted["session_id"], "payload": sealed["payload"]}
+    assert handlers.session_decrypt(body) == ({"plaintext": "once"}, 200)
+    assert handlers.session_decrypt(body) == ({"error": "replayed or out-of-order session message"}, 400)
+
+
+def test_unshared_sessions_refused_with_several_workers(monkeypatch):
+    monkeypatch.setattr(handlers, "SESSIONS_REQUIRE_SHARED", True)
+    monkeypatch.setattr(handlers, "_session_store", None)
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    pk, _ = PostQuantumCircuitEncryption.from_analysis(ANALYSIS).generate_keypair()
+    payload, status = handlers.session_open({"public_key": base64.b64encode(pk).decode()})
+    assert status == 503
+    assert "need Redis" in payload["error"]
+    assert handlers.session_encrypt({"session_id": "s", "plaintext": "x"})[1] == 503
+    assert handlers.session_close({"session_id": "s"})[1] == 503
+    assert handlers.status()[0]["sessions"]["backend"] is None
+
+
+def test_session_validation(memory_sessions):
+    assert handlers.session_open({"plaintext": "x"}) == ({"error": "public_key required"}, 400)
+    assert handlers.session_open({"public_key": "eA==", "ttl": "soon"})[1] == 400
+    assert handlers.session_open({"public_key": "eA==", "max_messages": 0})[1] == 400
+    assert handlers.session_accept({"kem_ciphertext": "eA=="})[1] == 400
+    assert handlers.session_encrypt({"plaintext": "x"}) == ({"error": "session_id required"}, 400)
+    assert handlers.session_decrypt({"session_id": "nope", "payload": "eA=="})[1] == 404
+    assert handlers.session_close({}) == ({"error": "session_id required"}, 400)
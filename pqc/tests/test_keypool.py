@@ -0,0 +1,81 @@
+"""Tests for the pre-generated keypair pool behind /pqc/keypair."""
+
+import itertools
+import time
+
+from keypool import KeypairPool
+
+
+def counter_generator():
+    counter = itertools.count()
+
+    def generate():
+        n = next(counter)
+        return b"pk%d" % n, b"sk%d" % n
+
+    return generate
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+class TestKeypairPool:
+    def test_empty_pool_generates_inline(self):
+        pool = KeypairPool(counter_generator(), capacity=4)
+        assert pool.take() == (b"pk0", b"sk0")
+        assert (pool.stats()["hits"], pool.stats()["misses"]) == (0, 1)
+
+    def test_fill_once_is_bounded(self):
+        pool = KeypairPool(counter_generator(), capacity=3)
+        assert pool.fill_once() == 3
+        assert pool.fill_once() == 0
+        assert pool.stats()["depth"] == 3
+
+    def test_pooled_pairs_are_handed_out_once(self):
+        pool = KeypairPool(counter_generator(), capacity=3)
+        pool.fill_once()
+        taken = [pool.take() for _ in range(4)]
+        assert len(set(taken)) == 4
+        stats = pool.stats()
+        assert (stats["hits"], stats["misses"], stats["depth"]) == (3, 1, 0)
+
+    def test_background_refill(self):
+        pool = KeypairPool(counter_generator(), capacity=5)
+        pool.start()
+        try:
+            assert wait_for(lambda: pool.stats()["depth"] == 5)
+            for _ in range(5):
+                pool.take()
+            assert wait_for(lambda: pool.stats()["depth"] == 5)
+            stats = pool.stats()
+            assert stats["running"] is True
+            assert stats["produced"] >= 10
+            assert stats["refill_per_sec"] > 0
+        finally:
+            pool.stop()
+
+    def test_refill_rate_window(self):
+        now = [1000.0]
+        pool = KeypairPool(counter_generator(), capacity=6, clock=lambda: now[0])
+        pool.fill_once()
+        assert pool.stats()["refill_per_sec"] == 0.1
+        now[0] += 61
+        assert pool.stats()["refill_per_sec"] == 0.0
+
+    def test_generator_errors_are_counted(self):
+        def broken():
+            raise RuntimeError("liboqs unavailable")
+
+        pool = KeypairPool(broken, capacity=2)
+        assert pool.fill_once() == 0
+        assert pool.stats()["errors"] == 1
+
+    def test_zero_capacity_disables_producer(self):
+        pool = KeypairPool(counter_generator(), capacity=0)
+        pool.start()
+        assert pool.stats()["running"] is False
+        assert pool.take() == (b"pk0", b"sk0")
@@ -0,0 +1,121 @@
+"""Tests for the encrypted, handle-addressed secret-key store."""
+
+import os
+
+import pytest
+
+from keystore import HEADER_SIZE, KeyStore, KeyStoreFull
+
+SECRET_LEN = 64
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "keys.bin")
+
+
+def open_store(path, passphrase="test-passphrase", max_keys=1000):
+    return KeyStore(path, passphrase, secret_len=SECRET_LEN, max_keys=max_keys)
+
+
+class TestKeyStore:
+    def test_round_trip(self, path):
+        store = open_store(path)
+        keys = [os.urandom(SECRET_LEN) for _ in range(5)]
+        handles = [store.put(k) for k in keys]
+        assert len(set(handles)) == 5
+        assert [store.get(h) for h in handles] == keys
+        assert len(store) == 5
+
+    def test_fixed_size_records(self, path):
+        store = open_store(path)
+        store.put(os.urandom(SECRET_LEN))
+        store.put(os.urandom(SECRET_LEN))
+        assert os.path.getsize(path) == HEADER_SIZE + 2 * store.record_size
+
+    def test_secret_key_not_stored_in_plaintext(self, path):
+        store = open_store(path)
+        key = os.urandom(SECRET_LEN)
+        store.put(key)
+        with open(path, "rb") as f:
+            assert key not in f.read()
+
+    def test_reopen_with_same_key(self, path):
+        handle = open_store(path).put(b"k" * SECRET_LEN)
+        assert open_store(path).get(handle) == b"k" * SECRET_LEN
+
+    def test_wrong_passphrase_refused(self, path):
+        open_store(path).put(b"k" * SECRET_LEN)
+        with pytest.raises(ValueError, match="does not match"):
+            open_store(path, "another-passphrase")
+
+    def test_second_handle_sees_other_writers(self, path):
+        # Two stores on one file stand in for two gunicorn workers.
+        reader = open_store(path)
+        writer = open_store(path)
+        handle = writer.put(b"w" * SECRET_LEN)
+        assert reader.get(handle) == b"w" * SECRET_LEN
+
+    def test_forged_or_unknown_handles(self, path):
+        store = open_store(path)
+        handle = store.put(b"k" * SECRET_LEN)
+        other = open_store(str(path) + "2").put(b"x" * SECRET_LEN)
+        for bad in (other, "", "not-a-handle", handle[:-2] + "AA", "A" * 32):
+            with pytest.raises(KeyError):
+                store.get(bad)
+
+    def test_tampered_record_detected(self, path):
+        store = open_store(path)
+        handle = store.put(b"k" * SECRET_LEN)
+        with open(path, "r+b") as f:
+            f.seek(HEADER_SIZE + store.record_size - 1)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([last[0] ^ 1]))
+        with pytest.raises(ValueError, match="corrupt"):
+            open_store(path).get(handle)
+
+    def test_rejects_wrong_key_length(self, path):
+        with pytest.raises(ValueError):
+            open_store(path).put(b"short")
+
+    def test_passphrase_required(self, path):
+        with pytest.raises(ValueError):
+            KeyStore(path, "")
+
+    def test_file_is_private(self, path):
+        open_store(path)
+        assert os.stat(path).st_mode & 0o077 == 0
+
+    def test_delete(self, path):
+        store = open_store(path)
+        handle = store.put(b"k" * SECRET_LEN)
+        other = store.put(b"o" * SECRET_LEN)
+        store.delete(handle)
+        with pytest.raises(KeyError):
+            store.get(handle)
+        with pytest.raises(KeyError):
+            store.delete(handle)
+        assert store.get(other) == b"o" * SECRET_LEN
+
+    def test_delete_seen_by_other_workers(self, path):
+        reader = open_store(path)
+        writer = open_store(path)
+        handle = writer.put(b"w" * SECRET_LEN)
+        assert reader.get(handle) == b"w" * SECRET_LEN
+        writer.delete(handle)
+        with pytest.raises(KeyError):
+            reader.get(handle)
+
+    def test_bounded_file_reuses_deleted_slots(self, path):
+        store = open_store(path, max_keys=2)
+        first = store.put(b"1" * SECRET_LEN)
+        store.put(b"2" * SECRET_LEN)
+        with pytest.raises(KeyStoreFull):
+            store.put(b"3" * SECRET_LEN)
+        store.delete(first)
+        third = store.put(b"3" * SECRET_LEN)
+        assert os.path.getsize(path) == HEADER_SIZE + 2 * store.record_size
+        assert store.get(third) == b"3" * SECRET_LEN
+        with pytest.raises(KeyError):
+            store.get(first)
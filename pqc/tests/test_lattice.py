@@ -1,11 +1,25 @@
 """Tests for post-quantum circuit lattice encryption."""
 
+import os
+import struct
+import threading
+
 import pytest
+
+import lattice
 from lattice import (
     derive_lattice_params,
     CircuitLatticeKEM,
     CircuitCipher,
+    CircuitSession,
     PostQuantumCircuitEncryption,
+    SessionExpired,
+    envelope_recipients,
+    kem_context_stats,
+    params_cache_stats,
+    public_key_from_secret_key,
+    recipient_id,
+    self_test,
 )
 
 
@@ -91,6 +105,57 @@ class TestDeriveParams:
         p = derive_lattice_params(COMPLEX_ANALYSIS)
         assert 0 < p["gate_mod"] < 257
 
+    def test_connection_packing_matches_struct(self):
+        connections = [
+            {"fromX": 0.1, "fromY": -2, "toX": 1e39, "toY": 3.5},
+            {"fromX": 7},
+            {},
+        ]
+        expected = b"".join(
+            struct.pack("4f", c.get("fromX", 0.0), c.get("fromY", 0.0),
+                        c.get("toX", 0.0), c.get("toY", 0.0))
+            for c in connections
+        )
+        assert lattice._pack_connections(connections) == expected
+        assert lattice._pack_connections([]) == b""
+
+    @pytest.mark.parametrize("bad", [None, "1.5", b"1", [1.0]])
+    def test_connection_packing_rejects_non_numbers_like_struct(self, bad):
+        connections = [{"fromX": 1.0, "fromY": 2.0}, {"toX": bad}]
+        with pytest.raises(struct.error):
+            struct.pack("4f", 0.0, 0.0, bad, 0.0)
+        with pytest.raises(struct.error):
+            lattice._pack_connections(connections)
+
+    def test_cached_result_matches_fresh_derivation(self, monkeypatch):
+        cached = derive_lattice_params(COMPLEX_ANALYSIS)
+        cached_again = derive_lattice_params(COMPLEX_ANALYSIS)
+        monkeypatch.setattr(lattice, "PARAMS_CACHE_SIZE", 0)
+        assert cached == cached_again == derive_lattice_params(COMPLEX_ANALYSIS)
+
+    def test_cache_hit_returns_a_copy(self):
+        p1 = derive_lattice_params(SIMPLE_ANALYSIS)
+        p1["noise_vector"].append(99)
+        p1["gate_mod"] = -1
+        before = params_cache_stats()["hits"]
+        p2 = derive_lattice_params(SIMPLE_ANALYSIS)
+        assert params_cache_stats()["hits"] == before + 1
+        assert p2["noise_vector"] == p1["noise_vector"][:-1]
+        assert p2["gate_mod"] > 0
+
+    def test_cache_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(lattice, "PARAMS_CACHE_SIZE", 3)
+        for n in range(10):
+            derive_lattice_params({"summary": {"num_nodes": n}, "connections": []})
+        assert params_cache_stats()["size"] <= 3
+
+    def test_unused_fields_share_cache_entry(self):
+        a = dict(SIMPLE_ANALYSIS, nodes=[{"id": "n1"}])
+        before = params_cache_stats()["hits"]
+        derive_lattice_params(SIMPLE_ANALYSIS)
+        derive_lattice_params(a)
+        assert params_cache_stats()["hits"] >= before + 1
+
 
 # ---------------------------------------------------------------------------
 # KEM round-trip
@@ -125,6 +190,120 @@ class TestKEM:
         assert len(sk) == 2400   # ML-KEM-768 secret key
 
 
+# ---------------------------------------------------------------------------
+# Reused liboqs contexts
+# ---------------------------------------------------------------------------
+
+class TestKemContexts:
+    def test_repeat_decapsulation_reuses_context(self):
+        kem = CircuitLatticeKEM(derive_lattice_params(SIMPLE_ANALYSIS))
+        pk, sk = kem.generate_keypair()
+        before = kem_context_stats()
+        for _ in range(3):
+            ct, key = kem.encapsulate(pk)
+            assert kem.decapsulate(sk, ct) == key
+        after = kem_context_stats()
+        assert after["decap_misses"] - before["decap_misses"] == 1
+        assert after["decap_hits"] - before["decap_hits"] == 2
+
+    def test_lru_bounds_cached_secret_keys(self, monkeypatch):
+        monkeypatch.setattr(lattice, "DECAP_CACHE_SIZE", 2)
+        kem = CircuitLatticeKEM(derive_lattice_params(SIMPLE_ANALYSIS))
+        keys = [kem.generate_keypair() for _ in range(3)]
+        for pk, sk in keys + keys[:1]:
+            ct, key = kem.encapsulate(pk)
+            assert kem.decapsulate(sk, ct) == key
+        assert kem_context_stats()["decap_cached"] == 2
+
+    def test_cache_disabled(self, monkeypatch):
+        monkeypatch.setattr(lattice, "DECAP_CACHE_SIZE", 0)
+        kem = CircuitLatticeKEM(derive_lattice_params(SIMPLE_ANALYSIS))
+        pk, sk = kem.generate_keypair()
+        before = kem_context_stats()
+        ct, key = kem.encapsulate(pk)
+        assert kem.decapsulate(sk, ct) == key
+        assert kem_context_stats()["decap_misses"] == before["decap_misses"]
+
+    def test_keygen_context_does_not_keep_secret_key(self):
+        kem = CircuitLatticeKEM(derive_lattice_params(SIMPLE_ANALYSIS))
+        kem.generate_keypair()
+        shared = lattice._thread_contexts().shared[0]
+        assert not any(bytes(shared.secret_key))
+
+    def test_contexts_are_per_thread(self):
+        kem = CircuitLatticeKEM(derive_lattice_params(SIMPLE_ANALYSIS))
+        pk, sk = kem.generate_keypair()
+        ct, key = kem.encapsulate(pk)
+        kem.decapsulate(sk, ct)
+        seen = {}
+
+        def worker():
+            seen["fresh"] = kem_context_stats()["decap_cached"]
+            seen["key"] = kem.decapsulate(sk, ct)
+
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+        assert seen == {"fresh": 0, "key": key}
+
+
+# ---------------------------------------------------------------------------
+# Multi-recipient envelopes
+# ---------------------------------------------------------------------------
+
+class TestEnvelope:
+    def setup_method(self):
+        self.enc = PostQuantumCircuitEncryption.from_analysis(SIMPLE_ANALYSIS)
+        self.pairs = [self.enc.generate_keypair() for _ in range(3)]
+
+    def test_public_key_recoverable_from_secret_key(self):
+        for pk, sk in self.pairs:
+            assert public_key_from_secret_key(sk) == pk
+
+    def test_every_recipient_decrypts(self):
+        env = self.enc.encrypt_envelope(b"shared doc", [pk for pk, _ in self.pairs])
+        for _, sk in self.pairs:
+            assert self.enc.decrypt_envelope(env, sk) == b"shared doc"
+
+    def test_payload_encrypted_once(self):
+        msg = os.urandom(4096)
+        one = self.enc.encrypt_envelope(msg, [self.pairs[0][0]])
+        three = self.enc.encrypt_envelope(msg, [pk for pk, _ in self.pairs])
+        slot = (len(three) - len(one)) // 2
+        assert len(three) == len(one) + 2 * slot
+        assert slot < 2048
+
+    def test_recipient_ids_in_order_and_deduplicated(self):
+        pks = [pk for pk, _ in self.pairs]
+        env = self.enc.encrypt_envelope(b"x", pks + pks[:1])
+        assert envelope_recipients(env) == [recipient_id(pk) for pk in pks]
+
+    def test_non_recipient_raises_lookup_error(self):
+        env = self.enc.encrypt_envelope(b"x", [self.pairs[0][0]])
+        with pytest.raises(LookupError):
+            self.enc.decrypt_envelope(env, self.pairs[1][1])
+
+    def test_other_topology_cannot_open(self):
+        env = self.enc.encrypt_envelope(b"x", [self.pairs[0][0]])
+        other = PostQuantumCircuitEncryption.from_analysis(COMPLEX_ANALYSIS)
+        with pytest.raises(Exception):
+            other.decrypt_envelope(env, self.pairs[0][1])
+
+    def test_dropping_a_slot_breaks_the_payload(self):
+        pks = [pk for pk, _ in self.pairs[:2]]
+        env = self.enc.encrypt_envelope(b"x", pks)
+        magic, count, ct_len = struct.unpack_from(">4sHH", env)
+        slot_len = 16 + ct_len + 48
+        stripped = struct.pack(">4sHH", magic, 1, ct_len) + env[8 + slot_len:]
+        with pytest.raises(Exception):
+            self.enc.decrypt_envelope(stripped, self.pairs[1][1])
+
+    def test_malformed_envelopes(self):
+        for bad in (b"", b"XXXX\x00\x01\x00\x10", b"PQE1\x00\x05\x04\x40" + b"\x00" * 10):
+            with pytest.raises(ValueError):
+                self.enc.decrypt_envelope(bad, self.pairs[0][1])
+
+
 # ---------------------------------------------------------------------------
 # Symmetric cipher
 # ---------------------------------------------------------------------------
@@ -170,6 +349,51 @@ class TestCircuitCipher:
             c2.decrypt(ct, key)
 
 
+class TestCircuitSession:
+    def setup_method(self):
+        self.enc = PostQuantumCircuitEncryption.from_analysis(SIMPLE_ANALYSIS)
+        self.pk, self.sk = self.enc.generate_keypair()
+
+    def test_one_encapsulation_many_messages(self):
+        kem_ct, sender = self.enc.open_session(self.pk, ttl=60, max_messages=10)
+        receiver = self.enc.accept_session(kem_ct, self.sk, ttl=60, max_messages=10)
+        for msg in (b"a", b"b", b"c"):
+            assert receiver.decrypt(sender.encrypt(msg)) == msg
+        assert sender.used == receiver.used == 3
+
+    def test_counter_nonces_are_sequential(self):
+        _, sender = self.enc.open_session(self.pk, ttl=60, max_messages=10)
+        nonces = [sender.encrypt(b"x")[:12] for _ in range(3)]
+        assert nonces == [n.to_bytes(12, "big") for n in (1, 2, 3)]
+
+    def test_payload_matches_circuit_cipher_format(self):
+        kem_ct, sender = self.enc.open_session(self.pk, ttl=60, max_messages=10)
+        assert self.enc.decrypt(kem_ct, sender.encrypt("compat"), self.sk) == b"compat"
+
+    def test_message_limit(self):
+        _, sender = self.enc.open_session(self.pk, ttl=60, max_messages=2)
+        sender.encrypt(b"1")
+        sender.encrypt(b"2")
+        with pytest.raises(SessionExpired):
+            sender.encrypt(b"3")
+
+    def test_expiry(self):
+        now = [1000.0]
+        session = CircuitSession(os.urandom(32), b"aad", can_encrypt=True, ttl=5,
+                                 max_messages=10, clock=lambda: now[0])
+        session.encrypt(b"ok")
+        now[0] += 5
+        assert session.expired()
+        with pytest.raises(SessionExpired):
+            session.encrypt(b"late")
+
+    def test_accepted_session_cannot_encrypt(self):
+        kem_ct, _ = self.enc.open_session(self.pk, ttl=60, max_messages=10)
+        receiver = self.enc.accept_session(kem_ct, self.sk, ttl=60, max_messages=10)
+        with pytest.raises(PermissionError):
+            receiver.encrypt(b"x")
+
+
 # ---------------------------------------------------------------------------
 # Full pipeline
 # ---------------------------------------------------------------------------
@@ -203,3 +427,11 @@ class TestPostQuantumCircuitEncryption:
         kem_ct, payload = enc1.encrypt("isolated", pk1)
         with pytest.raises(Exception):
             enc2.decrypt(kem_ct, payload, sk1)
+
+    def test_self_test_passes(self):
+        assert self_test()["kem_algorithm"] == "ML-KEM-768"
+
+    def test_self_test_reports_mismatch(self, monkeypatch):
+        monkeypatch.setattr(CircuitCipher, "decrypt", lambda self, ct, key: b"wrong")
+        with pytest.raises(RuntimeError, match="mismatch"):
+            self_test()
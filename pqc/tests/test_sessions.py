@@ -0,0 +1,218 @@
+"""Tests for the sidecar session store."""
+
+import os
+import sys
+import types
+
+import pytest
+
+import sessions
+from lattice import CircuitSession, SessionExpired
+
+
+def _session(clock, ttl=10):
+    return CircuitSession(os.urandom(32), b"aad", can_encrypt=True, ttl=ttl,
+                          max_messages=5, clock=clock)
+
+
+def test_put_get_close():
+    store = sessions.MemorySessionStore(capacity=4)
+    session = _session(lambda: 0.0)
+    session_id = store.put(session)
+    assert store.get(session_id) is session
+    assert store.close(session_id) is True
+    assert store.close(session_id) is False
+    with pytest.raises(KeyError):
+        store.get(session_id)
+
+
+def test_expired_sessions_are_dropped():
+    now = [0.0]
+    store = sessions.MemorySessionStore(capacity=4)
+    session_id = store.put(_session(lambda: now[0], ttl=10))
+    now[0] = 10.0
+    with pytest.raises(KeyError):
+        store.get(session_id)
+    assert store.stats()["sessions"] == 0
+
+
+def test_capacity_evicts_least_recently_used():
+    store = sessions.MemorySessionStore(capacity=2)
+    first = store.put(_session(lambda: 0.0))
+    second = store.put(_session(lambda: 0.0))
+    store.get(first)
+    store.put(_session(lambda: 0.0))
+    store.get(first)
+    with pytest.raises(KeyError):
+        store.get(second)
+    assert store.stats() == {"backend": "memory", "sessions": 2, "capacity": 2, "evicted": 1}
+
+
+def test_session_ids_are_unique_and_opaque():
+    store = sessions.MemorySessionStore()
+    ids = {store.put(_session(lambda: 0.0)) for _ in range(50)}
+    assert len(ids) == 50
+    assert all(len(i) >= 24 for i in ids)
+
+
+def test_decrypt_rejects_replayed_and_reordered_messages():
+    session = _session(lambda: 0.0)
+    payloads = [session.encrypt(str(i)) for i in range(3)]
+    assert session.decrypt(payloads[1]) == b"1"
+    for payload in (payloads[0], payloads[1]):
+        with pytest.raises(ValueError, match="replayed"):
+            session.decrypt(payload)
+    assert session.decrypt(payloads[2]) == b"2"
+
+
+def test_forged_message_does_not_advance_the_window():
+    session = _session(lambda: 0.0)
+    payload = session.encrypt("real")
+    forged = (2 ** 40).to_bytes(12, "big") + payload[12:]
+    with pytest.raises(Exception):
+        session.decrypt(forged)
+    assert session.decrypt(payload) == b"real"
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for RedisSessionStore; one instance stands
+    in for the shared server, so two stores on it act like two workers."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.ttls = {}
+
+    def register_script(self, source):
+        # Stand-ins for the Lua scripts, which only touch an existing hash.
+        def reserve(keys, client):
+            record = client.hashes.get(keys[0])
+            if record is None:
+                return -1
+            record[b"used"] = str(int(record[b"used"]) + 1).encode()
+            return int(record[b"used"])
+
+        def advance(keys, args, client):
+            record = client.hashes.get(keys[0])
+            if record is None:
+                return -1
+            if args[0] <= int(record.get(b"seen", b"0")):
+                return 0
+            record[b"seen"] = str(args[0]).encode()
+            return 1
+        return advance if source is sessions._ADVANCE_SCRIPT else reserve
+
+    def pipeline(self):
+        return self
+
+    def hset(self, key, mapping):
+        self.hashes[key] = {
+            k.encode(): v if isinstance(v, bytes) else str(v).encode() for k, v in mapping.items()
+        }
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+
+    def execute(self):
+        pass
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def delete(self, key):
+        return 1 if self.hashes.pop(key, None) is not None else 0
+
+    def ping(self):
+        return True
+
+
+class TestRedisSessionStore:
+    def setup_method(self):
+        self.redis = FakeRedis()
+        self.now = [0.0]
+        clock = lambda: self.now[0]  # noqa: E731
+        self.workers = [sessions.RedisSessionStore(self.redis, "api-key", clock=clock)
+                        for _ in range(2)]
+        self.session_id = self.workers[0].put(
+            CircuitSession(os.urandom(32), b"aad", can_encrypt=True, ttl=60,
+                           max_messages=3, clock=clock))
+
+    def test_key_wrapped_and_ttl_set(self):
+        key = sessions._REDIS_PREFIX + self.session_id
+        assert self.redis.ttls[key] == 60
+        assert len(self.redis.hashes[key][b"key"]) == 12 + 32 + 16
+
+    def test_workers_share_one_nonce_counter(self):
+        a, b = (w.get(self.session_id) for w in self.workers)
+        nonces = [a.encrypt(b"1")[:12], b.encrypt(b"2")[:12], a.encrypt(b"3")[:12]]
+        assert nonces == [n.to_bytes(12, "big") for n in (1, 2, 3)]
+        with pytest.raises(SessionExpired):
+            b.encrypt(b"4")
+
+    def test_payload_opens_in_other_worker(self):
+        sealed = self.workers[0].get(self.session_id).encrypt(b"hello")
+        assert self.workers[1].get(self.session_id).decrypt(sealed) == b"hello"
+
+    def test_replay_rejected_by_every_worker(self):
+        session_id = self.workers[0].put(
+            CircuitSession(os.urandom(32), b"aad", can_encrypt=True, ttl=60,
+                           max_messages=10, clock=lambda: self.now[0]))
+        sender = self.workers[0].get(session_id)
+        first, second = sender.encrypt(b"1"), sender.encrypt(b"2")
+        assert self.workers[1].get(session_id).decrypt(second) == b"2"
+        for worker in self.workers:
+            for payload in (first, second):
+                with pytest.raises(ValueError, match="replayed"):
+                    worker.get(session_id).decrypt(payload)
+
+    def test_export_key_is_the_session_key(self):
+        original = CircuitSession(os.urandom(32), b"aad", can_encrypt=True, ttl=60,
+                                  max_messages=3, clock=lambda: self.now[0])
+        session_id = self.workers[0].put(original)
+        assert self.workers[1].get(session_id).export_key() == original.export_key()
+
+    def test_close_seen_by_every_worker(self):
+        cached = self.workers[1].get(self.session_id)
+        assert self.workers[0].close(self.session_id) is True
+        with pytest.raises(KeyError):
+            self.workers[0].get(self.session_id)
+        with pytest.raises(KeyError):
+            cached.encrypt(b"late")
+
+    def test_expiry(self):
+        self.now[0] = 60.0
+        with pytest.raises(KeyError):
+            self.workers[1].get(self.session_id)
+
+    def test_wrong_api_key_cannot_unwrap(self):
+        other = sessions.RedisSessionStore(self.redis, "other-key")
+        with pytest.raises(KeyError):
+            other.get(self.session_id)
+
+
+class TestCreateStore:
+    def test_memory_allowed_for_one_worker(self, monkeypatch):
+        monkeypatch.delenv("REDIS_URL", raising=False)
+        assert sessions.create_store().backend == "memory"
+
+    def test_several_workers_require_redis(self, monkeypatch):
+        monkeypatch.delenv("REDIS_URL", raising=False)
+        with pytest.raises(RuntimeError, match="REDIS_URL is not set"):
+            sessions.create_store(require_shared=True)
+
+    def test_several_workers_require_redis_package(self, monkeypatch):
+        monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/1")
+        monkeypatch.setenv("API_KEY", "api-key")
+        monkeypatch.setitem(sys.modules, "redis", None)
+        assert sessions.create_store().backend == "memory"
+        with pytest.raises(RuntimeError, match="redis package"):
+            sessions.create_store(require_shared=True)
+
+    def test_redis_store_when_available(self, monkeypatch):
+        monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/1")
+        monkeypatch.setenv("API_KEY", "api-key")
+        fake = types.SimpleNamespace(
+            Redis=types.SimpleNamespace(from_url=lambda url: FakeRedis()),
+            RedisError=Exception,
+        )
+        monkeypatch.setitem(sys.modules, "redis", fake)
+        assert sessions.create_store(require_shared=True).backend == "redis"
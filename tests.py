@@ -9,6 +9,11 @@ public API. The tests below validate the new contract:
   CircuitEncryption(circuit_params=None)
     .encrypt(plaintext, password) -> bytes (base64)
     .decrypt(ciphertext, password) -> str | bytes
+    .encrypt_raw(plaintext, password) -> bytes (binary FOLD3)
+    .decrypt_raw(blob, password, out=None) -> bytes | int
+    .encrypt_stream(source, password, chunk_size=None) -> Iterator[bytes]
+    .decrypt_stream(source, password) -> Iterator[bytes]
+    .open_session(password, salt=None) -> CircuitKeySession (FOLD3)
 
   create_encryption_from_analysis(analysis) -> CircuitEncryption
   derive_circuit_parameters(analysis) -> dict
@@ -18,10 +23,19 @@ Before running, set dummy env vars so app.py can import:
     API_KEY=test-key SECRET_KEY=$(python -c 'import os;print(os.urandom(32).hex())') \\
         python -m unittest tests -v
 """
+import concurrent.futures
+import io
+import json
 import os
 import random
+import sqlite3
 import string
+import sys
+import tempfile
+import time
+import types
 import unittest
+from unittest import mock
 
 # Ensure required env vars exist before importing app.py.
 os.environ.setdefault('API_KEY', 'test-api-key')
@@ -30,12 +44,39 @@ os.environ.setdefault('SECRET_KEY', 'test-secret-key-' + 'a' * 32)
 os.environ.setdefault('SCRYPT_N', '1024')
 
 from app import (  # noqa: E402
+    MAX_NODES_PER_CARD,
     CircuitEncryption,
+    CircuitResultCache,
+    DerivedKeyCache,
+    KdfAdmission,
+    KdfExecutor,
+    KdfUnavailableError,
+    MemoryHistoryStore,
+    PqcConnectionPool,
+    PqcHealthProber,
+    SqliteHistoryStore,
     analyze_circuit,
+    analyze_circuit_compact,
+    calibrate_scrypt_n,
     create_encryption_from_analysis,
     derive_circuit_parameters,
+    scrypt_memory_cost,
     validate_circuit_data,
 )
+from app import limiter  # noqa: E402
+
+# Route tests post to rate-limited endpoints far more often than a client may.
+limiter.enabled = False
+
+
+def _legacy_fold2(cipher, plaintext, password):
+    """Build a FOLD2 blob the way the pre-FOLD3 encrypt() did."""
+    import base64
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    salt, nonce = os.urandom(16), os.urandom(12)
+    key = cipher._derive_key(password, salt, (int(os.environ['SCRYPT_N']), 8, 1))
+    ct = AESGCM(key).encrypt(nonce, plaintext.encode(), cipher._info)
+    return base64.b64encode(b'FOLD2' + salt + nonce + ct)
 
 
 class TestCircuitEncryption(unittest.TestCase):
@@ -146,6 +187,19 @@ class TestCircuitEncryption(unittest.TestCase):
         enc = cipher.encrypt('hello', self.test_key)
         self.assertTrue(base64.b64decode(enc).startswith(b'FOLD2'))
 
+    def test_fold3_write_format(self):
+        import base64
+        import app
+        cipher = CircuitEncryption()
+        original = app.CIPHER_WRITE_FORMAT
+        try:
+            app.CIPHER_WRITE_FORMAT = 'fold3'
+            enc = cipher.encrypt('hello', self.test_key)
+        finally:
+            app.CIPHER_WRITE_FORMAT = original
+        self.assertTrue(base64.b64decode(enc).startswith(b'FOLD3'))
+        self.assertEqual(cipher.decrypt(enc, self.test_key), 'hello')
+
     # -- circuit-binding semantics ----------------------------------------
     def test_different_circuits_produce_different_ciphertexts(self):
         simple = create_encryption_from_analysis(analyze_circuit(self.simple_circuit))
@@ -202,5 +256,1094 @@ class TestCircuitEncryption(unittest.TestCase):
         self.assertEqual(cleaned['cards'][0]['logicGates'][0]['type'], 'BUFFER')
 
 
+class TestCircuitEncryptionStream(unittest.TestCase):
+    def setUp(self):
+        self.cipher = CircuitEncryption({'circuit_seed': 'stream-test'})
+        self.password = 'SecretKey123'
+
+    def _encrypt(self, source, chunk_size=64):
+        return b''.join(self.cipher.encrypt_stream(source, self.password, chunk_size=chunk_size))
+
+    def _decrypt(self, blob, cipher=None):
+        cipher = cipher or self.cipher
+        return b''.join(cipher.decrypt_stream(io.BytesIO(blob), self.password))
+
+    def test_roundtrip_file_like(self):
+        data = os.urandom(1000)
+        blob = self._encrypt(io.BytesIO(data))
+        self.assertTrue(blob.startswith(b'FOLDS'))
+        self.assertEqual(self._decrypt(blob), data)
+
+    def test_roundtrip_iterator_of_uneven_pieces(self):
+        data = os.urandom(777)
+        pieces = [data[i:i + 13] for i in range(0, len(data), 13)]
+        self.assertEqual(self._decrypt(self._encrypt(iter(pieces))), data)
+
+    def test_exact_multiple_and_empty(self):
+        for data in (b'', os.urandom(64), os.urandom(64 * 4)):
+            self.assertEqual(self._decrypt(self._encrypt(data)), data)
+
+    def test_segments_are_chunk_sized(self):
+        pieces = list(self.cipher.encrypt_stream(os.urandom(200), self.password, chunk_size=64))
+        # header + 4 segments (64, 64, 64, 8)
+        self.assertEqual([len(p) for p in pieces[1:]], [80, 80, 80, 24])
+
+    def test_truncation_detected(self):
+        blob = self._encrypt(os.urandom(200))
+        truncated = blob[:-24]  # drop the final segment entirely
+        with self.assertRaises(Exception):
+            self._decrypt(truncated)
+
+    def test_segment_reorder_detected(self):
+        blob = self._encrypt(os.urandom(256))
+        header, body = blob[:35], blob[35:]
+        segs = [body[i:i + 80] for i in range(0, len(body), 80)]
+        segs[0], segs[1] = segs[1], segs[0]
+        with self.assertRaises(Exception):
+            self._decrypt(header + b''.join(segs))
+
+    def test_cross_circuit_rejected(self):
+        blob = self._encrypt(b'bound to one circuit')
+        other = CircuitEncryption({'circuit_seed': 'other'})
+        with self.assertRaises(Exception):
+            self._decrypt(blob, cipher=other)
+
+    def test_single_shot_decrypt_rejects_stream_blob(self):
+        import base64
+        blob = self._encrypt(b'stream')
+        with self.assertRaises(ValueError):
+            self.cipher.decrypt(base64.b64encode(blob), self.password)
+
+
+class TestCircuitKeySession(unittest.TestCase):
+    def setUp(self):
+        self.cipher = CircuitEncryption({'circuit_seed': 'session-test'})
+        self.password = 'SecretKey123'
+
+    def test_session_roundtrip_and_format(self):
+        import base64
+        with self.cipher.open_session(self.password) as sess:
+            blobs = [sess.encrypt(f'record {i}') for i in range(5)]
+            self.assertTrue(all(base64.b64decode(b).startswith(b'FOLD3') for b in blobs))
+            self.assertEqual([sess.decrypt(b) for b in blobs], [f'record {i}' for i in range(5)])
+
+    def test_plain_decrypt_accepts_session_blobs(self):
+        sess = self.cipher.open_session(self.password)
+        blob = sess.encrypt(b'\xff\x00binary')
+        self.assertEqual(self.cipher.decrypt(blob, self.password), b'\xff\x00binary')
+        with self.assertRaises(Exception):
+            self.cipher.decrypt(blob, 'WrongPassword')
+
+    def test_fold2_still_decrypts(self):
+        self.assertEqual(self.cipher.decrypt(_legacy_fold2(self.cipher, 'legacy', self.password),
+                                             self.password), 'legacy')
+
+    def test_reopen_with_persisted_salt(self):
+        first = self.cipher.open_session(self.password)
+        blob = first.encrypt('persisted')
+        again = self.cipher.open_session(self.password, salt=first.salt)
+        self.assertEqual(again.decrypt(blob), 'persisted')
+
+    def test_foreign_session_blob_rejected(self):
+        blob = self.cipher.open_session(self.password).encrypt('x')
+        with self.assertRaises(ValueError):
+            self.cipher.open_session(self.password).decrypt(blob)
+
+    def test_cross_circuit_rejected(self):
+        blob = self.cipher.open_session(self.password).encrypt('x')
+        other = CircuitEncryption({'circuit_seed': 'other'})
+        with self.assertRaises(Exception):
+            other.decrypt(blob, self.password)
+
+    def test_closed_session_refuses(self):
+        sess = self.cipher.open_session(self.password)
+        sess.close()
+        with self.assertRaises(ValueError):
+            sess.encrypt('x')
+
+
+class TestDerivedKeyCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = DerivedKeyCache(max_entries=2, ttl_seconds=10, clock=lambda: self.now)
+        self.cipher = CircuitEncryption({'circuit_seed': 'cache-test'}, key_cache=self.cache)
+
+    def test_repeat_decrypt_hits_cache(self):
+        blob = self.cipher.encrypt('hello', 'pw')
+        for _ in range(3):
+            self.assertEqual(self.cipher.decrypt(blob, 'pw'), 'hello')
+        stats = self.cache.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (1, 3))
+
+    def test_wrong_password_is_a_separate_entry(self):
+        blob = self.cipher.encrypt('hello', 'pw')
+        with self.assertRaises(Exception):
+            self.cipher.decrypt(blob, 'other')
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_ttl_expiry(self):
+        blob = self.cipher.encrypt('hello', 'pw')
+        self.now = 11
+        self.cipher.decrypt(blob, 'pw')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 2))
+        self.assertGreaterEqual(stats['evictions'], 1)
+
+    def test_lru_bound_and_wipe(self):
+        for i in range(3):
+            self.cipher.encrypt(f'm{i}', 'pw')
+        self.assertEqual(self.cache.stats()['size'], 2)
+        buffers = [buf for _, buf in self.cache._entries.values()]
+        self.cache.clear()
+        self.assertTrue(all(not any(buf) for buf in buffers))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_index_does_not_contain_password(self):
+        self.cipher.encrypt('x', 'very-distinctive-password')
+        for index in self.cache._entries:
+            self.assertNotIn(b'very-distinctive-password', index)
+
+
+class TestKdfExecutor(unittest.TestCase):
+    def test_sync_matches_pool_modes(self):
+        expected = KdfExecutor('sync').derive(b'pw', b's' * 16, 1024, 8, 1)
+        for mode in ('thread', 'process'):
+            ex = KdfExecutor(mode, max_workers=1)
+            try:
+                self.assertEqual(ex.derive(b'pw', b's' * 16, 1024, 8, 1), expected)
+            finally:
+                ex.shutdown()
+
+    def test_process_pool_does_not_fork(self):
+        ex = KdfExecutor('process', max_workers=1)
+        try:
+            self.assertNotEqual(ex._get_pool()._mp_context.get_start_method(), 'fork')
+        finally:
+            ex.shutdown()
+
+    def test_broken_process_pool_is_replaced(self):
+        ex = KdfExecutor('process', max_workers=1)
+        try:
+            expected = KdfExecutor('sync').derive(b'pw', b's' * 16, 1024, 8, 1)
+            crashed = ex._get_pool().submit(os._exit, 1)
+            with self.assertRaises(concurrent.futures.BrokenExecutor):
+                crashed.result(timeout=30)
+            self.assertEqual(ex.derive(b'pw', b's' * 16, 1024, 8, 1), expected)
+        finally:
+            ex.shutdown()
+
+    def test_cipher_roundtrip_through_pool(self):
+        ex = KdfExecutor('thread', max_workers=2)
+        try:
+            cipher = CircuitEncryption({'circuit_seed': 'pool'}, kdf_executor=ex)
+            blob = cipher.encrypt('pooled', 'pw')
+            self.assertEqual(CircuitEncryption({'circuit_seed': 'pool'}).decrypt(blob, 'pw'), 'pooled')
+            self.assertEqual(ex.stats()['completed'], 1)
+        finally:
+            ex.shutdown()
+
+    def test_queue_full_rejects_fast(self):
+        ex = KdfExecutor('thread', max_workers=1, max_pending=1)
+        try:
+            first = ex.submit(b'pw', b's' * 16, 2 ** 16, 8, 1)
+            with self.assertRaises(KdfUnavailableError):
+                ex.submit(b'pw', b's' * 16, 1024, 8, 1)
+            first.result()
+            self.assertEqual(ex.stats()['rejected'], 1)
+        finally:
+            ex.shutdown()
+
+    def test_timeout_raises_unavailable(self):
+        ex = KdfExecutor('process', max_workers=1, timeout=0.001)
+        try:
+            with self.assertRaises(KdfUnavailableError) as ctx:
+                ex.derive(b'pw', b's' * 16, 2 ** 16, 8, 1)
+            self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        finally:
+            ex.shutdown()
+
+
+class TestKdfAdmission(unittest.TestCase):
+    COST = scrypt_memory_cost(2 ** 15, 8, 1)
+
+    def test_cost_matches_scrypt_formula(self):
+        self.assertEqual(self.COST, 128 * 8 * 2 ** 15 + 128 * 8 + 256 * 8)
+
+    def test_waits_then_times_out_over_budget(self):
+        adm = KdfAdmission(budget_bytes=self.COST, max_queue=4)
+        token = adm.acquire(self.COST)
+        with self.assertRaises(KdfUnavailableError) as ctx:
+            adm.acquire(self.COST, timeout=0.05)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        adm.release(self.COST, token)
+        adm.release(self.COST, adm.acquire(self.COST, timeout=0.05))
+        self.assertEqual(adm.stats()['timeouts'], 1)
+
+    def test_full_queue_rejects_immediately(self):
+        adm = KdfAdmission(budget_bytes=self.COST, max_queue=0)
+        adm.acquire(self.COST)
+        with self.assertRaises(KdfUnavailableError):
+            adm.acquire(self.COST, timeout=5)
+        self.assertEqual(adm.stats()['rejected'], 1)
+
+    def test_oversized_call_rejected_even_when_idle(self):
+        adm = KdfAdmission(budget_bytes=1024, max_queue=1)
+        with self.assertRaises(KdfUnavailableError):
+            adm.acquire(self.COST)
+        self.assertEqual(adm.stats()['in_use_bytes'], 0)
+        self.assertEqual(adm.stats()['rejected'], 1)
+
+    def test_executor_releases_budget_after_work(self):
+        adm = KdfAdmission(budget_bytes=self.COST, max_queue=1)
+        ex = KdfExecutor('sync', admission=adm)
+        ex.derive(b'pw', b's' * 16, 1024, 8, 1)
+        self.assertEqual(adm.stats()['in_use_bytes'], 0)
+        self.assertEqual(adm.stats()['admitted'], 1)
+
+    def test_unavailable_maps_to_503_with_retry_after(self):
+        from app import app, handle_kdf_unavailable
+        with app.test_request_context():
+            resp = handle_kdf_unavailable(KdfUnavailableError('busy', retry_after=7))
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '7')
+
+
+class TestScryptCalibration(unittest.TestCase):
+    def test_picks_largest_n_within_target(self):
+        self.assertEqual(calibrate_scrypt_n(10_000, 1 << 30, min_n=2 ** 10, max_n=2 ** 12), 2 ** 12)
+
+    def test_memory_ceiling_caps_n(self):
+        ceiling = scrypt_memory_cost(2 ** 11, 8, 1)
+        self.assertEqual(calibrate_scrypt_n(10_000, ceiling, min_n=2 ** 10, max_n=2 ** 14), 2 ** 11)
+
+    def test_min_n_is_a_floor(self):
+        self.assertEqual(calibrate_scrypt_n(0, 1 << 30, min_n=2 ** 10, max_n=2 ** 12), 2 ** 10)
+
+    def test_ciphertext_carries_its_own_cost(self):
+        import app
+        cipher = CircuitEncryption({'circuit_seed': 'calibrated'})
+        original = app._SCRYPT_N
+        try:
+            # What calibration does: write at the new N.
+            app._SCRYPT_N = 2 ** 11
+            with cipher.open_session('pw') as session:
+                blob = session.encrypt('written at 2**11')
+            cleaned, _ = validate_circuit_data({'cards': [{'id': 'c'}]})
+            params = derive_circuit_parameters(analyze_circuit(cleaned))
+            self.assertIn('N=2048', params['kdf'])
+            app._SCRYPT_N = original
+            self.assertEqual(cipher.decrypt(blob, 'pw'), 'written at 2**11')
+        finally:
+            app._SCRYPT_N = original
+
+    def test_header_cap_does_not_follow_local_n(self):
+        import app
+        cipher = CircuitEncryption({'circuit_seed': 'other-host'})
+        original = app._SCRYPT_N
+        try:
+            # Another worker or host calibrated higher than this one.
+            app._SCRYPT_N = original * 2
+            with cipher.open_session('pw') as session:
+                blob = session.encrypt_raw(b'from a faster host')
+        finally:
+            app._SCRYPT_N = original
+        self.assertGreater(app._SCRYPT_MAX_N, app._SCRYPT_N)
+        self.assertLessEqual(scrypt_memory_cost(app._SCRYPT_MAX_N, 8, 1), app.SCRYPT_MAX_MEMORY)
+        self.assertEqual(cipher.decrypt_raw(blob, 'pw'), b'from a faster host')
+
+    def test_header_cannot_raise_kdf_cost(self):
+        import app
+        cipher = CircuitEncryption({'circuit_seed': 'bounded'})
+        with cipher.open_session('pw') as session:
+            blob = bytearray(session.encrypt_raw(b'x'))
+        off = len(app._SESSION_MAGIC)
+        for kdf in (bytes((app._SCRYPT_MAX_N.bit_length(), 8, 1)),   # N above the cap
+                    bytes((app._SCRYPT_N.bit_length() - 1, 32, 1)),  # r
+                    bytes((app._SCRYPT_N.bit_length() - 1, 8, 16))):  # p
+            tampered = bytes(blob[:off]) + kdf + bytes(blob[off + 3:])
+            with self.assertRaisesRegex(ValueError, 'Unsupported KDF parameters'):
+                cipher.decrypt_raw(tampered, 'pw')
+
+
+class _SidecarStub:
+    """Tiny HTTP/1.1 keep-alive server standing in for the PQC sidecar."""
+
+    def __init__(self):
+        import http.server
+        import threading
+        stub = self
+        self.connections = 0
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+
+            def do_GET(self):
+                body = b'{"status":"online"}' * (4 if self.path.endswith('big') else 1)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                # Drop the socket without announcing it, like an idle timeout.
+                self.close_connection = self.path.endswith('drop')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestPqcConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.stub = _SidecarStub()
+        self.pool = PqcConnectionPool(self.stub.url, max_connections=2, timeout=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.stub.close()
+
+    def test_keep_alive_reuses_one_socket(self):
+        for _ in range(5):
+            resp = self.pool.request('GET', '/pqc/status')
+            self.assertEqual((resp.status, resp.read()), (200, b'{"status":"online"}'))
+        self.assertEqual(self.stub.connections, 1)
+        self.assertEqual(self.pool.stats()['reused'], 4)
+
+    def test_streams_in_chunks(self):
+        resp = self.pool.request('GET', '/pqc/big')
+        chunks = list(resp.iter_chunks(chunk_size=10))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), b'{"status":"online"}' * 4)
+
+    def test_stale_socket_is_retried(self):
+        self.pool.request('GET', '/pqc/drop').read()
+        time.sleep(0.05)
+        resp = self.pool.request('GET', '/pqc/status')
+        self.assertEqual(resp.read(), b'{"status":"online"}')
+        self.assertEqual(self.pool.stats()['stale_retries'], 1)
+
+    def test_unread_response_is_not_reused(self):
+        self.pool.request('GET', '/pqc/big').close()
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_connection_cap(self):
+        from app import PqcPoolExhausted
+        held = [self.pool.request('GET', '/pqc/status') for _ in range(2)]
+        with self.assertRaises(PqcPoolExhausted):
+            self.pool.request('GET', '/pqc/status', timeout=0.05)
+        for resp in held:
+            resp.close()
+
+
+class TestPqcHealthProber(unittest.TestCase):
+    def setUp(self):
+        self.healthy = True
+
+        def probe():
+            if not self.healthy:
+                raise ConnectionRefusedError()
+
+        self.prober = PqcHealthProber(probe, interval=0.01, fail_threshold=2)
+
+    def test_success_records_latency(self):
+        self.prober.check_once()
+        snap = self.prober.snapshot()
+        self.assertEqual(snap['status'], 'online')
+        self.assertIsNotNone(snap['last_latency_ms'])
+        self.assertFalse(self.prober.is_down())
+
+    def test_fail_fast_after_threshold(self):
+        self.prober.check_once()
+        self.healthy = False
+        self.prober.check_once()
+        self.assertFalse(self.prober.is_down())
+        self.assertEqual(self.prober.snapshot()['status'], 'online')
+        self.prober.check_once()
+        self.assertTrue(self.prober.is_down())
+        snap = self.prober.snapshot()
+        self.assertEqual((snap['status'], snap['errors'], snap['last_error']),
+                         ('unavailable', 2, 'ConnectionRefusedError'))
+        self.healthy = True
+        self.prober.check_once()
+        self.assertFalse(self.prober.is_down())
+
+    def test_background_thread_refreshes(self):
+        self.prober.start()
+        try:
+            deadline = time.time() + 2
+            while self.prober.snapshot()['checks'] < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertGreaterEqual(self.prober.snapshot()['checks'], 3)
+        finally:
+            self.prober.stop()
+
+    def test_status_route_answers_from_cache(self):
+        import app as app_module
+        prober = PqcHealthProber(lambda: None, interval=60)
+        prober.record_success(1.5)
+        original = (app_module._pqc_prober, app_module._pqc_prober_pid)
+        app_module._pqc_prober, app_module._pqc_prober_pid = prober, os.getpid()
+        try:
+            body = app_module.app.test_client().get('/api/status').get_json()
+        finally:
+            app_module._pqc_prober, app_module._pqc_prober_pid = original
+        self.assertEqual(body['pqc_status'], 'online')
+        self.assertEqual(body['pqc_health']['last_latency_ms'], 1.5)
+
+
+class TestMeshResolution(unittest.TestCase):
+    @staticmethod
+    def _reference(all_mesh_points):
+        out = []
+        for point in all_mesh_points:
+            for key, direction in (('upConnections', 'up'), ('downConnections', 'down')):
+                for ref in point.get(key, []):
+                    for target in all_mesh_points:
+                        if target.get('id') != ref:
+                            continue
+                        higher = target.get('card_index') > point.get('card_index')
+                        lower = target.get('card_index') < point.get('card_index')
+                        if (direction == 'up' and higher) or (direction == 'down' and lower):
+                            out.append({'from_point': point, 'to_point': target, 'direction': direction})
+        return out
+
+    def test_matches_nested_scan_with_duplicate_ids(self):
+        rng = random.Random(1234)
+        ids = [f'm{i}' for i in range(6)]  # few ids -> many duplicates across cards
+        cards = [{
+            'id': f'card{c}',
+            'meshInteractionPoints': [{
+                'id': rng.choice(ids),
+                'upConnections': rng.sample(ids, 3),
+                'downConnections': rng.sample(ids, 3),
+            } for _ in range(rng.randint(0, 5))],
+        } for c in range(12)]
+        analysis = analyze_circuit({'cards': cards})
+        self.assertEqual(analysis['mesh_connections'], self._reference(analysis['mesh_points']))
+        self.assertGreater(len(analysis['mesh_connections']), 0)
+
+    def test_simple_down_link(self):
+        circuit = {'cards': [
+            {'id': 'a', 'meshInteractionPoints': [{'id': 'm1'}]},
+            {'id': 'b', 'meshInteractionPoints': [{'id': 'm2', 'downConnections': ['m1', 'm2', 'missing']}]},
+        ]}
+        links = analyze_circuit(circuit)['mesh_connections']
+        self.assertEqual([(m['from_point']['id'], m['to_point']['id'], m['direction']) for m in links],
+                         [('m2', 'm1', 'down')])
+
+
+class TestCircuitResultCache(unittest.TestCase):
+    def setUp(self):
+        self.now = [0.0]
+        self.cache = CircuitResultCache(max_entries=2, ttl_seconds=10, clock=lambda: self.now[0])
+
+    def test_key_ignores_key_order_and_dropped_fields(self):
+        a, _ = validate_circuit_data({'cards': [{'id': 'c1', 'type': 'basic', 'color': 'red'}]})
+        b, _ = validate_circuit_data({'cards': [{'color': 'red', 'type': 'basic', 'id': 'c1', 'junk': 1}]})
+        c, _ = validate_circuit_data({'cards': [{'id': 'c2', 'type': 'basic', 'color': 'red'}]})
+        self.assertEqual(CircuitResultCache.key_for(a), CircuitResultCache.key_for(b))
+        self.assertNotEqual(CircuitResultCache.key_for(a), CircuitResultCache.key_for(c))
+
+    def test_lru_and_ttl(self):
+        self.cache.put('a', {'v': 1})
+        self.cache.put('b', {'v': 2})
+        self.assertEqual(self.cache.get('a'), {'v': 1})
+        self.cache.put('c', {'v': 3})
+        self.assertIsNone(self.cache.get('b'))
+        self.now[0] = 11
+        self.assertIsNone(self.cache.get('a'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_shared_tier_fills_local_and_tolerates_errors(self):
+        class FakeRedis(dict):
+            def set(self, key, value, ex=None):
+                self[key] = value
+
+        shared = FakeRedis()
+        writer = CircuitResultCache(redis_client=shared)
+        reader = CircuitResultCache(redis_client=shared)
+        writer.put('k', {'v': 1})
+        self.assertEqual(reader.get('k'), {'v': 1})
+        self.assertEqual(reader.stats()['shared_hits'], 1)
+
+        class BrokenRedis:
+            def get(self, key):
+                raise ConnectionError('down')
+
+            def set(self, *args, **kwargs):
+                raise ConnectionError('down')
+
+        broken = CircuitResultCache(redis_client=BrokenRedis())
+        broken.put('k', {'v': 1})
+        self.assertIsNone(broken.get('missing'))
+
+    def test_key_changes_with_signing_key(self):
+        import app as app_module
+        cleaned, _ = validate_circuit_data({'cards': [{'id': 'c1'}]})
+        before = CircuitResultCache.key_for(cleaned)
+        original = app_module._SIGNING_KEY
+        try:
+            app_module._SIGNING_KEY = os.urandom(32)
+            self.assertNotEqual(CircuitResultCache.key_for(cleaned), before)
+        finally:
+            app_module._SIGNING_KEY = original
+        self.assertEqual(CircuitResultCache.key_for(cleaned), before)
+
+    def test_corrupt_shared_entry_is_a_miss(self):
+        shared = {'fold:circuit-result:bad': b'{not json', 'fold:circuit-result:list': b'[1]',
+                  'fold:circuit-result:bin': b'\xff\xfe'}
+        cache = CircuitResultCache(redis_client=shared)
+        for key in ('bad', 'list', 'bin'):
+            self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.stats()['misses'], 3)
+
+    def test_route_serves_identical_results_from_cache(self):
+        import app as app_module
+        client = app_module.app.test_client()
+        headers = {'X-API-Key': os.environ['API_KEY']}
+        circuit = {'cards': [{'id': 'c1', 'type': 'basic', 'color': 'red',
+                              'nodes': [{'id': 'n1', 'x': 1, 'y': 2}]}]}
+        before = app_module._RESULT_CACHE.stats()['hits']
+        first = client.post('/api/generate_encryption', json=circuit, headers=headers)
+        second = client.post('/api/generate_encryption', json=circuit, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.get_json(), second.get_json())
+        self.assertEqual(app_module._RESULT_CACHE.stats()['hits'], before + 1)
+
+
+class _HistoryStoreContract:
+    """Shared behaviour every history backend must provide."""
+
+    def make_store(self, max_records, max_users):
+        raise NotImplementedError
+
+    @staticmethod
+    def record(i, complexity=None, seed=None):
+        return {'timestamp': 1000.0 + i, 'complexity': i if complexity is None else complexity,
+                'circuit_seed': seed or 'seed-%d' % i}
+
+    @staticmethod
+    def seqs(records):
+        return [r['seq'] for r in records]
+
+    def test_trims_oldest_records(self):
+        store = self.make_store(max_records=3, max_users=10)
+        for i in range(7):
+            self.assertEqual(store.append('alice', self.record(i)), i)
+        self.assertEqual(self.seqs(store.records('alice')), [4, 5, 6])
+        self.assertEqual(store.records('alice')[0]['timestamp'], 1004.0)
+        self.assertEqual(store.records('nobody'), [])
+        self.assertEqual(store.latest_seq('alice'), 6)
+        self.assertEqual(store.latest_seq('nobody'), -1)
+
+    def test_evicts_least_recently_written_user(self):
+        store = self.make_store(max_records=5, max_users=2)
+        store.append('a', self.record(1))
+        store.append('b', self.record(2))
+        store.append('a', self.record(3))
+        store.append('c', self.record(4))
+        self.assertEqual(store.records('b'), [])
+        self.assertEqual([r['complexity'] for r in store.records('a')], [1, 3])
+        self.assertEqual(self.seqs(store.records('c')), [0])
+        self.assertEqual(store.stats()['users'], 2)
+        self.assertEqual(store.aggregates('b')['count'], 0)
+
+    def test_page_by_cursor_and_since(self):
+        store = self.make_store(max_records=4, max_users=10)
+        for i in range(6):
+            store.append('u', self.record(i))
+        self.assertEqual(self.seqs(store.page('u')), [2, 3, 4, 5])
+        self.assertEqual(self.seqs(store.page('u', after=0)), [2, 3, 4, 5])
+        self.assertEqual(self.seqs(store.page('u', after=3)), [4, 5])
+        self.assertEqual(self.seqs(store.page('u', after=2, limit=2)), [3, 4])
+        self.assertEqual(store.page('u', after=5), [])
+        self.assertEqual(self.seqs(store.page('u', since=1003.5)), [4, 5])
+        self.assertEqual(self.seqs(store.page('u', since=1002.5, limit=1)), [3])
+
+    def test_running_aggregates_cover_trimmed_records(self):
+        store = self.make_store(max_records=2, max_users=10)
+        store.append('u', self.record(0, complexity=10, seed='x'))
+        store.append('u', self.record(1, complexity=40, seed='y'))
+        store.append('u', self.record(2, complexity=25, seed='x'))
+        store.append('u', self.record(3, complexity=5, seed='x'))
+        aggregates = store.aggregates('u')
+        self.assertEqual(aggregates['count'], 4)
+        self.assertAlmostEqual(aggregates['mean_complexity'], 20.0)
+        self.assertEqual(aggregates['max_complexity'], 40)
+        self.assertEqual(aggregates['distinct_seeds'], 2)
+
+
+class TestMemoryHistoryStore(_HistoryStoreContract, unittest.TestCase):
+    def make_store(self, max_records, max_users):
+        return MemoryHistoryStore(max_records, max_users)
+
+
+class TestSqliteHistoryStore(_HistoryStoreContract, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'history.sqlite3')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_store(self, max_records, max_users):
+        return SqliteHistoryStore(self.path, max_records, max_users)
+
+    def test_separate_instances_share_the_file(self):
+        writer = self.make_store(10, 10)
+        reader = self.make_store(10, 10)
+        writer.append('alice', self.record(1))
+        self.assertEqual(reader.records('alice'), [dict(self.record(1), seq=0)])
+        self.assertEqual(reader.aggregates('alice')['count'], 1)
+
+    def test_migrates_version_1_file(self):
+        conn = sqlite3.connect(self.path)
+        conn.executescript(
+            'CREATE TABLE history_users (user_id TEXT PRIMARY KEY, last_used INTEGER NOT NULL,'
+            ' next_seq INTEGER NOT NULL);'
+            'CREATE INDEX history_users_last_used ON history_users (last_used);'
+            'CREATE TABLE history_records (user_id TEXT NOT NULL, seq INTEGER NOT NULL,'
+            ' record TEXT NOT NULL, PRIMARY KEY (user_id, seq)) WITHOUT ROWID;'
+            'CREATE TABLE history_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);'
+            "INSERT INTO history_meta VALUES ('users', 1), ('clock', 2);"
+            "INSERT INTO history_users VALUES ('alice', 2, 2);")
+        conn.executemany('INSERT INTO history_records VALUES (?, ?, ?)',
+                         [('alice', i, json.dumps(self.record(i, seed='s'))) for i in (0, 1)])
+        conn.commit()
+        conn.close()
+
+        store = self.make_store(10, 10)
+        self.assertEqual(self.seqs(store.records('alice')), [0, 1])
+        self.assertEqual(store.page('alice', since=1000.5), [dict(self.record(1, seed='s'), seq=1)])
+        self.assertEqual(store.aggregates('alice'),
+                         {'count': 2, 'mean_complexity': 0.5, 'max_complexity': 1, 'distinct_seeds': 1})
+        self.assertEqual(store.append('alice', self.record(2)), 2)
+        self.assertEqual(store.aggregates('alice')['distinct_seeds'], 2)
+        version = sqlite3.connect(self.path).execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, SqliteHistoryStore.SCHEMA_VERSION)
+
+
+class TestHistoryRoute(unittest.TestCase):
+    def setUp(self):
+        import app as app_module
+        self.app_module = app_module
+        self.original_store = app_module._HISTORY_STORE
+        app_module._HISTORY_STORE = MemoryHistoryStore(max_records=50, max_users=10)
+        self.client = app_module.app.test_client()
+        self.headers = {'X-API-Key': os.environ['API_KEY']}
+
+    def tearDown(self):
+        self.app_module._HISTORY_STORE = self.original_store
+
+    def generate(self, card_type):
+        response = self.client.post(
+            '/api/generate_encryption', headers=self.headers,
+            json={'cards': [{'id': 'c1', 'type': card_type, 'color': 'red'}]})
+        self.assertEqual(response.status_code, 200)
+
+    def test_cursor_polling_and_etag(self):
+        self.generate('basic')
+        self.generate('memory')
+        first = self.client.get('/api/history', headers=self.headers)
+        body = first.get_json()
+        self.assertEqual([r['seq'] for r in body['records']], [0, 1])
+        self.assertEqual(body['next_cursor'], 1)
+        self.assertFalse(body['has_more'])
+        self.assertEqual(body['aggregates']['count'], 2)
+        self.assertEqual(body['aggregates']['distinct_seeds'], 2)
+
+        poll_url = '/api/history?after=%d' % body['next_cursor']
+        empty = self.client.get(poll_url, headers=self.headers)
+        self.assertEqual(empty.get_json()['records'], [])
+        unchanged = self.client.get(poll_url, headers=dict(self.headers, **{
+            'If-None-Match': empty.headers['ETag']}))
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(unchanged.data, b'')
+
+        self.generate('basic')
+        changed = self.client.get(poll_url, headers=dict(self.headers, **{
+            'If-None-Match': empty.headers['ETag']}))
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual([r['seq'] for r in changed.get_json()['records']], [2])
+        self.assertEqual(changed.get_json()['aggregates']['distinct_seeds'], 2)
+
+    def test_limit_and_validation(self):
+        for card_type in ('basic', 'memory', 'logic'):
+            self.generate(card_type)
+        page = self.client.get('/api/history?limit=2', headers=self.headers).get_json()
+        self.assertEqual([r['seq'] for r in page['records']], [0, 1])
+        self.assertTrue(page['has_more'])
+        for query in ('limit=0', 'after=x', 'since=nan'):
+            response = self.client.get('/api/history?' + query, headers=self.headers)
+            self.assertEqual(response.status_code, 400, query)
+
+
+class TestValidatorQuirks(unittest.TestCase):
+    """validate_circuit_data clamping and normalisation rules."""
+
+    def test_top_level_errors(self):
+        self.assertEqual(validate_circuit_data(None), (None, 'Request body must be a JSON object'))
+        self.assertEqual(validate_circuit_data({'cards': 'abc'}), (None, 'Missing or empty cards array'))
+        self.assertEqual(validate_circuit_data({'cards': [{}, 3]}), (None, 'Card at index 1 is not an object'))
+        self.assertIn('Too many cards', validate_circuit_data({'cards': [{}] * 21})[1])
+
+    def test_non_finite_numbers_become_zero(self):
+        cleaned, _ = validate_circuit_data({'cards': [{'logicGates': [
+            {'x': 'inf', 'y': 'nan', 'type': 'bogus'}, {'x': float('inf'), 'y': float('nan')},
+            {'x': 3, 'y': '2.5'}]}]})
+        self.assertEqual(cleaned['cards'][0]['logicGates'], [
+            {'id': '', 'type': 'BUFFER', 'x': 0.0, 'y': 0.0},
+            {'id': '', 'type': 'BUFFER', 'x': 0.0, 'y': 0.0},
+            {'id': '', 'type': 'BUFFER', 'x': 3.0, 'y': 2.5},
+        ])
+        self.assertIs(type(cleaned['cards'][0]['logicGates'][2]['x']), float)
+
+    def test_inactive_matrix_connections_are_dropped(self):
+        cleaned, _ = validate_circuit_data({'cards': [{'matrixConnections': [
+            {'id': 'on', 'active': 1}, {'id': 'off', 'active': False}, 'junk']}]})
+        self.assertEqual([c['id'] for c in cleaned['cards'][0]['matrixConnections']], ['on'])
+
+    def test_lists_and_strings_are_truncated(self):
+        ids = [f'{i}' + 'x' * 70 for i in range(20)]
+        cleaned, _ = validate_circuit_data({'cards': [{
+            'id': 'c' * 80, 'color': 'r' * 30,
+            'nodes': [{'id': 'n', 'type': 't' * 30, 'connections': ids + [5]}] * 40,
+            'matrixConnections': [{'active': True}] * 70,
+            'meshInteractionPoints': [{'upConnections': ids}] * 40,
+            'logicGates': [{}] * 20,
+        }]})
+        card = cleaned['cards'][0]
+        self.assertEqual((len(card['id']), len(card['color'])), (64, 20))
+        self.assertEqual(len(card['nodes']), MAX_NODES_PER_CARD)
+        self.assertEqual(len(card['nodes'][0]['type']), 20)
+        self.assertEqual(card['nodes'][0]['connections'], [c[:64] for c in ids[:16]])
+        self.assertEqual(len(card['matrixConnections']), 64)
+        self.assertEqual(len(card['meshInteractionPoints']), 32)
+        self.assertEqual(len(card['meshInteractionPoints'][0]['upConnections']), 16)
+        self.assertEqual(len(card['logicGates']), 16)
+
+    def test_non_list_connections_become_empty(self):
+        for bad in ('abc', 7, {'a': 1}, None):
+            cleaned, error = validate_circuit_data({'cards': [{
+                'nodes': [{'connections': bad}],
+                'meshInteractionPoints': [{'upConnections': bad, 'downConnections': bad}]}]})
+            self.assertIsNone(error)
+            card = cleaned['cards'][0]
+            self.assertEqual(card['nodes'][0]['connections'], [], bad)
+            self.assertEqual(card['meshInteractionPoints'][0]['upConnections'], [], bad)
+            self.assertEqual(card['meshInteractionPoints'][0]['downConnections'], [], bad)
+
+    def test_non_list_connections_do_not_break_the_route(self):
+        import app as app_module
+        client = app_module.app.test_client()
+        response = client.post('/api/generate_encryption', headers={'X-API-Key': os.environ['API_KEY']},
+                               json={'cards': [{'nodes': [{'id': 'n', 'connections': 7}]}]})
+        self.assertEqual(response.status_code, 200)
+
+
+class TestCompactAnalysis(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(99)
+        ids = [f'm{i}' for i in range(8)]
+        self.circuit = validate_circuit_data({'cards': [{
+            'id': f'card{c}', 'type': rng.choice(['basic', 'memory', 'logic']), 'color': 'red',
+            'nodes': [{'id': f'n{c}-{i}', 'x': i, 'y': c} for i in range(rng.randint(0, 4))],
+            'matrixConnections': [{'id': f'mc{i}', 'active': rng.random() < 0.5} for i in range(5)],
+            'meshInteractionPoints': [{'id': rng.choice(ids), 'upConnections': rng.sample(ids, 2),
+                                       'downConnections': rng.sample(ids, 2)} for _ in range(4)],
+            'logicGates': [{'id': f'g{i}', 'type': 'XOR'} for i in range(rng.randint(0, 3))],
+        } for c in range(8)]})[0]
+
+    def test_views_match_analyze_circuit(self):
+        expected = analyze_circuit(self.circuit)
+        compact = analyze_circuit_compact(self.circuit)
+        self.assertEqual(compact.to_dict(), expected)
+        self.assertEqual(compact['summary'], expected['summary'])
+        self.assertGreater(len(compact['mesh_connections']), 0)
+        for key in ('nodes', 'connections', 'mesh_points', 'mesh_connections', 'logic_gates'):
+            view = compact[key]
+            self.assertEqual(len(view), len(expected[key]), key)
+            if expected[key]:
+                self.assertEqual(view[-1], expected[key][-1], key)
+                self.assertEqual(view[1:3], expected[key][1:3], key)
+        with self.assertRaises(KeyError):
+            compact['nope']
+
+    def test_unvalidated_input_matches(self):
+        circuit = {'cards': [
+            {'meshInteractionPoints': [{'id': 'a'}]},
+            {'id': 'b', 'nodes': [{'id': 'n'}],
+             'meshInteractionPoints': [{'id': 'c', 'downConnections': ['a']}]},
+        ]}
+        self.assertEqual(analyze_circuit_compact(circuit).to_dict(), analyze_circuit(circuit))
+
+    def test_parameters_are_unchanged(self):
+        self.assertEqual(derive_circuit_parameters(analyze_circuit_compact(self.circuit)),
+                         derive_circuit_parameters(analyze_circuit(self.circuit)))
+
+    def test_elements_reference_input_instead_of_copying(self):
+        compact = analyze_circuit_compact(self.circuit)
+        self.assertIs(compact.mesh_items[0], self.circuit['cards'][0]['meshInteractionPoints'][0])
+
+
+class TestRawWireFormat(unittest.TestCase):
+    def setUp(self):
+        self.cipher = CircuitEncryption({'circuit_seed': 'raw-test'})
+        self.password = 'SecretKey123'
+
+    def test_raw_roundtrip_from_any_buffer_type(self):
+        import base64
+        blob = self.cipher.encrypt_raw('raw payload', self.password)
+        self.assertTrue(blob.startswith(b'FOLD2'))
+        with self.cipher.open_session(self.password) as session:
+            session_blob = session.encrypt_raw('raw payload')
+        for raw in (blob, session_blob):
+            for wrapped in (raw, bytearray(raw), memoryview(raw), memoryview(b'xx' + raw)[2:]):
+                self.assertEqual(self.cipher.decrypt_raw(wrapped, self.password), b'raw payload')
+        self.assertEqual(self.cipher.decrypt(base64.b64encode(blob), self.password), 'raw payload')
+        self.assertEqual(self.cipher.decrypt_raw(base64.b64decode(
+            self.cipher.encrypt('b64 payload', self.password)), self.password), b'b64 payload')
+
+    def test_decrypt_into_caller_buffer(self):
+        payload = os.urandom(1000)
+        blob = self.cipher.encrypt_raw(payload, self.password)
+        out = bytearray(1200)
+        self.assertEqual(self.cipher.decrypt_raw(blob, self.password, out=out), 1000)
+        self.assertEqual(bytes(out[:1000]), payload)
+        window = memoryview(bytearray(2000))[500:1500]
+        self.assertEqual(self.cipher.decrypt_raw(blob, self.password, out=window), 1000)
+        self.assertEqual(bytes(window), payload)
+
+    def test_bad_out_buffers_rejected_before_decrypting(self):
+        blob = self.cipher.encrypt_raw(b'x' * 10, self.password)
+        with self.assertRaises(ValueError):
+            self.cipher.decrypt_raw(blob, self.password, out=bytearray(9))
+        with self.assertRaises(TypeError):
+            self.cipher.decrypt_raw(blob, self.password, out=bytes(10))
+
+    def test_tampered_raw_blob_rejected(self):
+        blob = bytearray(self.cipher.encrypt_raw('x', self.password))
+        blob[-1] ^= 1
+        with self.assertRaises(Exception):
+            self.cipher.decrypt_raw(blob, self.password)
+
+    def test_session_raw_and_legacy_raw(self):
+        import base64
+        with self.cipher.open_session(self.password) as sess:
+            blob = sess.encrypt_raw(b'\x00session')
+            out = bytearray(16)
+            self.assertEqual(sess.decrypt_raw(memoryview(blob), out=out), 8)
+            self.assertEqual(bytes(out[:8]), b'\x00session')
+        legacy = base64.b64decode(_legacy_fold2(self.cipher, 'legacy', self.password))
+        self.assertEqual(self.cipher.decrypt_raw(memoryview(legacy), self.password), b'legacy')
+
+
+class TestBatchEncryption(unittest.TestCase):
+    def setUp(self):
+        self.cipher = CircuitEncryption({'circuit_seed': 'batch-test'}, key_cache=None)
+        self.password = 'SecretKey123'
+
+    def count_derivations(self, cipher):
+        calls = []
+        original = cipher._derive_key_uncached
+
+        def counting(*args, **kwargs):
+            calls.append(args)
+            return original(*args, **kwargs)
+        cipher._derive_key_uncached = counting
+        return calls
+
+    def test_many_roundtrip_with_one_scrypt_each_way(self):
+        import app as app_module
+        records = [f'record {i}' for i in range(app_module._BATCH_KEY_BLOCK + 5)] + [b'\xff\x00']
+        calls = self.count_derivations(self.cipher)
+        blobs = self.cipher.encrypt_many(records, self.password)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({b for b in blobs}), len(records))
+        self.assertEqual(self.cipher.decrypt(blobs[3], self.password), 'record 3')
+        self.assertEqual(self.cipher.decrypt_many(blobs, self.password), records[:-1] + [b'\xff\x00'])
+        self.assertEqual(len(calls), 3)  # encrypt_many, decrypt(), decrypt_many
+
+    def test_raw_many(self):
+        blobs = self.cipher.encrypt_many([b'a', b'b'], self.password, raw=True)
+        self.assertTrue(all(b.startswith(b'FOLD3') for b in blobs))
+        self.assertEqual(self.cipher.decrypt_many([memoryview(b) for b in blobs], self.password, raw=True),
+                         [b'a', b'b'])
+
+    def test_return_exceptions_and_mixed_formats(self):
+        good = self.cipher.encrypt('ok', self.password)
+        legacy = _legacy_fold2(self.cipher, 'legacy', self.password)
+        other_key = self.cipher.encrypt('other', 'WrongPassword')
+        results = self.cipher.decrypt_many([good, 'not base64!', legacy, other_key, 7], self.password,
+                                           return_exceptions=True)
+        self.assertEqual(results[0], 'ok')
+        self.assertEqual(results[2], 'legacy')
+        self.assertIsInstance(results[1], ValueError)
+        self.assertIsInstance(results[3], Exception)
+        self.assertIsInstance(results[4], TypeError)
+        with self.assertRaises(Exception):
+            self.cipher.decrypt_many([good, other_key], self.password)
+
+    def test_max_derivations(self):
+        blobs = [self.cipher.encrypt(str(i), self.password) for i in range(3)]
+        results = self.cipher.decrypt_many(blobs, self.password, return_exceptions=True, max_derivations=2)
+        self.assertEqual(results[:2], ['0', '1'])
+        self.assertIsInstance(results[2], ValueError)
+
+
+class TestBatchRoutes(unittest.TestCase):
+    def setUp(self):
+        import json
+        import app as app_module
+        self.json = json
+        self.client = app_module.app.test_client()
+        self.headers = {'X-API-Key': os.environ['API_KEY']}
+        generated = self.client.post('/api/generate_encryption', headers=self.headers, json={
+            'cards': [{'id': 'c1', 'type': 'lattice', 'color': 'red'}]}).get_json()
+        self.header = {'password': 'SecretKey123', 'parameters': generated['parameters'],
+                       'parameters_signature': generated['parameters_signature']}
+
+    def lines(self, response):
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        return [self.json.loads(line) for line in response.data.splitlines()]
+
+    def test_json_encrypt_then_ndjson_decrypt(self):
+        encrypted = self.lines(self.client.post('/api/batch/encrypt', headers=self.headers,
+                                                json=dict(self.header, records=['a', 5, 'c'])))
+        self.assertEqual([line['i'] for line in encrypted], [0, 1, 2])
+        self.assertIn('error', encrypted[1])
+        cipher = CircuitEncryption(self.header['parameters'])
+        self.assertEqual(cipher.decrypt(encrypted[2]['ciphertext'], 'SecretKey123'), 'c')
+
+        body = '\n'.join(self.json.dumps(x) for x in
+                         [self.header, encrypted[0]['ciphertext'], 'garbage', encrypted[2]['ciphertext']])
+        decrypted = self.lines(self.client.post('/api/batch/decrypt', data=body, headers=dict(
+            self.headers, **{'Content-Type': 'application/x-ndjson'})))
+        self.assertEqual(decrypted, [{'i': 0, 'plaintext': 'a'}, {'i': 1, 'error': 'Decryption failed'},
+                                     {'i': 2, 'plaintext': 'c'}])
+
+    def test_rejects_unsigned_parameters_and_session_auth(self):
+        tampered = dict(self.header, parameters=dict(self.header['parameters'], circuit_seed='0' * 32))
+        response = self.client.post('/api/batch/encrypt', headers=self.headers,
+                                    json=dict(tampered, records=['a']))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/batch/encrypt', json=dict(self.header, records=['a']))
+        self.assertEqual(response.status_code, 401)
+
+
+class _FakePqcEngine:
+    """Stands in for pqc/handlers.py: same (payload, status) contract."""
+
+    def __init__(self):
+        self.calls = []
+
+    def status(self):
+        return {'status': 'online', 'algorithm': 'ML-KEM-768', 'symmetric': 'AES-256-GCM'}, 200
+
+    def _encrypt(self, body):
+        self.calls.append(('encrypt', body))
+        if not body:
+            return {'error': 'missing body'}, 400
+        return {'kem_ciphertext': 'a2Vt', 'payload': 'cGF5', 'params': {}}, 200
+
+    def _encrypt_batch(self, body):
+        self.calls.append(('encrypt_batch', len(body['items'])))
+        return {'results': [{'error': 'public_key required'}] * len(body['items'])}, 200
+
+    @property
+    def OPERATIONS(self):
+        return {'encrypt': self._encrypt, 'encrypt_batch': self._encrypt_batch}
+
+
+class TestInProcessPqcEngine(unittest.TestCase):
+    def setUp(self):
+        import app as app_module
+        self.app_module = app_module
+        self.engine = _FakePqcEngine()
+        self.original = (app_module._pqc_engine, app_module._pqc_engine_loaded)
+        app_module._pqc_engine, app_module._pqc_engine_loaded = self.engine, True
+        self.client = app_module.app.test_client()
+        self.headers = {'X-API-Key': os.environ['API_KEY']}
+
+    def tearDown(self):
+        self.app_module._pqc_engine, self.app_module._pqc_engine_loaded = self.original
+
+    def test_routes_skip_the_sidecar(self):
+        def fail(*args, **kwargs):
+            raise AssertionError('sidecar used in in-process mode')
+
+        with mock.patch.object(self.app_module, '_get_pqc_pool', fail), \
+                mock.patch.object(self.app_module, '_get_pqc_prober', fail):
+            resp = self.client.post('/api/pqc/encrypt', headers=self.headers,
+                                    json={'public_key': 'cGs=', 'plaintext': 'hi'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json()['kem_ciphertext'], 'a2Vt')
+            self.assertEqual(self.engine.calls, [('encrypt', {'public_key': 'cGs=', 'plaintext': 'hi'})])
+
+            self.assertEqual(self.client.get('/api/pqc/status').get_json()['status'], 'online')
+            status = self.client.get('/api/status').get_json()
+            self.assertEqual((status['pqc_engine'], status['pqc_status']), ('inprocess', 'online'))
+
+    def test_handler_status_codes_pass_through(self):
+        resp = self.client.post('/api/pqc/encrypt', headers=self.headers,
+                                data='not json', content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.get_json(), {'error': 'missing body'})
+
+    def test_body_limit_still_applies(self):
+        resp = self.client.post('/api/pqc/encrypt', headers=self.headers,
+                                json={'plaintext': 'x' * (self.app_module._PQC_MAX_PROXY_BODY + 1)})
+        self.assertEqual(resp.status_code, 413)
+        self.assertEqual(self.engine.calls, [])
+
+    def test_batch_routes_use_batch_body_cap(self):
+        items = [{'plaintext': 'x' * 1024}] * (self.app_module._PQC_MAX_PROXY_BODY // 1024 + 1)
+        resp = self.client.post('/api/pqc/encrypt_batch', headers=self.headers, json={'items': items})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.get_json()['results']), len(items))
+        self.assertEqual(self.engine.calls, [('encrypt_batch', len(items))])
+
+    def test_oversized_proxy_body_is_not_a_sidecar_failure(self):
+        self.app_module._pqc_engine = None
+        prober = PqcHealthProber(lambda: None, interval=60)
+        with mock.patch.object(self.app_module, '_get_pqc_prober', return_value=prober):
+            resp = self.client.post('/api/pqc/encrypt', headers=self.headers,
+                                    json={'plaintext': 'x' * (self.app_module._PQC_MAX_PROXY_BODY + 1)})
+        self.assertEqual(resp.status_code, 413)
+        self.assertEqual(prober.snapshot()['errors'], 0)
+
+    def test_import_failure_falls_back_to_http(self):
+        load = self.app_module._load_pqc_engine
+        self.assertIsNone(load('http'))
+        with mock.patch('importlib.util.find_spec', return_value=None):
+            self.assertIsNone(load('inprocess'))
+        with mock.patch('importlib.util.find_spec', return_value=object()), \
+                mock.patch('importlib.import_module', side_effect=ImportError('no lattice')), \
+                mock.patch.object(sys, 'path', list(sys.path)):
+            self.assertIsNone(load('auto', tempfile.gettempdir()))
+
+    def test_in_process_sessions_must_be_shared_across_workers(self):
+        engine = types.SimpleNamespace(OPERATIONS={}, __file__='handlers.py')
+        for workers, shared in ((4, True), (1, False)):
+            with mock.patch('importlib.util.find_spec', return_value=object()), \
+                    mock.patch('importlib.import_module', return_value=engine), \
+                    mock.patch.object(sys, 'path', list(sys.path)), \
+                    mock.patch.object(self.app_module, 'GUNICORN_WORKERS', workers):
+                self.assertIs(self.app_module._load_pqc_engine('auto', tempfile.gettempdir()), engine)
+            self.assertIs(engine.SESSIONS_REQUIRE_SHARED, shared)
+
+
 if __name__ == '__main__':
     unittest.main()